@@ -0,0 +1,174 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Optional
+
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.memory import InMemorySaver
+
+try:
+    import aiosqlite
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+except ImportError:  # langgraph-checkpoint-sqlite is optional
+    aiosqlite = None
+    AsyncSqliteSaver = None
+
+CHECKPOINT_DB = os.getenv(
+    "CHECKPOINT_DB",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "generated", "checkpoints.sqlite")
+)
+# "sqlite" (durable, the default when available) or "memory"
+CHECKPOINT_BACKEND = os.getenv("CHECKPOINT_BACKEND", "sqlite")
+# A thread with more checkpoints than this is dropped and re-seeded from the session history
+CHECKPOINT_MAX_PER_THREAD = int(os.getenv("CHECKPOINT_MAX_PER_THREAD", "256"))
+# Threads untouched for this long are deleted (0 keeps them forever)
+CHECKPOINT_RETENTION_DAYS = float(os.getenv("CHECKPOINT_RETENTION_DAYS", "30"))
+# How often old threads are purged and the database compacted
+CHECKPOINT_COMPACT_SECONDS = float(os.getenv("CHECKPOINT_COMPACT_SECONDS", "3600"))
+
+
+class CheckpointStore:
+    """
+    Owns the process-wide LangGraph checkpointer, keyed by `thread_id` = session id.
+
+    SQLite runs in WAL mode so turn writes never block reads of other sessions.
+    Messages are stored as deltas reconstructed through the parent chain, so
+    individual checkpoints cannot be dropped without corrupting the thread. Instead,
+    `prune` drops a whole thread once it exceeds `max_per_thread` checkpoints; the
+    next turn re-seeds it from the session history, which already holds every
+    message. `compact` periodically drops abandoned threads and truncates the WAL.
+    Falls back to an in-memory saver when SQLite support is not installed.
+    """
+    def __init__(
+        self,
+        path: str = CHECKPOINT_DB,
+        backend: str = CHECKPOINT_BACKEND,
+        max_per_thread: int = CHECKPOINT_MAX_PER_THREAD,
+        retention_days: float = CHECKPOINT_RETENTION_DAYS,
+        compact_seconds: float = CHECKPOINT_COMPACT_SECONDS,
+    ):
+        self.path = path
+        self.backend = backend if AsyncSqliteSaver is not None else "memory"
+        self.max_per_thread = max(1, max_per_thread)
+        self.retention_days = retention_days
+        self.compact_seconds = compact_seconds
+        self._saver: Optional[BaseCheckpointSaver] = None
+        self._conn = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._last_compact = time.monotonic()
+
+    @property
+    def durable(self) -> bool:
+        return self.backend == "sqlite"
+
+    async def get(self) -> BaseCheckpointSaver:
+        """Returns the checkpointer, opening the database on first use."""
+        loop = asyncio.get_running_loop()
+        if self._saver is not None and self._loop is loop:
+            return self._saver
+        if self._lock is None or self._loop is not loop:
+            # The saver and its connection are bound to the loop that opened them
+            self._lock = asyncio.Lock()
+            self._saver = None
+            self._loop = loop
+        async with self._lock:
+            if self._saver is None:
+                self._saver = await self._open()
+        return self._saver
+
+    async def _open(self) -> BaseCheckpointSaver:
+        if not self.durable:
+            if CHECKPOINT_BACKEND == "sqlite":
+                logging.warning("CheckpointStore: langgraph-checkpoint-sqlite is not installed; sessions will not survive a restart")
+            return InMemorySaver()
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = await aiosqlite.connect(self.path)
+        await self._conn.execute("PRAGMA journal_mode=WAL")
+        await self._conn.execute("PRAGMA synchronous=NORMAL")
+        saver = AsyncSqliteSaver(self._conn)
+        await saver.setup()
+        await self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS thread_activity (thread_id TEXT PRIMARY KEY, updated_at REAL NOT NULL)"
+        )
+        await self._conn.commit()
+        logging.info(f"CheckpointStore: using {self.path}")
+        return saver
+
+    async def has_thread(self, thread_id: str) -> bool:
+        saver = await self.get()
+        return await saver.aget_tuple({"configurable": {"thread_id": thread_id}}) is not None
+
+    async def prune(self, thread_id: str) -> bool:
+        """Drops the thread if it has outgrown `max_per_thread` checkpoints. Returns whether it was dropped."""
+        saver = await self.get()
+        config = {"configurable": {"thread_id": thread_id}}
+        if self.durable:
+            async with saver.lock:
+                async with self._conn.execute("SELECT COUNT(*) FROM checkpoints WHERE thread_id = ?", (thread_id,)) as cursor:
+                    count = (await cursor.fetchone())[0]
+                await self._conn.execute(
+                    "INSERT INTO thread_activity (thread_id, updated_at) VALUES (?, ?) "
+                    "ON CONFLICT(thread_id) DO UPDATE SET updated_at = excluded.updated_at",
+                    (thread_id, time.time()),
+                )
+                await self._conn.commit()
+        else:
+            count = 0
+            async for _ in saver.alist(config, limit=self.max_per_thread + 1):
+                count += 1
+
+        dropped = count > self.max_per_thread
+        if dropped:
+            await saver.adelete_thread(thread_id)
+            logging.info(f"CheckpointStore: dropped {thread_id} at {count} checkpoints; it will be re-seeded from history")
+        if time.monotonic() - self._last_compact >= self.compact_seconds:
+            await self.compact()
+        return dropped
+
+    async def delete_thread(self, thread_id: str):
+        """Deletes every checkpoint of the thread."""
+        saver = await self.get()
+        await saver.adelete_thread(thread_id)
+        if self.durable:
+            async with saver.lock:
+                await self._conn.execute("DELETE FROM thread_activity WHERE thread_id = ?", (thread_id,))
+                await self._conn.commit()
+
+    async def compact(self) -> int:
+        """Deletes threads idle past the retention period and truncates the WAL. Returns threads deleted."""
+        self._last_compact = time.monotonic()
+        saver = await self.get()
+        if not self.durable:
+            return 0
+        stale = []
+        if self.retention_days > 0:
+            cutoff = time.time() - self.retention_days * 86400
+            async with self._conn.execute("SELECT thread_id FROM thread_activity WHERE updated_at < ?", (cutoff,)) as cursor:
+                stale = [row[0] for row in await cursor.fetchall()]
+        for thread_id in stale:
+            await saver.adelete_thread(thread_id)
+        async with saver.lock:
+            if stale:
+                await self._conn.executemany("DELETE FROM thread_activity WHERE thread_id = ?", [(t,) for t in stale])
+                await self._conn.commit()
+            await self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        if stale:
+            logging.info(f"CheckpointStore: deleted {len(stale)} threads idle for over {self.retention_days:g} days")
+        return len(stale)
+
+    async def close(self):
+        if self._conn is not None:
+            try:
+                await self._conn.close()
+            except Exception as e:
+                logging.warning(f"CheckpointStore: error closing database: {e}")
+        self._conn = None
+        self._saver = None
+        self._loop = None
+
+
+# Process-wide checkpoint store
+CHECKPOINT_STORE = CheckpointStore()
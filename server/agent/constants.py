@@ -11,30 +11,32 @@ description: Capability to create interactive React components/apps by writing c
 - Visual representation is the best way to answer.
 
 ## Instructions
-To create a visual component, you must write TWO files to the current directory:
-1. `widget.jsx`: The React component code.
-2. `widget.json`: Metadata (title, width, height).
+A visual component is a `widget.jsx` file (plus any other component files it imports),
+built and shown with ONE call to `build_widget`.
 
 ### Technical Rules
 - Use `lucide-react` for icons.
+- Only `react`, `lucide-react` and `framer-motion` can be imported; put anything else in local files.
 - Use `tailwindcss` for styling.
 - **ALWAYS include a background color** (e.g., `bg-slate-50`, `bg-white`).
 - Use rounded corners (`rounded-xl`) and padding.
 - `widget.jsx` MUST export a default component (`export default function Widget() ...`).
-- **Use the `write` tool** to create files.
 - **CRITICALLY IMPORTANT**: **DO NOT use leading slashes** in file paths.
   - ✅ CORRECT: `widget.jsx`
   - ❌ WRONG: `/widget.jsx` (This will fail with Read-only file system error)
-- `widget.jsx` MUST export a default component (`export default function Widget() ...`).
-- **Use `bundle_project`** to compile disparate files into a single bundle.
 
 ### Workflow
-1. Write `widget.jsx` (and any other component files) using `write`.
-2. check if write succeeded.
-3. Call `bundle_project` to compile everything into `widget.bundled.js`.
-4. Check if bundling succeeded.
-5. Write `widget.json` using `write`.
-6. Call `preview_widget` to show it to the user.
+1. Call `build_widget` with `title`, `width`, `height` and `files` holding every source file,
+   e.g. `{"widget.jsx": "..."}`. It writes the files and `widget.json`, bundles, and shows
+   the preview to the user. Do not write the files separately first.
+2. If it returns `"ok": false`, fix each listed error (`file`, `line`, `column`, `text`,
+   and a `suggestion` when there is a known fix):
+   use `edit` for small fixes, then call `build_widget` again WITHOUT `files`
+   (or pass only the corrected files). Repeat until `"ok": true`.
+3. When `"ok": true`, the user already sees the widget; reply briefly.
+
+`write`, `bundle_project` and `preview_widget` still work for step-by-step changes,
+but `build_widget` does all of them in a single call.
 
 ### layout Best Practices
 - Calendars/Calculators: Use `grid` layout.
@@ -1,7 +1,8 @@
 
 import os
+import mmap
 import logging
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 
 from langchain_core.language_models import BaseChatModel
@@ -9,48 +10,259 @@ from langchain_core.tools import BaseTool
 
 from deepagents import create_deep_agent
 from deepagents.backends.filesystem import FilesystemBackend
+from deepagents.backends.protocol import ReadResult
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.config import get_config
 from langgraph.graph.state import CompiledStateGraph
 
-from .middleware import SkillsMiddleware
+from server.core.aio import run_io
+from server.core.tracing import span
+from server.session.pool import unshare
+
+from .middleware import ContextWindowMiddleware, SkillsMiddleware
+
+# Most text a single read returns; longer windows are cut at a line boundary, with a marker
+FS_READ_MAX_BYTES = int(os.getenv("FS_READ_MAX_BYTES", "65536"))
+# Files from this size on are windowed through mmap rather than read whole
+FS_MMAP_MIN_BYTES = int(os.getenv("FS_MMAP_MIN_BYTES", "1048576"))
+# Bytes scanned per step when counting lines in a mapped file
+_SCAN_CHUNK = 1 << 20
+
+def resolve_workspace_path(config: Optional[dict] = None) -> Optional[Path]:
+    """
+    Returns the session workspace carried in the invocation config.
+    Falls back to the config of the currently running graph when none is passed.
+    """
+    if config is None:
+        try:
+            config = get_config()
+        except RuntimeError:
+            return None
+    workspace_path = config.get("configurable", {}).get("workspace_path")
+    return Path(workspace_path) if workspace_path else None
+
+def _count_lines(mm: "mmap.mmap", start: int) -> int:
+    """Lines from byte `start` to the end, counting a last line without a newline."""
+    size = len(mm)
+    count = 0
+    for pos in range(start, size, _SCAN_CHUNK):
+        count += mm[pos:min(pos + _SCAN_CHUNK, size)].count(b"\n")
+    if size > start and mm[size - 1:size] != b"\n":
+        count += 1
+    return count
+
+
+def _read_lines_mmap(path: Path, offset: int, limit: int) -> Optional[ReadResult]:
+    """
+    A window of `limit` lines from `offset`, located by scanning newlines in the mapped
+    file so only the window is decoded. None for binary files, which the base class
+    returns whole.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if b"\0" in mm[:8192]:
+            return None
+        size = len(mm)
+        start = 0
+        for line in range(offset):
+            newline = mm.find(b"\n", start)
+            if newline < 0 or newline + 1 >= size:
+                total = line + 1
+                return ReadResult(error=f"Line offset {offset} exceeds file length ({total} lines)")
+            start = newline + 1
+
+        end, lines = start, 0
+        # Stops early once the window is over the return cap; the rest would be cut anyway
+        while lines < limit and end < size and end - start <= FS_READ_MAX_BYTES:
+            newline = mm.find(b"\n", end)
+            end = size if newline < 0 else newline + 1
+            lines += 1
+        content = mm[start:end].decode("utf-8", errors="replace")
+        total = offset + lines + _count_lines(mm, end)
+
+    content = content.replace("\r\n", "\n").replace("\r", "\n")
+    end_line = offset + lines
+    return ReadResult(
+        file_data={"content": content, "encoding": "utf-8"},
+        total_lines=total,
+        start_line=offset + 1,
+        end_line=end_line,
+        next_offset=end_line if end_line < total else None,
+    )
+
+
+def _cap_read(result: ReadResult, size: Optional[int], max_bytes: int) -> ReadResult:
+    """
+    Cuts a text window longer than `max_bytes` after its last whole line (or inside a
+    single overlong line) and appends a marker with the sizes and where to resume.
+    """
+    data = result.file_data
+    if result.error or not data or data.get("encoding") != "utf-8" or result.start_line is None:
+        return result
+    encoded = data["content"].encode("utf-8")
+    if len(encoded) <= max_bytes:
+        return result
+
+    kept = encoded[:max_bytes].decode("utf-8", errors="ignore")
+    newline = kept.rfind("\n")
+    partial = newline < 0
+    if not partial:
+        kept = kept[:newline + 1]
+    end_line = result.start_line + max(0, kept.count("\n") - 1) if not partial else result.start_line
+    file_size = f"{size} bytes" if size is not None else "unknown size"
+    resume = f"offset={end_line}" if end_line < (result.total_lines or 0) else "no further lines"
+    hint = f"; the rest of line {end_line} needs read_range" if partial else ""
+    marker = (
+        f"\n[truncated at the {max_bytes}-byte read limit (file is {file_size}, "
+        f"{result.total_lines} lines); continue with {resume}{hint}]"
+    )
+    return ReadResult(
+        # A blank line separates the marker from the source lines
+        file_data={"content": (kept[:-1] if kept.endswith("\n") else kept) + "\n" + marker, "encoding": "utf-8"},
+        total_lines=result.total_lines,
+        start_line=result.start_line,
+        end_line=end_line,
+        next_offset=end_line if end_line < (result.total_lines or 0) else None,
+    )
 
-# Setup Logging
-log_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent_debug.log")
-logging.basicConfig(filename=log_path, level=logging.DEBUG, format='%(asctime)s %(message)s')
 
 class SafeFilesystemBackend(FilesystemBackend):
     """
     A wrapper around FilesystemBackend that strictly enforces relative paths
     to prevent escaping the sandbox (root_dir).
+
+    The root is resolved per call from the `workspace_path` in the invocation config,
+    so a single backend (and a single compiled agent) can serve every session.
+    `root_dir` is only used outside of a run.
     """
+    @property
+    def cwd(self) -> Path:
+        workspace_path = resolve_workspace_path()
+        if workspace_path is not None:
+            return workspace_path.resolve()
+        return self._default_root
+
+    @cwd.setter
+    def cwd(self, value: Path):
+        self._default_root = value
+
     def write(self, file_path: str, content: str, *args, **kwargs):
         # Strip leading slashes to ensure path is relative to root_dir
         safe_path = file_path.lstrip("/")
         logging.debug(f"SafeFilesystemBackend: writing to {safe_path} (orig: {file_path})")
         # Swallow extra args to avoid "unexpected argument" in base class
-        return super().write(safe_path, content)
-        
-    # Also override read just in case
-    def read(self, file_path: str, *args, **kwargs):
+        with span("fs.write", cat="fs", path=safe_path, bytes=len(content)):
+            self._unshare(safe_path, keep_content=False)
+            return super().write(safe_path, content)
+
+    def edit(self, file_path: str, *args, **kwargs):
+        self._unshare(file_path)
+        return super().edit(file_path, *args, **kwargs)
+
+    def _unshare(self, file_path: str, keep_content: bool = True):
+        # Pooled workspaces start out as hardlinks to a shared template; in-place writes
+        # must not reach the other copies
+        try:
+            unshare(self._resolve_path(file_path), keep_content)
+        except (OSError, ValueError):
+            pass
+
+    def read(self, file_path: str, offset: int = 0, limit: int = 2000, *args, **kwargs):
+        """
+        Reads a window of `limit` lines from `offset`. Files of FS_MMAP_MIN_BYTES and more
+        are windowed through mmap instead of being read whole, and the text returned is
+        capped at FS_READ_MAX_BYTES.
+        """
+        safe_path = file_path.lstrip("/")
+        with span("fs.read", cat="fs", path=safe_path, offset=offset, limit=limit):
+            try:
+                resolved = self._resolve_path(safe_path)
+                size = resolved.stat().st_size if resolved.is_file() else None
+            except (OSError, RuntimeError, ValueError):
+                resolved, size = None, None
+
+            result = None
+            if size and size >= FS_MMAP_MIN_BYTES and limit > 0:
+                try:
+                    result = _read_lines_mmap(resolved, max(0, offset), limit)
+                except (OSError, ValueError) as e:
+                    return ReadResult(error=f"Error reading file '{file_path}': {e}")
+            if result is None:
+                result = super().read(safe_path, offset, limit)
+            return _cap_read(result, size, FS_READ_MAX_BYTES)
+
+    def read_bytes(self, file_path: str, start: int = 0, length: int = FS_READ_MAX_BYTES) -> Dict[str, object]:
+        """
+        Reads `length` bytes from byte `start`, capped at FS_READ_MAX_BYTES; large files are
+        sliced through mmap. Returns the text (undecodable bytes replaced) with the file
+        size and the range actually read. Raises ValueError for paths outside the root.
+        """
         safe_path = file_path.lstrip("/")
-        # Swallow extra args
-        return super().read(safe_path)
+        root = self.cwd.resolve()
+        target = (root / safe_path).resolve()
+        if not target.is_relative_to(root):
+            raise ValueError(f"'{file_path}' is outside the workspace.")
+        length = max(0, min(length, FS_READ_MAX_BYTES))
+        with span("fs.read_bytes", cat="fs", path=safe_path, start=start, length=length):
+            with open(target, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                start = max(0, min(start, size))
+                if size and size >= FS_MMAP_MIN_BYTES:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        data = mm[start:start + length]
+                else:
+                    f.seek(start)
+                    data = f.read(length)
+        end = start + len(data)
+        return {
+            "path": safe_path,
+            "size": size,
+            "start": start,
+            "end": end,
+            "truncated": end < size,
+            "content": data.decode("utf-8", errors="replace"),
+        }
+
+    # The agent's tools run on the event loop; their file access goes to the bounded I/O pool
+    # (the base class would use the default executor)
+    async def aread(self, file_path: str, offset: int = 0, limit: int = 2000):
+        return await run_io(self.read, file_path, offset, limit)
+
+    async def awrite(self, file_path: str, content: str):
+        return await run_io(self.write, file_path, content)
+
+    async def aedit(self, file_path: str, old_string: str, new_string: str, replace_all: bool = False):
+        return await run_io(self.edit, file_path, old_string, new_string, replace_all)
+
+    async def als(self, path: str):
+        return await run_io(self.ls, path)
+
+    async def aglob(self, pattern: str, path: Optional[str] = None):
+        return await run_io(self.glob, pattern, path)
+
+    async def agrep(self, pattern: str, path: Optional[str] = None, glob: Optional[str] = None, **kwargs):
+        return await run_io(self.grep, pattern, path, glob, **kwargs)
 
 def create_skilled_deep_agent(
     model: BaseChatModel,
-    root_dir: Path,
+    root_dir: Optional[Path] = None,
     skills_registry_path: Optional[str] = None,
     tools: Optional[List[BaseTool]] = None,
     system_prompt: str = "",
-    name: str = "DeepAgent"
+    name: str = "DeepAgent",
+    checkpointer: Optional[BaseCheckpointSaver] = None
 ) -> CompiledStateGraph:
     """
     Creates a Deep Agent equipped with Skills via Middleware and Filesystem Backend.
+    The workspace is taken from `configurable.workspace_path` at invocation time;
+    `root_dir` is only the fallback root. With a `checkpointer`, conversation state
+    is kept per `configurable.thread_id`.
     """
     
     # 1. Setup Backend (Safe Filesystem)
     backend = SafeFilesystemBackend(root_dir=root_dir)
     
-    # 2. Setup Middleware
+    # 2. Setup Middleware (windowing runs first so skills are inserted into the final window)
+    context_middleware = ContextWindowMiddleware()
     skills_middleware = SkillsMiddleware(skills_registry_path)
             
     # 3. Create Agent using Library
@@ -59,9 +271,47 @@ def create_skilled_deep_agent(
         backend=backend,
         tools=tools, 
         system_prompt=system_prompt, # Passed prompt + middleware prompt
-        middleware=[skills_middleware]
+        middleware=[context_middleware, skills_middleware],
+        checkpointer=checkpointer
     )
     
     logging.info(f"Created Skilled DeepAgent via library with skills from {skills_registry_path}")
     
     return agent
+
+
+# Compiled agents shared by every session, keyed by model and agent setup
+_AGENT_TEMPLATES: Dict[Tuple, CompiledStateGraph] = {}
+
+def get_agent_template(
+    model: BaseChatModel,
+    model_key: str,
+    skills_registry_path: Optional[str] = None,
+    tools: Optional[List[BaseTool]] = None,
+    system_prompt: str = "",
+    name: str = "DeepAgent",
+    checkpointer: Optional[BaseCheckpointSaver] = None
+) -> CompiledStateGraph:
+    """
+    Returns the shared, precompiled agent for this model and setup, compiling it on first use.
+    Sessions pass their workspace in the invocation config instead of getting their own graph.
+
+    The graph holds on to the model and checkpointer it was compiled with, so a new model
+    instance (the registry's clients were closed and recreated) or a reopened checkpointer
+    gets a new graph, and the graphs of the replaced ones are dropped.
+    """
+    key = (model_key, id(model), skills_registry_path, tuple(t.name for t in tools or []), system_prompt, name, id(checkpointer))
+    agent = _AGENT_TEMPLATES.get(key)
+    if agent is None:
+        for stale in [k for k in _AGENT_TEMPLATES if k[0] == model_key and (k[1], k[-1]) != (key[1], key[-1])]:
+            del _AGENT_TEMPLATES[stale]
+        agent = create_skilled_deep_agent(
+            model=model,
+            skills_registry_path=skills_registry_path,
+            tools=tools,
+            system_prompt=system_prompt,
+            name=name,
+            checkpointer=checkpointer
+        )
+        _AGENT_TEMPLATES[key] = agent
+    return agent
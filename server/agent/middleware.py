@@ -1,104 +1,221 @@
+import os
 import logging
-import yaml
-from dataclasses import dataclass
-from typing import Optional, List, Dict, Any
-from pathlib import Path
-
-from langchain_core.messages import SystemMessage
-from langchain.agents.middleware.types import AgentMiddleware
-
-@dataclass
-class SkillMetadata:
-    name: str 
-    description: str
-    registry: str = "unknown"
-    path: str = ""
-    instructions: str = ""
-
-def load_skill_from_path(skill_path: Path, registry_name: str = "user") -> Optional[SkillMetadata]:
-    """
-    Parses a SKILL.md file. 
-    Expects YAML frontmatter + Markdown content.
-    """
-    if not skill_path.exists():
-        logging.warning(f"Skill path not found: {skill_path}")
-        return None
-        
-    try:
-        with open(skill_path, "r") as f:
-            content = f.read()
-            
-        # Basic Frontmatter parsing
-        if content.startswith("---"):
-            parts = content.split("---", 2)
-            if len(parts) >= 3:
-                frontmatter_yaml = parts[1]
-                markdown_body = parts[2].strip()
-                
-                meta = yaml.safe_load(frontmatter_yaml)
-                
-                return SkillMetadata(
-                    name=meta.get("name", skill_path.parent.name),
-                    description=meta.get("description", ""),
-                    registry=registry_name,
-                    path=str(skill_path),
-                    instructions=markdown_body
-                )
-    except Exception as e:
-        logging.error(f"Error loading skill at {skill_path}: {e}")
-    
-    return None
+from typing import Optional, Dict, Any, Awaitable, Callable, List
+
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.tools import tool
+from langchain.agents.middleware.types import AgentMiddleware, ModelRequest, ModelResponse
+
+from server.core.tracing import span
+
+from .skills import SKILL_REGISTRY, SKILLS_TOP_K, SkillMetadata, load_skill_from_path
+
+# Estimated prompt tokens allowed for the conversation before old turns are elided
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "48000"))
+# The most recent turns are always sent verbatim
+CONTEXT_KEEP_TURNS = int(os.getenv("CONTEXT_KEEP_TURNS", "4"))
+# Tool outputs longer than this are cut down in turns outside the kept window
+CONTEXT_TOOL_OUTPUT_CHARS = int(os.getenv("CONTEXT_TOOL_OUTPUT_CHARS", "2000"))
+# Old turns are dropped in blocks, so the window start (and the cached prompt prefix) moves rarely
+CONTEXT_DROP_BLOCK = int(os.getenv("CONTEXT_DROP_BLOCK", "4"))
 
 def load_skills_instructions(registry_path: str, registry_name: str = "user") -> str:
-    """Loads all skills from a registry and returns the combined system prompt instructions."""
-    skills_text = ""
-    base_path = Path(registry_path)
-    if not base_path.exists():
-        return ""
-        
-    # Iterate over subdirectories looking for SKILL.md
-    found_skills = []
-    for item in base_path.iterdir():
-        if item.is_dir():
-            skill_md = item / "SKILL.md"
-            if skill_md.exists():
-                skill = load_skill_from_path(skill_md, registry_name)
-                if skill:
-                    found_skills.append(skill)
-    
-    if found_skills:
-        skills_text += "\n\n## AGENT SKILLS"
-        for skill in found_skills:
-            skills_text += f"\n\n### {skill.name}\n{skill.description}\n\n{skill.instructions}"
-            
-    logging.info(f"Loaded {len(found_skills)} skills from {registry_path}")
-    return skills_text
+    """Returns the combined system prompt instructions for a registry, parsed once per process."""
+    return SKILL_REGISTRY.instructions(registry_path, registry_name)
+
+def _extend_system_message(system_message: Optional[SystemMessage], text: str) -> SystemMessage:
+    if system_message is None:
+        return SystemMessage(content=text.lstrip())
+    if isinstance(system_message.content, str):
+        return SystemMessage(content=system_message.content + text)
+    return SystemMessage(content=list(system_message.content) + [{"type": "text", "text": text}])
 
 class SkillsMiddleware(AgentMiddleware):
     """
-    Middleware that loads skills from a registry and injects them into the agent's system prompt
-    at the start of execution.
+    Middleware that adds a registry's skills to every model call. The instructions come
+    pre-rendered from the shared SKILL_REGISTRY, so edits to a SKILL.md are picked up
+    without rebuilding the agent.
+
+    The prompt is laid out so providers can reuse their prompt/KV cache across turns:
+    the skill catalog, which only changes when skills change, is appended to the system
+    prompt, ahead of the tool schemas and the history. The `top_k` skills relevant to a
+    turn are selected once, before its first model call, and written to the thread right
+    after the user message, so every later request repeats them unchanged and the
+    previous turns stay a byte-stable prefix.
+    """
+    def __init__(self, registry_path: Optional[str], top_k: int = SKILLS_TOP_K):
+        self.registry_path = registry_path
+        self.top_k = top_k
+        self.tools = [self._make_load_skill_tool()] if registry_path else []
+
+    @property
+    def instructions(self) -> str:
+        if not self.registry_path:
+            return ""
+        return SKILL_REGISTRY.instructions(self.registry_path)
+
+    def _make_load_skill_tool(self):
+        registry_path = self.registry_path
+
+        @tool
+        def load_skill(name: str) -> str:
+            """
+            Load the full instructions of a skill listed in the SKILL CATALOG.
+
+            Args:
+                name: Name of the skill, exactly as listed.
+            """
+            skill = SKILL_REGISTRY.get(registry_path, name)
+            if skill is None:
+                available = ", ".join(s.name for s in SKILL_REGISTRY.skills(registry_path))
+                return f"Unknown skill '{name}'. Available skills: {available}"
+            return f"### {skill.name}\n{skill.description}\n\n{skill.instructions}"
+
+        return load_skill
+
+    def relevant_skills(self, messages: List[AnyMessage]) -> Optional[SystemMessage]:
+        """
+        The skills relevant to a user message that has just arrived. None once the turn is
+        under way (the last message is no longer the user's), so they are added only once.
+        """
+        if not self.registry_path or not messages or not isinstance(messages[-1], HumanMessage):
+            return None
+        relevant = SKILL_REGISTRY.select(self.registry_path, messages[-1].text, self.top_k)
+        return SystemMessage(content=relevant.lstrip()) if relevant else None
+
+    def before_model(self, state: Dict[str, Any], runtime: Any) -> Optional[Dict[str, Any]]:
+        message = self.relevant_skills(state["messages"])
+        return {"messages": [message]} if message is not None else None
+
+    async def abefore_model(self, state: Dict[str, Any], runtime: Any) -> Optional[Dict[str, Any]]:
+        if self.registry_path:
+            await SKILL_REGISTRY.arefresh(self.registry_path)
+        return self.before_model(state, runtime)
+
+    def apply(self, request: ModelRequest) -> ModelRequest:
+        """Returns the request with the skill catalog appended to the system prompt."""
+        if not self.registry_path:
+            return request
+        catalog = SKILL_REGISTRY.catalog(self.registry_path, self.top_k)
+        if not catalog:
+            return request
+        return request.override(system_message=_extend_system_message(request.system_message, catalog))
+
+    def wrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], ModelResponse],
+    ) -> ModelResponse:
+        with span("SkillsMiddleware", cat="middleware"):
+            request = self.apply(request)
+        return handler(request)
+
+    async def awrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], Awaitable[ModelResponse]],
+    ) -> ModelResponse:
+        with span("SkillsMiddleware", cat="middleware"):
+            if self.registry_path:
+                await SKILL_REGISTRY.arefresh(self.registry_path)
+            request = self.apply(request)
+        return await handler(request)
+
+
+def estimate_tokens(message: AnyMessage) -> int:
+    """Rough token count (~4 characters per token), good enough for budgeting."""
+    content = message.content
+    chars = len(content) if isinstance(content, str) else len(str(content))
+    if isinstance(message, AIMessage) and message.tool_calls:
+        chars += len(str(message.tool_calls))
+    return chars // 4 + 4
+
+def split_turns(messages: List[AnyMessage]) -> List[List[AnyMessage]]:
+    """Groups messages into turns, each starting at a user message, so tool calls stay with their results."""
+    turns: List[List[AnyMessage]] = []
+    for message in messages:
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+def _elide_tool_output(message: AnyMessage, max_chars: int) -> AnyMessage:
+    if not isinstance(message, ToolMessage) or not isinstance(message.content, str) or len(message.content) <= max_chars:
+        return message
+    elided = len(message.content) - max_chars
+    return message.model_copy(update={"content": f"{message.content[:max_chars]}\n[... {elided} characters of tool output elided ...]"})
+
+def _summarize_turns(turns: List[List[AnyMessage]]) -> SystemMessage:
+    requests = []
+    for turn in turns:
+        if isinstance(turn[0], HumanMessage):
+            text = turn[0].text.strip().replace("\n", " ")
+            requests.append(f"- {text[:200]}{'...' if len(text) > 200 else ''}")
+    summary = "\n".join(requests) or "- (no user requests)"
+    return SystemMessage(content=f"[{len(turns)} earlier turns were elided to fit the context window. The user had asked:]\n{summary}")
+
+class ContextWindowMiddleware(AgentMiddleware):
+    """
+    Keeps the conversation sent to the model within a token budget.
+
+    Within budget, the request is left untouched. Over budget, large tool outputs are
+    cut down outside the most recent `keep_turns` turns; if that is not enough, the
+    oldest turns are replaced by a short note listing what the user asked in them.
+    Turns are dropped in blocks of `drop_block`, so the start of the window changes
+    rarely and the provider's prompt cache stays usable. The agent state always keeps
+    the full conversation; only the model request is windowed.
     """
-    def __init__(self, registry_path: Optional[str]):
-        self.instructions = ""
-        if registry_path:
-            self.instructions = load_skills_instructions(registry_path)
-        
-    def before_agent(self, state: Dict[str, Any]) -> Dict[str, Any]:
-        """Injects skills instructions into the messages list."""
-        if not self.instructions:
-            return state
-            
-        messages = state.get("messages", [])
-        if not messages:
-            messages = []
-            
-        # Create SystemMessage
-        skill_msg = SystemMessage(content=self.instructions)
-        
-        # We append to ensure it's present. 
-        # Ideally, we'd merge with existing system prompt, but appending works for most models.
-        messages = list(messages) + [skill_msg]
-        
-        state["messages"] = messages
-        return state
+    def __init__(
+        self,
+        token_budget: int = CONTEXT_TOKEN_BUDGET,
+        keep_turns: int = CONTEXT_KEEP_TURNS,
+        tool_output_chars: int = CONTEXT_TOOL_OUTPUT_CHARS,
+        drop_block: int = CONTEXT_DROP_BLOCK,
+    ):
+        self.token_budget = token_budget
+        self.keep_turns = max(1, keep_turns)
+        self.tool_output_chars = tool_output_chars
+        self.drop_block = max(1, drop_block)
+        self.tools = []
+
+    def window(self, messages: List[AnyMessage]) -> List[AnyMessage]:
+        if self.token_budget <= 0 or sum(estimate_tokens(m) for m in messages) <= self.token_budget:
+            return messages
+
+        turns = split_turns(messages)
+        recent = turns[-self.keep_turns:]
+        older = [[_elide_tool_output(m, self.tool_output_chars) for m in turn] for turn in turns[:-self.keep_turns]]
+        costs = [sum(estimate_tokens(m) for m in turn) for turn in older + recent]
+        total = sum(costs)
+
+        dropped = 0
+        while total > self.token_budget and dropped < len(older):
+            total -= costs[dropped]
+            dropped += 1
+        if dropped:
+            # Round up to a whole block, without eating into the kept turns
+            dropped = min(len(older), -(-dropped // self.drop_block) * self.drop_block)
+            logging.debug(f"ContextWindowMiddleware: eliding {dropped} of {len(turns)} turns")
+
+        windowed = [_summarize_turns(older[:dropped])] if dropped else []
+        for turn in older[dropped:] + recent:
+            windowed.extend(turn)
+        return windowed
+
+    def wrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], ModelResponse],
+    ) -> ModelResponse:
+        with span("ContextWindowMiddleware", cat="middleware"):
+            messages = self.window(request.messages)
+        return handler(request if messages is request.messages else request.override(messages=messages))
+
+    async def awrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], Awaitable[ModelResponse]],
+    ) -> ModelResponse:
+        with span("ContextWindowMiddleware", cat="middleware"):
+            messages = self.window(request.messages)
+        return await handler(request if messages is request.messages else request.override(messages=messages))
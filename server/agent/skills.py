@@ -0,0 +1,258 @@
+import os
+import re
+import math
+import time
+import logging
+import threading
+import yaml
+from dataclasses import dataclass, field
+from pathlib import Path
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from server.core.aio import run_io
+
+# How often a registry directory is re-checked for added, removed or edited skills
+SKILLS_RELOAD_SECONDS = float(os.getenv("SKILLS_RELOAD_SECONDS", "2"))
+# Number of skills injected in full per turn; the rest are only listed in the catalog
+SKILLS_TOP_K = int(os.getenv("SKILLS_TOP_K", "3"))
+
+@dataclass
+class SkillMetadata:
+    name: str
+    description: str
+    registry: str = "unknown"
+    path: str = ""
+    instructions: str = ""
+
+def load_skill_from_path(skill_path: Path, registry_name: str = "user") -> Optional[SkillMetadata]:
+    """
+    Parses a SKILL.md file.
+    Expects YAML frontmatter + Markdown content.
+    """
+    if not skill_path.exists():
+        logging.warning(f"Skill path not found: {skill_path}")
+        return None
+
+    try:
+        with open(skill_path, "r") as f:
+            content = f.read()
+
+        # Basic Frontmatter parsing
+        if content.startswith("---"):
+            parts = content.split("---", 2)
+            if len(parts) >= 3:
+                frontmatter_yaml = parts[1]
+                markdown_body = parts[2].strip()
+
+                meta = yaml.safe_load(frontmatter_yaml)
+
+                return SkillMetadata(
+                    name=meta.get("name", skill_path.parent.name),
+                    description=meta.get("description", ""),
+                    registry=registry_name,
+                    path=str(skill_path),
+                    instructions=markdown_body
+                )
+    except Exception as e:
+        logging.error(f"Error loading skill at {skill_path}: {e}")
+
+    return None
+
+def render_skills(skills: List[SkillMetadata]) -> str:
+    """Renders skills as the instruction block injected into the agent's prompt."""
+    if not skills:
+        return ""
+    skills_text = "\n\n## AGENT SKILLS"
+    for skill in skills:
+        skills_text += f"\n\n### {skill.name}\n{skill.description}\n\n{skill.instructions}"
+    return skills_text
+
+def render_catalog(skills: List[SkillMetadata]) -> str:
+    """One line per skill; the agent reads full instructions with `load_skill`."""
+    if not skills:
+        return ""
+    lines = "\n".join(f"- {skill.name}: {skill.description}" for skill in skills)
+    return f"\n\n## SKILL CATALOG\nCall `load_skill` with a name to read a skill's full instructions, unless they are already provided below.\n{lines}"
+
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_RE.findall(text.lower()) if len(t) > 1]
+
+
+class SkillIndex:
+    """
+    BM25 index over skill name, description and body, built once per registry reload.
+    Name and description terms are weighted up since they summarize the skill.
+    """
+    K1 = 1.5
+    B = 0.75
+    FIELD_WEIGHT = 3
+
+    def __init__(self, skills: List[SkillMetadata]):
+        self.skills = skills
+        self._terms: List[Counter] = []
+        self._lengths: List[int] = []
+        df: Counter = Counter()
+        for skill in skills:
+            tokens = tokenize(f"{skill.name} {skill.description}") * self.FIELD_WEIGHT + tokenize(skill.instructions)
+            terms = Counter(tokens)
+            self._terms.append(terms)
+            self._lengths.append(len(tokens))
+            df.update(terms.keys())
+        n = len(skills)
+        self._avg_length = (sum(self._lengths) / n) if n else 0.0
+        self._idf = {term: math.log(1 + (n - f + 0.5) / (f + 0.5)) for term, f in df.items()}
+
+    def search(self, query: str, k: int) -> List[SkillMetadata]:
+        """The `k` best matching skills, best first; skills sharing no terms with the query are left out."""
+        query_terms = set(tokenize(query))
+        scored = []
+        for i, terms in enumerate(self._terms):
+            norm = self.K1 * (1 - self.B + self.B * self._lengths[i] / (self._avg_length or 1))
+            score = 0.0
+            for term in query_terms:
+                tf = terms.get(term)
+                if tf:
+                    score += self._idf[term] * tf * (self.K1 + 1) / (tf + norm)
+            if score > 0:
+                scored.append((score, i))
+        scored.sort(key=lambda x: (-x[0], x[1]))
+        return [self.skills[i] for _, i in scored[:k]]
+
+
+# (mtime_ns, size) of a SKILL.md
+Fingerprint = Tuple[int, int]
+
+@dataclass
+class _RegistryState:
+    checked_at: Optional[float] = None
+    files: Dict[Path, Fingerprint] = field(default_factory=dict)
+    skills: List[SkillMetadata] = field(default_factory=list)
+    rendered: str = ""
+    catalog: str = ""
+    index: SkillIndex = field(default_factory=lambda: SkillIndex([]))
+
+
+class SkillRegistry:
+    """
+    Process-wide cache of parsed skills, shared by every session.
+
+    Each SKILL.md is parsed once and kept until its mtime or size changes. The rendered
+    instruction block and the retrieval index are rebuilt only when a registry's skills
+    change, and directories are re-scanned at most every `reload_seconds`, so the hot
+    path is a dict lookup.
+    """
+    def __init__(self, reload_seconds: float = SKILLS_RELOAD_SECONDS):
+        self.reload_seconds = reload_seconds
+        self._states: Dict[Tuple[str, str], _RegistryState] = {}
+        self._parsed: Dict[Path, Tuple[Fingerprint, Optional[SkillMetadata]]] = {}
+        self._lock = threading.Lock()
+
+    def skills(self, registry_path: str, registry_name: str = "user") -> List[SkillMetadata]:
+        return self._state(registry_path, registry_name).skills
+
+    def instructions(self, registry_path: str, registry_name: str = "user") -> str:
+        """The pre-rendered instruction block for a registry."""
+        return self._state(registry_path, registry_name).rendered
+
+    def get(self, registry_path: str, name: str, registry_name: str = "user") -> Optional[SkillMetadata]:
+        for skill in self.skills(registry_path, registry_name):
+            if skill.name == name:
+                return skill
+        return None
+
+    def catalog(self, registry_path: str, top_k: int = SKILLS_TOP_K, registry_name: str = "user") -> str:
+        """
+        The part of the skills prompt that only changes when skills change, so it can sit in
+        the cacheable prompt prefix: every skill in full when there are no more than `top_k`,
+        otherwise a one-line catalog entry per skill.
+        """
+        state = self._state(registry_path, registry_name)
+        if len(state.skills) <= top_k:
+            return state.rendered
+        return state.catalog
+
+    def select(self, registry_path: str, query: str, top_k: int = SKILLS_TOP_K, registry_name: str = "user") -> str:
+        """
+        Full instructions of the `top_k` skills most relevant to `query`, so the prompt stays
+        bounded as skills are added. Empty when `catalog` already holds every skill in full.
+        """
+        state = self._state(registry_path, registry_name)
+        if len(state.skills) <= top_k:
+            return ""
+        return render_skills(state.index.search(query, top_k))
+
+    def is_fresh(self, registry_path: str, registry_name: str = "user") -> bool:
+        """Whether the registry was scanned within `reload_seconds`, so reading it touches no files."""
+        with self._lock:
+            state = self._states.get((str(registry_path), registry_name))
+            return (state is not None and state.checked_at is not None
+                    and time.monotonic() - state.checked_at < self.reload_seconds)
+
+    async def arefresh(self, registry_path: str, registry_name: str = "user"):
+        """Re-scans a registry on the I/O pool when it is due, so reads on the event loop stay in memory."""
+        if not self.is_fresh(registry_path, registry_name):
+            await run_io(self._state, str(registry_path), registry_name)
+
+    def invalidate(self):
+        """Forces a re-scan on next access."""
+        with self._lock:
+            for state in self._states.values():
+                state.checked_at = None
+
+    def _state(self, registry_path: str, registry_name: str) -> _RegistryState:
+        key = (str(registry_path), registry_name)
+        now = time.monotonic()
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                state = self._states[key] = _RegistryState()
+            elif state.checked_at is not None and now - state.checked_at < self.reload_seconds:
+                return state
+            state.checked_at = now
+            files = self._scan(Path(registry_path))
+            if files != state.files:
+                self._reload(state, files, registry_path, registry_name)
+            return state
+
+    @staticmethod
+    def _scan(base_path: Path) -> Dict[Path, Fingerprint]:
+        files = {}
+        if not base_path.is_dir():
+            return files
+        # Iterate over subdirectories looking for SKILL.md
+        for item in sorted(base_path.iterdir()):
+            skill_md = item / "SKILL.md"
+            try:
+                st = skill_md.stat()
+            except OSError:
+                continue
+            files[skill_md] = (st.st_mtime_ns, st.st_size)
+        return files
+
+    def _reload(self, state: _RegistryState, files: Dict[Path, Fingerprint], registry_path: str, registry_name: str):
+        skills = []
+        for skill_md, fingerprint in files.items():
+            cached = self._parsed.get(skill_md)
+            if cached is None or cached[0] != fingerprint:
+                cached = (fingerprint, load_skill_from_path(skill_md, registry_name))
+                self._parsed[skill_md] = cached
+            if cached[1]:
+                skills.append(cached[1])
+        # Forget skills that were removed from disk
+        for skill_md in set(state.files) - set(files):
+            self._parsed.pop(skill_md, None)
+
+        state.files = files
+        state.skills = skills
+        state.rendered = render_skills(skills)
+        state.catalog = render_catalog(skills)
+        state.index = SkillIndex(skills)
+        logging.info(f"SkillRegistry: loaded {len(skills)} skills from {registry_path}")
+
+
+# Process-wide skill registry
+SKILL_REGISTRY = SkillRegistry()
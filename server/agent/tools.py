@@ -1,11 +1,30 @@
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
 
+from server.bundle.esbuild import OUTPUT_FILE
+from server.bundle.service import bundle_workspace
+from server.chat.preview import preview_manifest
+from server.core.aio import replace_text, run_io, write_text
+from server.session.store import broadcast_event
+
+from .factory import SafeFilesystemBackend, resolve_workspace_path
+
+# Written by the build itself; sources with these names would be overwritten
+RESERVED_FILES = {OUTPUT_FILE, "index.html", "widget.json"}
+
+# Resolves paths against the session workspace of the running graph
+_FILES = SafeFilesystemBackend()
+
 @tool
 async def preview_widget(title: str, width: int = 2, height: int = 2) -> str:
     """
     Notify that the widget files have been created and are ready for preview.
     Call this AFTER you have written 'widget.jsx' (and optionally bundled it) and 'widget.json'.
-    
+
     Args:
         title: Title of the widget.
         width: Width in grid units (1-4).
@@ -14,3 +33,111 @@ async def preview_widget(title: str, width: int = 2, height: int = 2) -> str:
     # Simply return success. The actual file reading happens in the event loop hook
     # where we check for widget.bundled.js or widget.jsx
     return "Success: Preview triggered."
+
+@tool
+async def bundle_project(config: RunnableConfig) -> str:
+    """
+    Bundle the current project (widget.jsx) into a single file (widget.bundled.js).
+    Call this BEFORE preview_widget if you have multiple files or dependencies.
+    """
+    # The session workspace comes from the invocation config, so one tool serves all sessions
+    workspace_path = resolve_workspace_path(config)
+    if workspace_path is None:
+        return "Bundling error: no workspace for this session."
+
+    try:
+        result = await bundle_workspace(workspace_path)
+    except Exception as e:
+        return f"Bundling error: {str(e)}"
+
+    cache_status = "cache hit" if result.cache_hit else "cache miss"
+    if not result.ok:
+        return f"Bundling failed ({cache_status}): {result.error}"
+    return f"Bundling successful ({cache_status}): widget.bundled.js and index.html created."
+
+
+def _write_files(workspace_path: Path, files: Dict[str, str]) -> List[str]:
+    """Writes sources into the workspace, refusing paths that leave it. Returns the paths written."""
+    root = workspace_path.resolve()
+    targets = []
+    for name, content in files.items():
+        target = (root / name.lstrip("/")).resolve()
+        if not target.is_relative_to(root) or target == root:
+            raise ValueError(f"'{name}' is outside the workspace.")
+        # Normalized, so "./widget.json" or "x/../index.html" are caught as well
+        rel = target.relative_to(root).as_posix()
+        if rel in RESERVED_FILES:
+            raise ValueError(f"'{name}' is generated by build_widget; pass title/width/height instead.")
+        targets.append((rel, target, content))
+    for rel, target, content in targets:
+        replace_text(str(target), content)
+    return [rel for rel, _, _ in targets]
+
+@tool
+async def build_widget(
+    title: str,
+    config: RunnableConfig,
+    files: Optional[Dict[str, str]] = None,
+    width: int = 2,
+    height: int = 2,
+) -> str:
+    """
+    Write, bundle and preview a widget in ONE call: writes the source files and widget.json,
+    bundles widget.jsx, writes index.html and shows the preview to the user.
+    Returns JSON: {"ok": true/false, "written": [...], "errors": [{"file", "line", "column", "text", "suggestion"}]}.
+    On errors, fix the listed files (with `edit`, or by passing them again) and call build_widget again.
+
+    Args:
+        title: Title of the widget.
+        files: Source files keyed by relative path, e.g. {"widget.jsx": "..."}. Must include
+            widget.jsx unless it is already written. Omit to rebuild the files already in the workspace.
+        width: Width in grid units (1-4).
+        height: Height in grid units (1-4).
+    """
+    workspace_path = resolve_workspace_path(config)
+    if workspace_path is None:
+        return json.dumps({"ok": False, "written": [], "errors": [{"text": "No workspace for this session."}]})
+
+    meta = {"title": title, "width": max(1, min(4, width)), "height": max(1, min(4, height))}
+    try:
+        written = await run_io(_write_files, workspace_path, files or {})
+        await write_text(workspace_path / "widget.json", json.dumps(meta, indent=2))
+    except (OSError, ValueError) as e:
+        return json.dumps({"ok": False, "written": [], "errors": [{"text": str(e)}]})
+
+    try:
+        result = await bundle_workspace(workspace_path)
+    except Exception as e:
+        return json.dumps({"ok": False, "written": written, "errors": [{"text": f"Bundling error: {e}"}]})
+
+    report: Dict[str, Any] = {"ok": result.ok, "written": written, "cache_hit": result.cache_hit}
+    if not result.ok:
+        report["errors"] = result.messages or [{"text": result.error}]
+        return json.dumps(report)
+
+    session_id = config.get("configurable", {}).get("session_id")
+    manifest = await run_io(preview_manifest, workspace_path)
+    if session_id:
+        await broadcast_event(session_id, "preview", manifest)
+    report["preview"] = manifest["url"]
+    return json.dumps(report)
+
+@tool
+async def read_range(file_path: str, config: RunnableConfig, start: int = 0, length: int = 16384) -> str:
+    """
+    Read a byte range of a file, for files (or single lines, like a minified bundle) too
+    long for `read_file`. Returns JSON: {"path", "size", "start", "end", "truncated", "content"};
+    `size` is the file size in bytes, and when `truncated` is true, continue from `end`.
+
+    Args:
+        file_path: Path of the file in the workspace.
+        start: First byte to read (0-based).
+        length: Bytes to read; capped by the server.
+    """
+    if resolve_workspace_path(config) is None:
+        return json.dumps({"error": "No workspace for this session."})
+    try:
+        result = await run_io(_FILES.read_bytes, file_path, start, length)
+    except (OSError, ValueError) as e:
+        return json.dumps({"error": f"Error reading '{file_path}': {e}"})
+    return json.dumps(result)
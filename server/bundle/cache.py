@@ -0,0 +1,182 @@
+import os
+import re
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+from server.core.aio import replace_bytes
+
+# Cached bundles live next to the generated workspaces
+BUNDLE_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "generated", "bundle_cache")
+BUNDLE_CACHE_MAX_BYTES = int(os.getenv("BUNDLE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Static, re-export, side-effect and dynamic import specifiers
+IMPORT_RE = re.compile(
+    r"""(?:import|export)\s[^'"]*?\bfrom\s*['"]([^'"]+)['"]"""
+    r"""|\bimport\s*['"]([^'"]+)['"]"""
+    r"""|\bimport\s*\(\s*['"]([^'"]+)['"]\s*\)"""
+)
+RESOLVE_EXTENSIONS = ["", ".jsx", ".js", ".tsx", ".ts", ".json", ".css"]
+
+
+def _resolve_specifier(importer: Path, specifier: str) -> Optional[Path]:
+    """Resolves a relative import the way esbuild does for our loaders."""
+    base = (importer.parent / specifier)
+    for ext in RESOLVE_EXTENSIONS:
+        candidate = Path(str(base) + ext)
+        if candidate.is_file():
+            return candidate
+    if base.is_dir():
+        for ext in RESOLVE_EXTENSIONS[1:]:
+            candidate = base / f"index{ext}"
+            if candidate.is_file():
+                return candidate
+    return None
+
+
+def resolve_local_imports(entry: Path) -> List[Path]:
+    """
+    Returns the entry file and every local file it transitively imports.
+    Bare specifiers (packages) are left to esbuild and are not part of the result.
+    """
+    seen = {entry.resolve()}
+    ordered = [entry.resolve()]
+    pending = [entry.resolve()]
+    while pending:
+        current = pending.pop()
+        try:
+            source = current.read_text(errors="replace")
+        except OSError:
+            continue
+        for match in IMPORT_RE.finditer(source):
+            specifier = next(group for group in match.groups() if group)
+            if not specifier.startswith("."):
+                continue
+            resolved = _resolve_specifier(current, specifier)
+            if resolved is None:
+                continue
+            resolved = resolved.resolve()
+            if resolved not in seen:
+                seen.add(resolved)
+                ordered.append(resolved)
+                pending.append(resolved)
+    return ordered
+
+
+def bundle_cache_key(entry: Path, flags: Iterable[str]) -> str:
+    """
+    Content address of a bundle: the esbuild flags plus the path and contents of
+    the entry file and each of its resolved local imports.
+    """
+    entry = entry.resolve()
+    root = entry.parent
+    digest = hashlib.sha256()
+    for flag in flags:
+        digest.update(flag.encode())
+        digest.update(b"\0")
+    for path in sorted(resolve_local_imports(entry)):
+        try:
+            rel = path.relative_to(root).as_posix()
+        except ValueError:
+            rel = path.as_posix()
+        digest.update(rel.encode())
+        digest.update(b"\0")
+        digest.update(hashlib.sha256(path.read_bytes()).digest())
+    return digest.hexdigest()
+
+
+class BundleCache:
+    """
+    Size-bounded, content-addressed store of bundle outputs.
+    Entries are plain files; their mtime doubles as the LRU timestamp. Called from
+    several I/O threads at once, so the size accounting is done under a lock.
+    """
+    def __init__(self, cache_dir: str = BUNDLE_CACHE_DIR, max_bytes: int = BUNDLE_CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self._total_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.js"
+
+    def restore(self, key: str, dest: Path) -> bool:
+        """Copies a cached bundle to `dest`. Returns False on a miss."""
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)  # Mark as recently used
+            replace_bytes(str(dest), data)
+        except OSError as e:
+            if not isinstance(e, FileNotFoundError):
+                logging.warning(f"BundleCache: could not restore {key}: {e}")
+            return False
+        return True
+
+    def put(self, key: str, src: Path):
+        """
+        Stores a freshly built bundle, evicting least recently used entries past the cap.
+        Best effort: a failure is logged and leaves the build itself untouched.
+        """
+        try:
+            data = src.read_bytes()
+        except OSError as e:
+            logging.warning(f"BundleCache: could not read {src}: {e}")
+            return
+        if len(data) > self.max_bytes:
+            return
+
+        path = self._path(key)
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            with self._lock:
+                total = self._current_total()
+                previous = path.stat().st_size if path.exists() else 0
+                replace_bytes(str(path), data)
+                self._total_bytes = total + len(data) - previous
+                if self._total_bytes > self.max_bytes:
+                    self._evict()
+        except OSError as e:
+            logging.warning(f"BundleCache: could not store {key}: {e}")
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._current_total()
+
+    def _current_total(self) -> int:
+        if self._total_bytes is None:
+            self._total_bytes = sum(size for _, size, _ in self._entries())
+        return self._total_bytes
+
+    def _entries(self):
+        if not self.cache_dir.exists():
+            return []
+        entries = []
+        for path in self.cache_dir.glob("*.js"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _evict(self):
+        # Called with the lock held
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except OSError:
+                pass
+        self._total_bytes = total
+
+
+# Process-wide bundle cache
+BUNDLE_CACHE = BundleCache()
@@ -0,0 +1,200 @@
+import os
+import re
+import hashlib
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from server.bundle.cache import IMPORT_RE, _resolve_specifier, resolve_local_imports
+from server.bundle.esbuild import ENTRY_FILE, EXTERNALS
+from server.core.aio import read_text, run_io
+
+# Per-file results kept, keyed by file name and content hash
+DIAGNOSTICS_CACHE_SIZE = int(os.getenv("DIAGNOSTICS_CACHE_SIZE", "512"))
+
+# Packages the preview page provides; everything else has to be local
+ALLOWED_IMPORTS = set(EXTERNALS)
+
+# Syntax-checks one file, returning esbuild messages, or None when it cannot check
+Transform = Callable[[str, str], Awaitable[Optional[List[Dict[str, Any]]]]]
+
+DEFAULT_EXPORT_RE = re.compile(r"^\s*export\s+default\b|\bas\s+default\b", re.M)
+
+# Fixes for common esbuild errors, matched on the message text
+SYNTAX_HINTS = [
+    ("Unexpected end of file", "A brace, parenthesis, JSX tag or string is not closed."),
+    ("Expected closing", "Close the JSX tag (or make it self-closing: <Tag />)."),
+    ("Unterminated string", "Close the string literal on the same line, or use a template literal."),
+    ("Unterminated regular expression", "A `/` in JSX text starts a regex; wrap the text in {'...'}."),
+    ("The character \"}\" is not valid inside a JSX element", "Use {'}'} for a literal brace in JSX text."),
+    ("The character \">\" is not valid inside a JSX element", "Use {'>'} or &gt; for a literal > in JSX text."),
+    ("Adjacent JSX elements must be wrapped", "Wrap sibling elements in a fragment: <>...</>."),
+    ("Expected \"}\" but found", "Check for a missing or extra brace before this point."),
+    ("Expected \")\" but found", "Check for a missing or extra parenthesis before this point."),
+    ("Multiple exports with the same name \"default\"", "Keep a single `export default`."),
+]
+
+# Packages models often reach for, and what to use instead
+IMPORT_HINTS = {
+    "react-dom": "Do not render the widget yourself; the preview mounts the default export.",
+    "react-icons": "Use icons from `lucide-react` instead.",
+    "@heroicons/react": "Use icons from `lucide-react` instead.",
+    "@mui/icons-material": "Use icons from `lucide-react` instead.",
+    "clsx": "Build class names with a template string instead.",
+    "classnames": "Build class names with a template string instead.",
+}
+
+
+def _position(text: str, offset: int) -> Dict[str, int]:
+    # esbuild style: 1-based line, 0-based column
+    line = text.count("\n", 0, offset) + 1
+    return {"line": line, "column": offset - (text.rfind("\n", 0, offset) + 1)}
+
+
+def _diagnostic(file: str, text: str, suggestion: Optional[str] = None, line: Optional[int] = None, column: Optional[int] = None) -> Dict[str, Any]:
+    diagnostic: Dict[str, Any] = {"file": file, "line": line, "column": column, "text": text}
+    if suggestion:
+        diagnostic["suggestion"] = suggestion
+    return diagnostic
+
+
+def syntax_hint(text: str) -> Optional[str]:
+    for fragment, hint in SYNTAX_HINTS:
+        if fragment in text:
+            return hint
+    return None
+
+
+def import_hint(specifier: str) -> str:
+    package = specifier.split("/")[0] if not specifier.startswith("@") else "/".join(specifier.split("/")[:2])
+    hint = IMPORT_HINTS.get(package)
+    if hint is None and package.startswith("react-dom"):
+        hint = IMPORT_HINTS["react-dom"]
+    allowed = ", ".join(f"`{name}`" for name in sorted(ALLOWED_IMPORTS))
+    return hint or f"Only {allowed} can be imported; write the code yourself in a local file."
+
+
+def check_imports(file: str, source: str) -> List[Dict[str, Any]]:
+    """Package imports the preview page cannot provide."""
+    diagnostics = []
+    for match in IMPORT_RE.finditer(source):
+        group = next(i for i, g in enumerate(match.groups(), 1) if g)
+        specifier = match.group(group)
+        if specifier.startswith(".") or specifier in ALLOWED_IMPORTS:
+            continue
+        diagnostics.append(_diagnostic(
+            file, f'Cannot import "{specifier}": it is not available in the preview.',
+            import_hint(specifier), **_position(source, match.start(group)),
+        ))
+    return diagnostics
+
+
+def check_default_export(file: str, source: str) -> List[Dict[str, Any]]:
+    """The entry file must default-export the component the preview mounts."""
+    if DEFAULT_EXPORT_RE.search(source):
+        return []
+    named = source.find("export function Widget")
+    if named >= 0:
+        return [_diagnostic(file, "Widget is exported by name, not as the default export.",
+                            "Use `export default function Widget() { ... }`.", **_position(source, named))]
+    return [_diagnostic(file, f"{file} has no default export.",
+                        "Add `export default function Widget() { ... }`.", line=1, column=0)]
+
+
+def unresolved_imports(path: Path, source: str) -> List[Tuple[str, int]]:
+    """Relative imports of `path` that match no file, with their offsets in `source`."""
+    missing = []
+    for match in IMPORT_RE.finditer(source):
+        group = next(i for i, g in enumerate(match.groups(), 1) if g)
+        specifier = match.group(group)
+        if specifier.startswith(".") and _resolve_specifier(path, specifier) is None:
+            missing.append((specifier, match.start(group)))
+    return missing
+
+
+class DiagnosticsCache:
+    """LRU of per-file results; unchanged files are not checked again."""
+    def __init__(self, max_entries: int = DIAGNOSTICS_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+
+    @staticmethod
+    def key(file: str, source: str) -> str:
+        return hashlib.sha256(f"{file}\0{source}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, diagnostics: List[Dict[str, Any]]):
+        self._entries[key] = diagnostics
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+async def check_file(file: str, source: str, is_entry: bool, transform: Optional[Transform]) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Diagnostics for one file, and whether its syntax was checked; unchecked results
+    are not cached.
+    """
+    errors = await transform(source, file) if transform is not None else None
+    if errors:
+        # The other checks read the source with regexes; broken syntax first
+        return [
+            _diagnostic(e.get("file") or file, e.get("text", ""), syntax_hint(e.get("text", "")), e.get("line"), e.get("column"))
+            for e in errors
+        ], True
+    diagnostics = check_imports(file, source)
+    if is_entry:
+        diagnostics += check_default_export(file, source)
+    return diagnostics, errors is not None
+
+
+async def check_workspace(workspace_path: Path, transform: Optional[Transform] = None, cache: Optional["DiagnosticsCache"] = None) -> List[Dict[str, Any]]:
+    """
+    Fast checks run before bundling: JSX syntax (when `transform` is given), the default
+    export of the entry file, package imports and unresolved local imports. Returns
+    structured errors with file, line, column, text and, where known, a suggested fix.
+    """
+    cache = DIAGNOSTICS_CACHE if cache is None else cache
+    entry = workspace_path / ENTRY_FILE
+    if not await run_io(entry.is_file):
+        return [_diagnostic(ENTRY_FILE, f"{ENTRY_FILE} not found in the workspace.", f"Write {ENTRY_FILE} first.")]
+
+    root = entry.resolve().parent
+    diagnostics = []
+    for path in await run_io(resolve_local_imports, entry):
+        try:
+            source = await read_text(path, errors="replace")
+        except OSError as e:
+            logging.debug(f"diagnostics: could not read {path}: {e}")
+            continue
+        if source is None:
+            continue
+        file = path.relative_to(root).as_posix() if path.is_relative_to(root) else path.name
+        key = cache.key(file, source)
+        result = cache.get(key)
+        if result is None:
+            result, checked = await check_file(file, source, path == entry.resolve(), transform)
+            if checked:
+                cache.put(key, result)
+        diagnostics.extend(result)
+        # Depends on which other files exist, so checked every time
+        for specifier, offset in await run_io(unresolved_imports, path, source):
+            diagnostics.append(_diagnostic(
+                file, f'Could not resolve "{specifier}".',
+                "Create the file (with `files` in build_widget, or `write`) or fix the path.",
+                **_position(source, offset),
+            ))
+    return diagnostics
+
+
+# Process-wide cache of per-file diagnostics
+DIAGNOSTICS_CACHE = DiagnosticsCache()
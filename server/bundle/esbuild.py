@@ -0,0 +1,106 @@
+import os
+import re
+import asyncio
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List
+
+from server.agent.constants import PREVIEW_HTML_TEMPLATE
+from server.core.aio import replace_text
+
+# Assume ESBuild path is relative to root
+ESBUILD_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "node_modules", ".bin", "esbuild")
+
+ENTRY_FILE = "widget.jsx"
+OUTPUT_FILE = "widget.bundled.js"
+EXTERNALS = ["react", "react/jsx-runtime", "lucide-react", "framer-motion"]
+
+# Build options in esbuild JS API form, shared by the worker service and the CLI fallback
+BUILD_OPTIONS = {
+    "entryPoints": [ENTRY_FILE],
+    "outfile": OUTPUT_FILE,
+    "bundle": True,
+    "format": "esm",
+    "jsx": "automatic",
+    "loader": {".js": "jsx", ".jsx": "jsx"},
+    "external": EXTERNALS,
+}
+ESBUILD_FLAGS = [
+    "--bundle",
+    f"--format={BUILD_OPTIONS['format']}",
+    f"--jsx={BUILD_OPTIONS['jsx']}",
+] + [f"--loader:{ext}={loader}" for ext, loader in BUILD_OPTIONS["loader"].items()] \
+  + [f"--external:{name}" for name in EXTERNALS]
+
+
+@dataclass
+class BundleResult:
+    ok: bool
+    cache_hit: bool = False
+    error: str = ""
+    duration_ms: float = 0.0
+    # Build errors as {text, file, line, column, lineText} dicts, when esbuild reported any
+    messages: List[Dict[str, Any]] = field(default_factory=list)
+
+
+# The `file:line:column:` line the CLI prints under each `✘ [ERROR] text`
+_LOCATION_RE = re.compile(r"^\s+(\S+?):(\d+):(\d+):\s*$", re.M)
+
+
+def parse_cli_errors(stderr: str) -> List[Dict[str, Any]]:
+    """Build errors from esbuild CLI output, in the same shape as the worker's messages."""
+    messages = []
+    for block in stderr.split("[ERROR]")[1:]:
+        text, _, rest = block.strip().partition("\n")
+        message: Dict[str, Any] = {"text": text.strip()}
+        location = _LOCATION_RE.search(rest.split("[WARNING]")[0])
+        if location:
+            message.update(file=location.group(1), line=int(location.group(2)), column=int(location.group(3)))
+        messages.append(message)
+    return messages
+
+
+def cache_flags() -> list:
+    """Flags plus the esbuild binary identity, so upgrading esbuild invalidates the cache."""
+    try:
+        binary = f"{os.path.realpath(ESBUILD_PATH)}:{os.stat(ESBUILD_PATH).st_mtime_ns}"
+    except OSError:
+        binary = ESBUILD_PATH
+    return [binary, ENTRY_FILE] + ESBUILD_FLAGS
+
+
+def write_preview_html(workspace_path: Path):
+    """Writes index.html from the template, skipping the write if it is already current."""
+    index_path = workspace_path / "index.html"
+    try:
+        if index_path.read_text() == PREVIEW_HTML_TEMPLATE:
+            return
+    except OSError:
+        pass
+    # Replaced rather than rewritten in place, in case it is hardlinked to a pooled template
+    replace_text(str(index_path), PREVIEW_HTML_TEMPLATE)
+
+
+async def run_esbuild(workspace_path: Path) -> BundleResult:
+    """Bundles ENTRY_FILE into OUTPUT_FILE with a one-off esbuild CLI process."""
+    process = await asyncio.create_subprocess_exec(
+        ESBUILD_PATH,
+        ENTRY_FILE,
+        f"--outfile={OUTPUT_FILE}",
+        *ESBUILD_FLAGS,
+        cwd=str(workspace_path),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        # Cancelled run or timeout: don't leave the process building for nobody
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    if process.returncode != 0:
+        error = stderr.decode()
+        return BundleResult(ok=False, error=error, messages=parse_cli_errors(error))
+    return BundleResult(ok=True)
@@ -0,0 +1,134 @@
+// Long-lived esbuild worker managed by server/bundle/service.py.
+//
+// Reads one JSON request per line on stdin and writes one JSON response per line
+// on stdout. Keeps an incremental build context per workspace so rebuilds only
+// re-parse what changed.
+//
+// Requests:
+//   {"id": 1, "op": "build", "workspace": "/abs/dir", "options": {...}}
+//   {"id": 2, "op": "cancel", "workspace": "/abs/dir"}
+//   {"id": 3, "op": "dispose", "workspace": "/abs/dir"}
+//   {"id": 4, "op": "transform", "code": "...", "options": {...}}
+// Responses:
+//   {"id": 1, "ok": true, "errors": [], "warnings": [...]}
+import * as esbuild from 'esbuild';
+import { createInterface } from 'node:readline';
+
+const MAX_CONTEXTS = Number(process.argv[2] || 32);
+
+// workspace -> { ctx, key }; Map iteration order doubles as LRU order
+const contexts = new Map();
+// workspace -> tail of its request chain, so builds of one workspace never overlap
+const chains = new Map();
+
+function toMessage(m) {
+    return {
+        text: m.text,
+        file: m.location ? m.location.file : null,
+        line: m.location ? m.location.line : null,
+        column: m.location ? m.location.column : null,
+        lineText: m.location ? m.location.lineText : null,
+    };
+}
+
+async function dispose(workspace) {
+    const entry = contexts.get(workspace);
+    if (!entry) return;
+    contexts.delete(workspace);
+    await entry.ctx.dispose();
+}
+
+async function getContext(workspace, options) {
+    const key = JSON.stringify(options);
+    const existing = contexts.get(workspace);
+    if (existing && existing.key === key) {
+        contexts.delete(workspace);
+        contexts.set(workspace, existing);
+        return existing.ctx;
+    }
+    if (existing) await dispose(workspace);
+
+    while (contexts.size >= MAX_CONTEXTS) {
+        await dispose(contexts.keys().next().value);
+    }
+    const ctx = await esbuild.context({ ...options, absWorkingDir: workspace, logLevel: 'silent' });
+    contexts.set(workspace, { ctx, key });
+    return ctx;
+}
+
+function serialize(workspace, fn) {
+    const run = (chains.get(workspace) || Promise.resolve()).then(fn);
+    const tail = run.catch(() => {});
+    chains.set(workspace, tail);
+    tail.then(() => {
+        if (chains.get(workspace) === tail) chains.delete(workspace);
+    });
+    return run;
+}
+
+async function handle(req) {
+    switch (req.op) {
+        case 'build': {
+            const ctx = await getContext(req.workspace, req.options);
+            try {
+                const result = await ctx.rebuild();
+                return { ok: true, errors: [], warnings: result.warnings.map(toMessage) };
+            } catch (e) {
+                if (Array.isArray(e.errors)) {
+                    return { ok: false, errors: e.errors.map(toMessage), warnings: (e.warnings || []).map(toMessage) };
+                }
+                throw e;
+            }
+        }
+        case 'cancel': {
+            const entry = contexts.get(req.workspace);
+            if (entry) await entry.ctx.cancel();
+            return { ok: true };
+        }
+        case 'dispose':
+            await dispose(req.workspace);
+            return { ok: true };
+        case 'transform': {
+            // Syntax check of one file; nothing is written
+            try {
+                const result = await esbuild.transform(req.code, { ...req.options, logLevel: 'silent' });
+                return { ok: true, errors: [], warnings: result.warnings.map(toMessage) };
+            } catch (e) {
+                if (Array.isArray(e.errors)) {
+                    return { ok: false, errors: e.errors.map(toMessage), warnings: (e.warnings || []).map(toMessage) };
+                }
+                throw e;
+            }
+        }
+        default:
+            return { ok: false, errors: [{ text: `Unknown op: ${req.op}` }] };
+    }
+}
+
+function send(response) {
+    process.stdout.write(JSON.stringify(response) + '\n');
+}
+
+const rl = createInterface({ input: process.stdin });
+rl.on('line', (line) => {
+    if (!line.trim()) return;
+    let req;
+    try {
+        req = JSON.parse(line);
+    } catch (e) {
+        send({ id: null, ok: false, errors: [{ text: `Invalid request: ${e.message}` }] });
+        return;
+    }
+    // Workspaces build concurrently; the Python side bounds how many are in flight.
+    // Cancel skips the queue so it can interrupt the build in progress; transforms are stateless.
+    const pending = req.op === 'cancel' || req.op === 'transform' ? handle(req) : serialize(req.workspace, () => handle(req));
+    pending.then(
+        (res) => send({ id: req.id, ...res }),
+        // `internal` tells a failure of the worker itself apart from errors in the sources
+        (e) => send({ id: req.id, ok: false, internal: true, errors: [{ text: String(e && e.message ? e.message : e) }] }),
+    );
+});
+rl.on('close', async () => {
+    for (const workspace of [...contexts.keys()]) await dispose(workspace);
+    process.exit(0);
+});
@@ -0,0 +1,361 @@
+import os
+import json
+import time
+import zlib
+import shutil
+import asyncio
+import logging
+import functools
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+
+from server.bundle.cache import BUNDLE_CACHE, bundle_cache_key
+from server.bundle.diagnostics import check_workspace
+from server.core.aio import run_io
+from server.core.metrics import BUNDLE_DURATION, METRICS
+from server.core.tracing import record_span, span
+from server.bundle.esbuild import (
+    BUILD_OPTIONS,
+    ENTRY_FILE,
+    OUTPUT_FILE,
+    BundleResult,
+    cache_flags,
+    run_esbuild,
+    write_preview_html,
+)
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "esbuild_worker.mjs")
+# The worker imports the `esbuild` JS package installed next to the esbuild binary
+ESBUILD_PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "node_modules", "esbuild")
+NODE_BINARY = os.getenv("NODE_BINARY") or shutil.which("node")
+
+ESBUILD_WORKERS = int(os.getenv("ESBUILD_WORKERS", str(min(4, os.cpu_count() or 1))))
+ESBUILD_MAX_CONCURRENCY = int(os.getenv("ESBUILD_MAX_CONCURRENCY", str(ESBUILD_WORKERS * 2)))
+ESBUILD_MAX_QUEUE = int(os.getenv("ESBUILD_MAX_QUEUE", "64"))
+ESBUILD_MAX_CONTEXTS = int(os.getenv("ESBUILD_MAX_CONTEXTS", "32"))
+ESBUILD_TIMEOUT = float(os.getenv("ESBUILD_TIMEOUT", "30"))
+
+
+class EsbuildWorkerError(Exception):
+    """Raised when a worker process dies or cannot be started."""
+
+
+def format_messages(messages: List[Dict[str, Any]]) -> str:
+    """Renders worker messages in the same `file:line:column: ERROR: text` shape as the CLI."""
+    lines = []
+    for m in messages:
+        if m.get("file"):
+            lines.append(f"{m['file']}:{m.get('line')}:{m.get('column')}: ERROR: {m.get('text')}")
+            if m.get("lineText"):
+                lines.append(f"    {m['lineText']}")
+        else:
+            lines.append(f"ERROR: {m.get('text')}")
+        if m.get("suggestion"):
+            lines.append(f"    fix: {m['suggestion']}")
+    return "\n".join(lines)
+
+
+class EsbuildWorker:
+    """
+    One long-lived node process running esbuild_worker.mjs.
+    Requests are JSON lines matched to responses by id. Each process has its own table
+    of pending requests, so the exit of a crashed process only fails requests sent to it.
+    """
+    def __init__(self, index: int):
+        self.index = index
+        self.restarts = 0
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._reader: Optional[asyncio.Task] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._next_id = 0
+        self._start_lock = asyncio.Lock()
+        self._stopping = False
+
+    @property
+    def alive(self) -> bool:
+        return self._process is not None and self._process.returncode is None
+
+    async def ensure_started(self):
+        async with self._start_lock:
+            if self.alive:
+                return
+            if self._process is not None:
+                self.restarts += 1
+                logging.warning(f"EsbuildWorker {self.index}: restarting (restart #{self.restarts})")
+            try:
+                self._process = await asyncio.create_subprocess_exec(
+                    NODE_BINARY,
+                    WORKER_SCRIPT,
+                    str(ESBUILD_MAX_CONTEXTS),
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    limit=16 * 1024 * 1024,
+                )
+            except OSError as e:
+                raise EsbuildWorkerError(f"Could not start esbuild worker: {e}") from e
+            self._pending = {}
+            self._reader = asyncio.create_task(self._read_loop(self._process, self._pending))
+
+    async def request(self, op: str, **payload) -> Dict[str, Any]:
+        await self.ensure_started()
+        self._next_id += 1
+        request_id = self._next_id
+        future = asyncio.get_running_loop().create_future()
+        pending = self._pending
+        pending[request_id] = future
+        try:
+            line = json.dumps({"id": request_id, "op": op, **payload}) + "\n"
+            self._process.stdin.write(line.encode())
+            await self._process.stdin.drain()
+            return await future
+        except (BrokenPipeError, ConnectionResetError) as e:
+            raise EsbuildWorkerError(f"esbuild worker {self.index} is not accepting requests: {e}") from e
+        finally:
+            pending.pop(request_id, None)
+
+    @staticmethod
+    async def _read_stderr(process: asyncio.subprocess.Process) -> str:
+        # Drained as it is written, so a chatty worker never blocks on a full pipe;
+        # only the tail is kept for the exit report
+        tail = b""
+        while True:
+            chunk = await process.stderr.read(64 * 1024)
+            if not chunk:
+                return tail.decode(errors="replace")
+            tail = (tail + chunk)[-2000:]
+
+    async def _read_loop(self, process: asyncio.subprocess.Process, pending: Dict[int, asyncio.Future]):
+        stderr_reader = asyncio.create_task(self._read_stderr(process))
+        try:
+            while True:
+                line = await process.stdout.readline()
+                if not line:
+                    break
+                try:
+                    response = json.loads(line)
+                except ValueError:
+                    logging.warning(f"EsbuildWorker {self.index}: unparseable output {line[:200]!r}")
+                    continue
+                future = pending.get(response.get("id"))
+                if future and not future.done():
+                    future.set_result(response)
+
+            # The process exited: fail everything still waiting so callers can retry
+            stderr = ""
+            try:
+                stderr = await asyncio.wait_for(asyncio.shield(stderr_reader), timeout=1)
+            except asyncio.TimeoutError:
+                pass
+            await process.wait()
+        finally:
+            stderr_reader.cancel()
+        if not self._stopping:
+            logging.error(f"EsbuildWorker {self.index}: exited with {process.returncode}: {stderr}")
+        for future in list(pending.values()):
+            if not future.done():
+                future.set_exception(EsbuildWorkerError(f"esbuild worker {self.index} exited with {process.returncode}"))
+
+    async def stop(self):
+        if self._process is None:
+            return
+        self._stopping = True
+        if self.alive:
+            self._process.stdin.close()
+            try:
+                await asyncio.wait_for(self._process.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                self._process.kill()
+                await self._process.wait()
+        if self._reader:
+            await asyncio.gather(self._reader, return_exceptions=True)
+        self._process = None
+        self._stopping = False
+
+
+class EsbuildService:
+    """
+    Server-managed pool of esbuild workers with bounded concurrency and queueing.
+
+    Each workspace is pinned to one worker, where it keeps an incremental build
+    context, so rebuilds only redo what changed. Crashed workers are restarted on
+    their next request. Without node or the esbuild JS package, builds fall back
+    to one-off CLI processes under the same concurrency bound.
+    """
+    def __init__(
+        self,
+        workers: int = ESBUILD_WORKERS,
+        max_concurrency: int = ESBUILD_MAX_CONCURRENCY,
+        max_queue: int = ESBUILD_MAX_QUEUE,
+        timeout: float = ESBUILD_TIMEOUT,
+    ):
+        self.workers = [EsbuildWorker(i) for i in range(max(1, workers))]
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self._waiting = 0
+        self._cancels: Set[asyncio.Task] = set()
+
+    @property
+    def available(self) -> bool:
+        return bool(NODE_BINARY) and os.path.isdir(ESBUILD_PACKAGE_DIR)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._waiting
+
+    def _worker_for(self, workspace: str) -> EsbuildWorker:
+        return self.workers[zlib.crc32(workspace.encode()) % len(self.workers)]
+
+    async def start(self):
+        """Spawns the workers ahead of the first build."""
+        if not self.available:
+            logging.info("EsbuildService: node or the esbuild package is missing; using the CLI")
+            return
+        await asyncio.gather(*(w.ensure_started() for w in self.workers), return_exceptions=True)
+
+    @asynccontextmanager
+    async def _slot(self) -> AsyncIterator[bool]:
+        """
+        Holds one of the `max_concurrency` slots shared by builds and transforms. Yields
+        False, without waiting, when `max_queue` requests are already waiting for one.
+        """
+        if self._waiting >= self.max_queue:
+            yield False
+            return
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        try:
+            yield True
+        finally:
+            self._semaphore.release()
+
+    async def build(self, workspace_path: Path) -> BundleResult:
+        async with self._slot() as admitted:
+            if not admitted:
+                return BundleResult(ok=False, error="Bundler is busy, too many builds queued. Try again shortly.")
+            try:
+                if not self.available:
+                    return await asyncio.wait_for(run_esbuild(workspace_path), timeout=self.timeout)
+                return await self._build_with_worker(str(workspace_path.resolve()))
+            except asyncio.TimeoutError:
+                return BundleResult(ok=False, error=f"Bundling timed out after {self.timeout:.0f}s.")
+
+    async def _build_with_worker(self, workspace: str) -> BundleResult:
+        worker = self._worker_for(workspace)
+        # One retry covers a worker that crashed before or during this build
+        for attempt in range(2):
+            try:
+                response = await asyncio.wait_for(
+                    worker.request("build", workspace=workspace, options=BUILD_OPTIONS),
+                    timeout=self.timeout
+                )
+            except (asyncio.CancelledError, asyncio.TimeoutError):
+                # The caller gave up on this build; stop the worker spending CPU on it
+                self._cancel_build(worker, workspace)
+                raise
+            except EsbuildWorkerError as e:
+                if attempt == 1:
+                    return BundleResult(ok=False, error=str(e))
+                continue
+            if not response.get("ok"):
+                errors = response.get("errors", [])
+                return BundleResult(ok=False, error=format_messages(errors), messages=errors)
+            return BundleResult(ok=True)
+        return BundleResult(ok=False, error="esbuild worker unavailable.")
+
+    async def transform(self, code: str, sourcefile: str, workspace: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        Syntax-checks one source file with esbuild's transform API. Returns its errors,
+        or None when no worker is available to check it or the bundler is saturated.
+        Runs on the worker that builds `workspace`, and counts against the build limits.
+        """
+        if not self.available:
+            return None
+        worker = self._worker_for(workspace or sourcefile)
+        options = {"loader": "jsx", "jsx": BUILD_OPTIONS["jsx"], "sourcefile": sourcefile}
+        async with self._slot() as admitted:
+            if not admitted:
+                logging.warning(f"EsbuildService: transform check of {sourcefile} skipped: too many requests queued")
+                return None
+            try:
+                response = await asyncio.wait_for(worker.request("transform", code=code, options=options), timeout=self.timeout)
+            except (asyncio.TimeoutError, EsbuildWorkerError) as e:
+                logging.warning(f"EsbuildService: transform check of {sourcefile} skipped: {e}")
+                return None
+        if response.get("internal"):
+            logging.warning(f"EsbuildService: transform check of {sourcefile} failed: {format_messages(response.get('errors', []))}")
+            return None
+        return response.get("errors", [])
+
+    def _cancel_build(self, worker: EsbuildWorker, workspace: str):
+        if not worker.alive:
+            return
+        task = asyncio.create_task(worker.request("cancel", workspace=workspace))
+        self._cancels.add(task)
+        task.add_done_callback(self._cancels.discard)
+        # Retrieve the outcome so a dead worker doesn't log "exception never retrieved"
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def dispose(self, workspace_path: Path):
+        """Drops the incremental context held for a workspace."""
+        workspace = str(workspace_path.resolve())
+        worker = self._worker_for(workspace)
+        if worker.alive:
+            try:
+                await worker.request("dispose", workspace=workspace)
+            except EsbuildWorkerError:
+                pass
+
+    async def close(self):
+        await asyncio.gather(*(w.stop() for w in self.workers), return_exceptions=True)
+
+
+# Process-wide esbuild service
+ESBUILD_SERVICE = EsbuildService()
+
+METRICS.gauge("esbuild_queue_depth", "Builds waiting for an esbuild slot.", collect=lambda: ESBUILD_SERVICE.queue_depth)
+
+
+async def bundle_workspace(workspace_path: Path) -> BundleResult:
+    """
+    Bundles a session workspace, serving unchanged sources from the content-addressed cache.
+    Writes index.html next to the bundle on success. File access runs on the I/O pool.
+    """
+    start = time.perf_counter()
+    entry = workspace_path / ENTRY_FILE
+    if not await run_io(entry.exists):
+        return BundleResult(ok=False, error=f"{ENTRY_FILE} not found in the workspace.")
+
+    # Cheap checks first: most failed builds are caught here with a suggested fix
+    with span("bundle.check", cat="bundle"):
+        # Checked on the worker that builds this workspace, like the build itself
+        transform = functools.partial(ESBUILD_SERVICE.transform, workspace=str(workspace_path.resolve()))
+        diagnostics = await check_workspace(workspace_path, transform)
+    if diagnostics:
+        result = BundleResult(ok=False, error=format_messages(diagnostics), messages=diagnostics)
+        mode = "check"
+    else:
+        key = await run_io(bundle_cache_key, entry, cache_flags())
+        if await run_io(BUNDLE_CACHE.restore, key, workspace_path / OUTPUT_FILE):
+            result = BundleResult(ok=True, cache_hit=True)
+            mode = "cache"
+        else:
+            mode = "worker" if ESBUILD_SERVICE.available else "cli"
+            with span("esbuild.build", cat="bundle", mode=mode):
+                result = await ESBUILD_SERVICE.build(workspace_path)
+            if result.ok:
+                await run_io(BUNDLE_CACHE.put, key, workspace_path / OUTPUT_FILE)
+
+    if result.ok:
+        await run_io(write_preview_html, workspace_path)
+
+    result.duration_ms = (time.perf_counter() - start) * 1000
+    BUNDLE_DURATION.labels(mode, "ok" if result.ok else "error").observe(result.duration_ms / 1000)
+    record_span("bundle_workspace", start, start + result.duration_ms / 1000, cat="bundle", mode=mode, ok=result.ok)
+    logging.debug(f"bundle_workspace: {workspace_path} ok={result.ok} cache_hit={result.cache_hit} in {result.duration_ms:.1f}ms")
+    return result
@@ -0,0 +1,117 @@
+import os
+import asyncio
+from typing import AsyncIterator, List, Optional
+
+from server.chat.events import StreamEvent
+
+# Latency budget for merging consecutive text chunks; 0 disables coalescing
+STREAM_COALESCE_MS = float(os.getenv("STREAM_COALESCE_MS", "25"))
+STREAM_COALESCE_MAX_CHARS = int(os.getenv("STREAM_COALESCE_MAX_CHARS", "1024"))
+COALESCIBLE_TYPES = ("chunk", "reasoning")
+
+_END = object()
+
+
+async def _pump(source: AsyncIterator[StreamEvent], queue: asyncio.Queue):
+    """Drains the source in a single task so its context and cancellation stay in one place."""
+    async for event in source:
+        await queue.put(event)
+
+
+async def _next(queue: asyncio.Queue, pump: asyncio.Task, timeout: Optional[float] = None):
+    """
+    The next queued event, or _END once the pump has finished and the queue is drained.
+    Waits on the pump as well as the queue, so a pump cancelled (or failed) while blocked
+    on a full queue still ends the stream. Raises the pump's error, or TimeoutError.
+    """
+    if queue.empty() and not pump.done():
+        get = asyncio.ensure_future(queue.get())
+        try:
+            await asyncio.wait((get, pump), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if not get.done():
+                get.cancel()
+        if get.done() and not get.cancelled():
+            return get.result()
+        if not pump.done():
+            raise asyncio.TimeoutError
+    if not queue.empty():
+        return queue.get_nowait()
+    if not pump.cancelled() and pump.exception() is not None:
+        raise pump.exception()
+    return _END
+
+
+async def coalesce_events(
+    source: AsyncIterator[StreamEvent],
+    latency_ms: float = STREAM_COALESCE_MS,
+    max_chars: int = STREAM_COALESCE_MAX_CHARS,
+) -> AsyncIterator[StreamEvent]:
+    """
+    Merges consecutive same-type text events into one event.
+
+    A merged event is emitted when the latency budget since its first chunk runs out,
+    when it reaches `max_chars`, when the event type changes, or right before any
+    other event (tool hints, errors, done). Events flagged `flush` are never held back.
+    """
+    if latency_ms <= 0:
+        async for event in source:
+            yield event
+        return
+
+    loop = asyncio.get_running_loop()
+    budget = latency_ms / 1000
+    queue: asyncio.Queue = asyncio.Queue(maxsize=256)
+    pump = asyncio.create_task(_pump(source, queue))
+
+    buffer_type: Optional[str] = None
+    parts: List[str] = []
+    size = 0
+    deadline = 0.0
+
+    def flush() -> StreamEvent:
+        nonlocal buffer_type, parts, size
+        event = StreamEvent(buffer_type, "".join(parts))
+        buffer_type, parts, size = None, [], 0
+        return event
+
+    try:
+        while True:
+            try:
+                item = await _next(queue, pump, max(0.0, deadline - loop.time()) if parts else None)
+            except asyncio.TimeoutError:
+                yield flush()
+                continue
+            except Exception:
+                if parts:
+                    yield flush()
+                raise
+
+            if item is _END:
+                break
+
+            if item.type in COALESCIBLE_TYPES and isinstance(item.payload, str) and not item.flush:
+                if parts and buffer_type != item.type:
+                    yield flush()
+                if not parts:
+                    buffer_type = item.type
+                    deadline = loop.time() + budget
+                parts.append(item.payload)
+                size += len(item.payload)
+                if size >= max_chars:
+                    yield flush()
+            else:
+                if parts:
+                    yield flush()
+                yield item
+
+        if parts:
+            yield flush()
+    finally:
+        # Stops the upstream stream too when the consumer goes away early
+        if not pump.done():
+            pump.cancel()
+        await asyncio.gather(pump, return_exceptions=True)
+        aclose = getattr(source, "aclose", None)
+        if aclose:
+            await aclose()
@@ -0,0 +1,54 @@
+import json
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+try:
+    import orjson
+except ImportError:  # Optional fast encoder
+    orjson = None
+
+
+@dataclass(slots=True)
+class StreamEvent:
+    """
+    One event in the agent output stream. Flows through the pipeline as an object
+    and is serialized exactly once, at the transport edge.
+    """
+    type: str
+    payload: Any
+    # Deliver immediately instead of merging it with neighbouring chunks
+    flush: bool = False
+    # Progress text for the UI (tool hints), not part of the assistant's reply
+    hint: bool = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"type": self.type, "payload": self.payload}
+
+    def to_sse(self, event_id: Optional[int] = None) -> bytes:
+        return sse_frame(self.type, self.payload, event_id)
+
+
+def dumps(value: Any) -> bytes:
+    """Compact JSON encoding, via orjson when it is installed."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(value)
+        except TypeError:
+            pass
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str).encode()
+
+
+# `data: {"type":"<type>","payload":` for each event type, built once
+_FRAME_PREFIXES: Dict[str, bytes] = {}
+
+
+def sse_frame(event_type: str, payload: Any, event_id: Optional[int] = None) -> bytes:
+    """Encodes a `{"type", "payload"}` SSE data frame, only serializing the payload per call."""
+    prefix = _FRAME_PREFIXES.get(event_type)
+    if prefix is None:
+        prefix = b'data: {"type":' + dumps(event_type) + b',"payload":'
+        _FRAME_PREFIXES[event_type] = prefix
+    frame = prefix + dumps(payload) + b"}\n\n"
+    if event_id is not None:
+        return b"id: %d\n" % event_id + frame
+    return frame
@@ -0,0 +1,55 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+
+
+def to_message(msg: Dict[str, Any]) -> Optional[BaseMessage]:
+    """Converts one stored history entry to a LangChain message."""
+    role = msg.get("role")
+    if role == "user":
+        return HumanMessage(content=msg["content"])
+    if role == "assistant":
+        return AIMessage(content=msg["content"], tool_calls=msg.get("tool_calls") or [])
+    if role == "tool":
+        return ToolMessage(content=msg["content"], tool_call_id=msg["tool_call_id"], name=msg.get("name"))
+    return None
+
+
+@dataclass
+class ConvertedHistory:
+    """
+    LangChain messages for a session's history, converted incrementally.
+    `consumed` counts the history entries already converted, so each turn only
+    converts what was appended since the last one.
+    """
+    consumed: int = 0
+    messages: List[BaseMessage] = field(default_factory=list)
+
+    def sync(self, history: List[Dict[str, Any]]) -> List[BaseMessage]:
+        if self.consumed > len(history):
+            # History was replaced or truncated; start over
+            self.consumed = 0
+            self.messages = []
+        for msg in history[self.consumed:]:
+            message = to_message(msg)
+            if message is not None:
+                self.messages.append(message)
+        self.consumed = len(history)
+        return self.messages
+
+
+def session_messages(entry: Dict[str, Any]) -> List[BaseMessage]:
+    """
+    The session's history as LangChain messages. The converted list lives on the
+    session entry, so it is rebuilt only after the session is rehydrated.
+    """
+    converted = entry.get("converted_history")
+    if converted is None:
+        converted = entry["converted_history"] = ConvertedHistory()
+    return converted.sync(entry["history"])
+
+
+def visible_history(history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """History entries shown to users; tool results are kept for the model only."""
+    return [msg for msg in history if msg.get("role") != "tool"]
@@ -0,0 +1,176 @@
+import re
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from server.chat.events import dumps
+from server.chat.service import discard_session, stream_conversation
+from server.session.runs import RunTicket
+
+# `user` names the session, and with it the workspace directory
+USER_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# Sessions created for requests without `user`; deleted when the request ends
+EPHEMERAL_PREFIX = "oai_"
+
+
+class CompletionError(Exception):
+    """The agent reported an error while producing a non-streaming completion."""
+
+
+class RequestError(ValueError):
+    """The request cannot be mapped onto an agent turn; answered with a 400."""
+
+
+def _message_text(content: Any) -> str:
+    """Flattens OpenAI message content (a string or a list of content parts) to text."""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict) and part.get("type") == "text")
+    return ""
+
+
+def validate_request(req: Dict[str, Any]):
+    """Raises RequestError for a request without a user message or with an unusable `user`."""
+    user = req.get("user")
+    if user is not None and not USER_RE.match(user):
+        raise RequestError("`user` must be 1-64 letters, digits, '-' or '_'.")
+    if not any(m.get("role") == "user" for m in req.get("messages") or []):
+        raise RequestError("`messages` must contain a user message.")
+
+
+def _split_request(req: Dict[str, Any]) -> Tuple[str, str, List[Dict[str, Any]], bool]:
+    """
+    Maps an OpenAI request onto the agent: the last user message is the prompt,
+    `user` is the session id, and earlier turns seed a new session's history.
+    Without `user`, the turn runs in a one-off session (the last value is True).
+    """
+    validate_request(req)
+    messages = req["messages"]
+    last_user = max(i for i, m in enumerate(messages) if m.get("role") == "user")
+    prompt = _message_text(messages[last_user]["content"])
+    seed_history = [
+        {"role": m["role"], "content": _message_text(m.get("content"))}
+        for m in messages[:last_user] if m.get("role") in ("user", "assistant")
+    ]
+    user = req.get("user")
+    session_id = user or f"{EPHEMERAL_PREFIX}{uuid.uuid4().hex[:12]}"
+    return prompt, session_id, seed_history, user is None
+
+
+def _bind_ticket(ticket: Optional[RunTicket], session_id: str) -> Optional[RunTicket]:
+    # Tickets for requests without `user` are created before the session id exists
+    if ticket is not None and ticket.session_id is None:
+        ticket.session_id = session_id
+    return ticket
+
+
+def _usage_object(usage: Optional[Dict[str, int]]) -> Dict[str, Any]:
+    usage = usage or {}
+    return {
+        "prompt_tokens": usage.get("prompt_tokens", 0),
+        "completion_tokens": usage.get("completion_tokens", 0),
+        "total_tokens": usage.get("total_tokens", 0),
+        "prompt_tokens_details": {"cached_tokens": usage.get("cached_tokens", 0)},
+    }
+
+
+async def stream_openai_conversation(req: Dict[str, Any], ticket: Optional[RunTicket] = None) -> AsyncIterator[bytes]:
+    """
+    Streams the agent as OpenAI `chat.completion.chunk` SSE frames.
+    Reasoning goes out as `reasoning_content` deltas; usage is sent as a final
+    chunk when the client asks for it via `stream_options.include_usage`.
+    """
+    prompt, session_id, seed_history, ephemeral = _split_request(req)
+    ticket = _bind_ticket(ticket, session_id)
+    include_usage = bool((req.get("stream_options") or {}).get("include_usage"))
+
+    # Everything but the delta is fixed for the whole response, so encode it once
+    head = dumps({
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": req.get("model", "deep-agent"),
+    })[:-1]
+    content_prefix = b"data: " + head + b',"choices":[{"index":0,"delta":{"content":'
+    reasoning_prefix = b"data: " + head + b',"choices":[{"index":0,"delta":{"reasoning_content":'
+    delta_suffix = b'},"finish_reason":null}]}\n\n'
+
+    def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None, **extra) -> bytes:
+        body = {"choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}], **extra}
+        return b"data: " + head + b"," + dumps(body)[1:] + b"\n\n"
+
+    def error(message: str, error_type: str) -> bytes:
+        return b"data: " + dumps({"error": {"message": message, "type": error_type}}) + b"\n\n"
+
+    yield chunk({"role": "assistant", "content": ""})
+
+    usage = None
+    failed = False
+    try:
+        async for event in stream_conversation(prompt, session_id, seed_history=seed_history, ticket=ticket):
+            if event.type == "chunk":
+                # Tool hints are UI progress text, not part of the reply
+                if not event.hint:
+                    yield content_prefix + dumps(event.payload) + delta_suffix
+            elif event.type == "reasoning":
+                yield reasoning_prefix + dumps(event.payload) + delta_suffix
+            elif event.type == "usage":
+                usage = event.payload
+            elif event.type == "error":
+                yield error(str(event.payload), "agent_error")
+                failed = True
+                break
+            elif event.type == "cancelled":
+                yield error(f"Run {event.payload}.", "cancelled")
+                failed = True
+                break
+
+        # A failed run gets no finish_reason, as the buffered path answers it with an error
+        if not failed:
+            yield chunk({}, finish_reason="stop")
+            if include_usage:
+                body = {"choices": [], "usage": _usage_object(usage)}
+                yield b"data: " + head + b"," + dumps(body)[1:] + b"\n\n"
+        yield b"data: [DONE]\n\n"
+    finally:
+        if ephemeral:
+            await discard_session(session_id)
+
+
+async def complete_openai_conversation(req: Dict[str, Any], ticket: Optional[RunTicket] = None) -> Dict[str, Any]:
+    """Runs the agent to completion and returns a `chat.completion` object, aggregating in one pass."""
+    prompt, session_id, seed_history, ephemeral = _split_request(req)
+    ticket = _bind_ticket(ticket, session_id)
+
+    content: List[str] = []
+    reasoning: List[str] = []
+    usage = None
+    try:
+        async for event in stream_conversation(prompt, session_id, seed_history=seed_history, ticket=ticket):
+            if event.type == "chunk":
+                if not event.hint:
+                    content.append(event.payload)
+            elif event.type == "reasoning":
+                reasoning.append(event.payload)
+            elif event.type == "usage":
+                usage = event.payload
+            elif event.type == "error":
+                raise CompletionError(str(event.payload))
+            elif event.type == "cancelled":
+                raise CompletionError(f"Run {event.payload}.")
+    finally:
+        if ephemeral:
+            await discard_session(session_id)
+
+    message = {"role": "assistant", "content": "".join(content)}
+    if reasoning:
+        message["reasoning_content"] = "".join(reasoning)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": req.get("model", "deep-agent"),
+        "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+        "usage": _usage_object(usage),
+    }
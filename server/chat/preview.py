@@ -0,0 +1,40 @@
+import os
+import re
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+GENERATED_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "generated")
+
+
+def preview_manifest(workspace_path: Path) -> Dict[str, Any]:
+    """
+    The `preview` event payload for a workspace: title and size from widget.json,
+    and the URL its index.html is served at.
+    """
+    meta = {}
+    try:
+        with open(workspace_path / "widget.json", "r") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        pass
+    title = meta.get("title") or "Generated Component"
+
+    slug = re.sub(r'[^a-z0-9]', '', title.lower()[:20])
+    widget_id = f"{int(time.time())}_{slug}"
+
+    try:
+        rel_path = Path(workspace_path).relative_to(GENERATED_DIR)
+        preview_url = f"/generated/{rel_path}/index.html"
+    except ValueError:
+        preview_url = None
+
+    return {
+        "id": widget_id,
+        "title": title,
+        "dimensions": {"w": meta.get("width", 2), "h": meta.get("height", 2)},
+        "code": None,
+        "url": preview_url,
+        "projectPath": str(workspace_path)
+    }
@@ -1,19 +1,33 @@
 import os
-import re
 import asyncio
 import json
 import time
+import shutil
 import logging
-from typing import Optional, AsyncIterator
+import functools
+from typing import Any, AsyncIterator, Dict, List, Optional
 from pathlib import Path
 from dotenv import load_dotenv
 
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.types import Command
 
 from server.core.llm.adapters import ChatDeepSeekCompatible
-from server.agent.factory import create_skilled_deep_agent
-from server.agent.tools import preview_widget
-from server.agent.constants import CREATION_SKILL_MD, PREVIEW_HTML_TEMPLATE
+from server.core.llm.registry import get_chat_model
+from server.core.metrics import TIME_TO_FIRST_TOKEN, TOKENS_PER_SECOND, TOOL_DURATION, TURN_DURATION
+from server.core.aio import makedirs, run_io
+from server.core.tracing import TRACE_STORE, Trace
+from server.agent.checkpoint import CHECKPOINT_STORE
+from server.agent.factory import get_agent_template
+from server.agent.tools import build_widget, preview_widget, bundle_project, read_range
+from server.agent.constants import CREATION_SKILL_MD
+from server.chat.events import StreamEvent
+from server.chat.history import session_messages
+from server.chat.preview import preview_manifest
+from server.chat.coalesce import coalesce_events
+from server.session.events import SessionEventBus
+from server.session.pool import SESSION_POOL
+from server.session.runs import RUN_COORDINATOR, RunRejected, RunTicket
 from server.session.store import SESSION_STORE, broadcast_event
 
 load_dotenv()
@@ -21,8 +35,8 @@ load_dotenv()
 # Constants moved or re-defined
 GENERATED_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "generated")
 WORKSPACES_DIR = os.path.join(GENERATED_DIR, "workspaces")
-# Assume ESBuild path is relative to root
-ESBUILD_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "node_modules", ".bin", "esbuild")
+# Skills loaded by the shared agent template
+SKILLS_DIR = os.path.join(GENERATED_DIR, "skills", "user")
 
 
 # Ensure dirs
@@ -33,6 +47,27 @@ for d in [GENERATED_DIR, WORKSPACES_DIR]:
         except OSError:
             pass
 
+@functools.lru_cache(maxsize=None)
+def install_shared_skills() -> str:
+    """Installs the built-in skills for the shared agent template, once per process."""
+    skill_md = Path(SKILLS_DIR) / "creation-skill" / "SKILL.md"
+    if not skill_md.exists() or skill_md.read_text() != CREATION_SKILL_MD:
+        skill_md.parent.mkdir(parents=True, exist_ok=True)
+        skill_md.write_text(CREATION_SKILL_MD)
+    return SKILLS_DIR
+
+def _is_top_level(event: Dict[str, Any]) -> bool:
+    """True for events of the main agent graph, False for those of subagents run by a tool."""
+    return "|" not in event.get("metadata", {}).get("langgraph_checkpoint_ns", "")
+
+def _tool_messages(output: Any) -> List[ToolMessage]:
+    """Tool results from an on_tool_end output; tools like `task` wrap theirs in a Command."""
+    if isinstance(output, ToolMessage):
+        return [output]
+    if isinstance(output, Command) and isinstance(output.update, dict):
+        return [m for m in output.update.get("messages", []) if isinstance(m, ToolMessage)]
+    return []
+
 class ConversationFlow:
     model_id: str = os.getenv("OPENAI_MODEL_NAME", "glm-4.7")
     
@@ -40,107 +75,117 @@ class ConversationFlow:
         if "model_id" in kwargs:
             self.model_id = kwargs.pop("model_id")
 
-    async def run(self, prompt: str, session_id: Optional[str] = None) -> AsyncIterator[str]:
-        # Initialize Model
-        model = ChatDeepSeekCompatible(
-            model=self.model_id,
-            api_key=os.getenv("OPENAI_API_KEY"),
+    def get_model(self) -> ChatDeepSeekCompatible:
+        return get_chat_model(
+            self.model_id,
             base_url=os.getenv("OPENAI_BASE_URL"),
+            api_key=os.getenv("OPENAI_API_KEY"),
             streaming=True,
+            stream_usage=True,
             temperature=0.6,
             model_kwargs={"reasoning_effort": "high"}
         )
 
+    def _setup_workspace(self, session_id: str) -> Path:
+        """Creates the session workspace. Skills are served from the shared registry, not copied in."""
+        workspace_path = Path(WORKSPACES_DIR) / f"session_{session_id}"
+        workspace_path.mkdir(parents=True, exist_ok=True)
+        return workspace_path
+
+    def _get_agent(self, model: ChatDeepSeekCompatible, checkpointer=None):
+        """Returns the precompiled agent shared by every session using this model."""
+        return get_agent_template(
+            model=model,
+            model_key=self.model_id,
+            skills_registry_path=install_shared_skills(),
+            tools=[build_widget, preview_widget, bundle_project, read_range],
+            name="deep-conversation-agent",
+            checkpointer=checkpointer
+        )
+
+    async def run(
+        self,
+        prompt: str,
+        session_id: Optional[str] = None,
+        seed_history: Optional[List[Dict[str, Any]]] = None,
+        ticket: Optional[RunTicket] = None,
+        lane: str = "interactive"
+    ) -> AsyncIterator[StreamEvent]:
+        """
+        Runs one agent turn and streams its events.
+        `seed_history` primes a brand new session with earlier turns (e.g. from a stateless client).
+        `lane` is the LLM scheduler priority of the turn's model calls ("interactive" or "background").
+        Runs of the same session are serialized by the run coordinator; cancelling `ticket`
+        (on client disconnect or when superseded) stops the model stream and any running tool.
+        """
+        ticket = ticket or RUN_COORDINATOR.ticket(session_id)
+        try:
+            async with RUN_COORDINATOR.acquire(ticket):
+                async for event in self._run_turn(prompt, session_id, seed_history, lane):
+                    yield event
+        except RunRejected as e:
+            yield StreamEvent("error", str(e))
+        except asyncio.CancelledError:
+            if not ticket.cancelled:
+                raise
+            # Our own cancellation: end the stream cleanly instead of failing the task
+            asyncio.current_task().uncancel()
+            logging.info(f"Run for {session_id} cancelled ({ticket.cancel_reason})")
+            yield StreamEvent("cancelled", ticket.cancel_reason)
+
+    @staticmethod
+    async def _traced(events: AsyncIterator[Dict[str, Any]], trace: Optional[Trace]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Relays astream_events, recording each one in `trace`. The trace is the current one
+        while the graph runs, so spans opened by tools and the scheduler land in it too.
+        """
+        if trace is None:
+            async for event in events:
+                yield event
+            return
+        with TRACE_STORE.activate(trace):
+            async for event in events:
+                trace.record(event)
+                yield event
+
+    async def _run_turn(
+        self,
+        prompt: str,
+        session_id: Optional[str],
+        seed_history: Optional[List[Dict[str, Any]]],
+        lane: str = "interactive"
+    ) -> AsyncIterator[StreamEvent]:
+        # Long-lived model client from the process-wide registry
+        model = self.get_model()
+
         # Session / Workspace Setup
         history = []
         workspace_path = None
 
         if session_id:
-            if session_id in SESSION_STORE:
-                data = SESSION_STORE[session_id]
-                agent = data["agent"]
-                history = data["history"]
-                workspace_path = data["workspace_path"]
-            else:
-                # Create Workspace
-                workspace_path = Path(WORKSPACES_DIR) / f"session_{session_id}"
-                workspace_path.mkdir(parents=True, exist_ok=True)
-                
-                # Install Skill
-                skills_dir = workspace_path / "skills" / "user"
-                skills_dir.mkdir(parents=True, exist_ok=True)
-                
-                skill_dir = skills_dir / "creation-skill"
-                skill_dir.mkdir(parents=True, exist_ok=True)
-                
-                with open(skill_dir / "SKILL.md", "w") as f:
-                    f.write(CREATION_SKILL_MD)
-                
-                # Define bound tool for bundling that knows the CWD
-                # WE MUST IMPORT tool here to bind it or keep it local?
-                # Keeping it local captures workspace_path
-                from langchain_core.tools import tool
-                
-                @tool
-                async def bundle_project() -> str:
-                    """
-                    Bundle the current project (widget.jsx) into a single file (widget.bundled.js).
-                    Call this BEFORE preview_widget if you have multiple files or dependencies.
-                    """
-                    try:
-                        # Run esbuild
-                        process = await asyncio.create_subprocess_exec(
-                            ESBUILD_PATH,
-                            "widget.jsx",
-                            "--bundle",
-                            "--outfile=widget.bundled.js",
-                            "--format=esm",
-                            "--jsx=automatic", 
-                            "--loader:.js=jsx",
-                            "--loader:.jsx=jsx",
-                            "--external:react",
-                            "--external:react/jsx-runtime",
-                            "--external:lucide-react",
-                            "--external:framer-motion",
-                            cwd=str(workspace_path),
-                            stdout=asyncio.subprocess.PIPE,
-                            stderr=asyncio.subprocess.PIPE
-                        )
-                        stdout, stderr = await process.communicate()
-                        
-                        
-                        if process.returncode != 0:
-                            return f"Bundling failed: {stderr.decode()}"
-                        
-                        # Generate index.html from template
-                        with open(workspace_path / "index.html", "w") as f:
-                            f.write(PREVIEW_HTML_TEMPLATE)
-
-                        return "Bundling successful: widget.bundled.js and index.html created."
-                    except Exception as e:
-                        return f"Bundling error: {str(e)}"
-
-                # Initialize Agent pointing to workspace
-                agent = create_skilled_deep_agent(
-                    model=model,
-                    root_dir=workspace_path,
-                    skills_registry_path=str(skills_dir),
-                    tools=[preview_widget, bundle_project],
-                    name="deep-conversation-agent"
-                )
-                
-                SESSION_STORE[session_id] = {
-                    "agent": agent,
-                    "history": [],
-                    "workspace_path": workspace_path,
-                    "event_queue": asyncio.Queue()
+            # Rehydrates transparently if the session was hibernated
+            data = await SESSION_STORE.aget(session_id)
+            if data is None:
+                # A pre-warmed workspace and event bus from the pool, if one is ready
+                data = await SESSION_POOL.claim(session_id) or {
+                    "workspace_path": await run_io(self._setup_workspace, session_id),
+                    "event_bus": SessionEventBus()
                 }
-                history = SESSION_STORE[session_id]["history"]
+                data["history"] = list(seed_history or [])
+                SESSION_STORE[session_id] = data
+            elif not data["workspace_path"] or not await run_io(Path(data["workspace_path"]).exists):
+                data["workspace_path"] = await run_io(self._setup_workspace, session_id)
+
+            workspace_path = Path(data["workspace_path"])
+            # Writes the skill files on the first turn of the process (cached afterwards)
+            await run_io(install_shared_skills)
+            agent = self._get_agent(model, await CHECKPOINT_STORE.get())
+            history = data["history"]
         else:
              # Temp workspace logic ignored for now as session_id is mandatory in new flow
              # But keeping fallback just in case
             workspace_path = Path(WORKSPACES_DIR) / f"temp_{int(time.time())}"
-            workspace_path.mkdir(parents=True, exist_ok=True)
+            await makedirs(workspace_path)
             # ... (Minimal setup for stateless request) ...
             return
 
@@ -148,21 +193,31 @@ class ConversationFlow:
         user_msg = {"role": "user", "content": prompt}
         history.append(user_msg)
         
-        formatted_history = []
-        for msg in history:
-            if msg["role"] == "user":
-                formatted_history.append(HumanMessage(content=msg["content"]))
-            elif msg["role"] == "assistant":
-                formatted_history.append(AIMessage(content=msg["content"], tool_calls=msg.get("tool_calls", [])))
-            elif msg["role"] == "tool":
-                 pass
-
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cached_tokens": 0}
+        # Turn timing for /metrics; a turn that never reaches the end was cancelled
+        started = time.perf_counter()
+        first_token_at = None
+        tool_started: Dict[str, float] = {}
+        status = "cancelled"
+        # Span tree of the turn, written to the session's trace file if sampled
+        trace = Trace(session_id) if TRACE_STORE.enabled else None
+        SESSION_STORE.pin(session_id)
         try:
-            print(f"[DEBUG] Starting stream for {session_id}.", flush=True)
-            input_payload = {"messages": formatted_history}
-            
+            logging.debug(f"Starting stream for {session_id}.")
+            # The checkpointer already holds the conversation for this thread, so only the new message is sent
+            if await CHECKPOINT_STORE.has_thread(session_id):
+                input_payload = {"messages": [HumanMessage(content=prompt)]}
+            else:
+                # First turn, or the checkpoint was lost: seed the thread from the stored history.
+                # Converted incrementally: only entries added since the last turn are new objects
+                input_payload = {"messages": list(session_messages(data))}
+
+            config = {
+                "configurable": {"thread_id": session_id, "session_id": session_id, "workspace_path": str(workspace_path), "llm_lane": lane},
+                "recursion_limit": 100
+            }
             # Use astream_events for granular token streaming
-            async for event in agent.astream_events(input_payload, config={"configurable": {"session_id": session_id}, "recursion_limit": 100}, version="v2"):
+            async for event in self._traced(agent.astream_events(input_payload, config=config, version="v2"), trace):
                 kind = event["event"]
                 name = event.get("name")
                 
@@ -170,15 +225,23 @@ class ConversationFlow:
                 if kind == "on_chat_model_stream":
                     chunk = event["data"]["chunk"]
                     reasoning = chunk.additional_kwargs.get("reasoning_content")
+                    if first_token_at is None and (reasoning or chunk.content):
+                        first_token_at = time.perf_counter()
+                        TIME_TO_FIRST_TOKEN.observe(first_token_at - started)
                     
                     if reasoning:
-                        yield json.dumps({"type": "reasoning", "payload": reasoning})
+                        yield StreamEvent("reasoning", reasoning)
 
                     if chunk.content:
-                        yield json.dumps({"type": "chunk", "payload": chunk.content})
+                        yield StreamEvent("chunk", chunk.content)
                 
+                # Position in the server-wide LLM queue while a model call waits for admission
+                elif kind == "on_custom_event" and name == "llm_queue":
+                    yield StreamEvent("queue", event["data"], flush=True)
+
                 # Tool Execution Hints
                 elif kind == "on_tool_start":
+                    tool_started[event["run_id"]] = time.perf_counter()
                     if name and name != "create_deep_agent" and name != "DeepAgent" and not name.startswith("LangGraph"): 
                         args = event["data"].get("input")
                         arg_str = ""
@@ -191,81 +254,100 @@ class ConversationFlow:
                                 for k, v in args.items():
                                     if k in ["code", "content", "file_content", "data"] and isinstance(v, str) and len(v) > 50:
                                         safe_args[k] = "..."
+                                    elif k == "files" and isinstance(v, dict):
+                                        # build_widget sources: only the file names
+                                        safe_args[k] = sorted(v)
                                     else:
                                         safe_args[k] = v
                                 arg_str = json.dumps(safe_args)
                         
-                        yield json.dumps({"type": "chunk", "payload": f"\n\n> 🛠️  Running {name} {arg_str}...\n\n"})
+                        yield StreamEvent("chunk", f"\n\n> 🛠️  Running {name} {arg_str}...\n\n", flush=True, hint=True)
                 
                 # Check for Preview Trigger
                 elif kind == "on_tool_end":
-                    if name == "preview_widget":
-                        # Generate index.html
-                        # ... (Simplified for this file View) ...
-                        # In refactor we should probably move this index.html generation to a helper in server/modules/preview?
-                        # For now keeping it inline to preserve behavior.
-                        
-                        # LOGIC: Generate index.html, create Manifest, Broadcast 'preview' event.
-                        
-                        # Note: index.html is now generated mainly by bundle_project, but we could ensure it exists here too if needed.
-                        # For now, assuming bundle_project was called.
-                        # If simple widget.jsx usage without bundle becomes allowed, we might need fallback here.
-                        # But current skill requires bundle.
+                    tool_start = tool_started.pop(event["run_id"], None)
+                    if tool_start is not None:
+                        TOOL_DURATION.labels(name or "unknown").observe(time.perf_counter() - tool_start)
+                    if _is_top_level(event):
+                        for tool_msg in _tool_messages(event["data"].get("output")):
+                            history.append({"role": "tool", "content": tool_msg.text, "tool_call_id": tool_msg.tool_call_id, "name": tool_msg.name or name})
 
-                        
-                        code = ""
-                        title = "Generated Component"
-                        try:
-                            with open(workspace_path / "widget.json", "r") as f:
-                                meta = json.load(f)
-                                title = meta.get("title", title)
-                        except: pass
-                            
-                        slug = re.sub(r'[^a-z0-9]', '', title.lower()[:20])
-                        widget_id = f"{int(time.time())}_{slug}"
-                        
-                        try:
-                            # Relative path logic needs to be robust
-                            rel_path = workspace_path.relative_to(GENERATED_DIR)
-                            preview_url = f"/generated/{rel_path}/index.html"
-                        except: preview_url = None
-    
-                        preview_manifest = {
-                            "id": widget_id,
-                            "title": title,
-                            "dimensions": {"w": 2, "h": 2},
-                            "code": None,
-                            "url": preview_url,
-                            "projectPath": str(workspace_path)
-                        }
-                        
+                    if name == "preview_widget":
+                        # index.html is written by bundle_project; build_widget broadcasts its own preview
                         if session_id:
-                             await broadcast_event(session_id, "preview", preview_manifest)
+                            await broadcast_event(session_id, "preview", await run_io(preview_manifest, workspace_path))
 
 
                 # History Persistence
                 elif kind == "on_chat_model_end":
                      msg = event["data"]["output"]
-                     if isinstance(msg, AIMessage):
+                     # Subagent calls stay inside their task tool's result
+                     if isinstance(msg, AIMessage) and _is_top_level(event):
                         history.append({"role": "assistant", "content": msg.content, "tool_calls": msg.tool_calls})
+                        if msg.usage_metadata:
+                            usage["prompt_tokens"] += msg.usage_metadata.get("input_tokens", 0)
+                            usage["completion_tokens"] += msg.usage_metadata.get("output_tokens", 0)
+                            usage["total_tokens"] += msg.usage_metadata.get("total_tokens", 0)
+                            # Prompt tokens the provider served from its prefix cache
+                            usage["cached_tokens"] += (msg.usage_metadata.get("input_token_details") or {}).get("cache_read", 0) or 0
+
+            # Token usage summed over every model call in this turn
+            if usage["prompt_tokens"]:
+                logging.info(f"Prompt cache for {session_id}: {usage['cached_tokens']}/{usage['prompt_tokens']} prompt tokens cached ({usage['cached_tokens'] / usage['prompt_tokens']:.0%})")
+            yield StreamEvent("usage", usage)
+            status = "ok"
+
+            try:
+                await CHECKPOINT_STORE.prune(session_id)
+            except Exception as e:
+                logging.warning(f"Checkpoint pruning failed for {session_id}: {e}")
 
         except Exception as e:
+            status = "error"
             logging.error(f"DeepAgent Error: {e}")
-            yield json.dumps({"type": "error", "payload": str(e)})
+            yield StreamEvent("error", str(e))
+        finally:
+            finished = time.perf_counter()
+            TURN_DURATION.labels(status).observe(finished - started)
+            if first_token_at is not None and usage["completion_tokens"] and finished > first_token_at:
+                TOKENS_PER_SECOND.observe(usage["completion_tokens"] / (finished - first_token_at))
+            if trace is not None:
+                TRACE_STORE.submit(trace, status)
+            SESSION_STORE.release(session_id)
+
 
+async def discard_session(session_id: str):
+    """
+    Deletes everything a session left behind: its store entry, checkpoint thread, trace
+    and workspace. For one-off sessions that no client can come back to.
+    """
+    data = SESSION_STORE.peek(session_id)
+    workspace_path = data.get("workspace_path") if data else None
+    await SESSION_STORE.discard(session_id)
+    try:
+        await CHECKPOINT_STORE.delete_thread(session_id)
+    except Exception as e:
+        logging.warning(f"Could not delete the checkpoints of {session_id}: {e}")
+    await TRACE_STORE.flush()
+    await run_io(TRACE_STORE.delete, session_id)
+    await run_io(shutil.rmtree, workspace_path or Path(WORKSPACES_DIR) / f"session_{session_id}", ignore_errors=True)
 
-async def stream_conversation(prompt: str, session_id: Optional[str] = None):
+
+async def stream_conversation(
+    prompt: str,
+    session_id: Optional[str] = None,
+    seed_history: Optional[List[Dict[str, Any]]] = None,
+    ticket: Optional[RunTicket] = None,
+    lane: str = "interactive"
+) -> AsyncIterator[StreamEvent]:
     if not os.getenv("OPENAI_API_KEY"):
-        yield ("error", "OPENAI_API_KEY not found.")
+        yield StreamEvent("error", "OPENAI_API_KEY not found.")
         return
 
     flow = ConversationFlow(model_id=os.getenv("OPENAI_MODEL_NAME", "glm-4.7"))
 
-    async for result_json in flow.run(prompt, session_id=session_id):
-        try:
-            result = json.loads(result_json)
-            yield (result["type"], result["payload"])
-        except json.JSONDecodeError:
-            yield ("error", "Internal JSON error")
+    # Merge per-token chunks into fewer, larger frames within a small latency budget
+    async for event in coalesce_events(flow.run(prompt, session_id=session_id, seed_history=seed_history, ticket=ticket, lane=lane)):
+        yield event
     
-    yield ("done", "[DONE]")
+    yield StreamEvent("done", "[DONE]")
@@ -0,0 +1,167 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import functools
+import threading
+import traceback
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+from server.core.metrics import METRICS
+
+# Threads doing blocking file I/O for the event loop; bounded so a slow disk cannot
+# pile up threads, and separate from the default executor used for CPU-bound work
+IO_MAX_WORKERS = int(os.getenv("IO_MAX_WORKERS", "8"))
+# A loop iteration slower than this is reported, with the stack of the blocking code; 0 disables
+LOOP_LAG_THRESHOLD_SECONDS = float(os.getenv("LOOP_LAG_THRESHOLD_SECONDS", "0.1"))
+LOOP_LAG_INTERVAL_SECONDS = float(os.getenv("LOOP_LAG_INTERVAL_SECONDS", "0.25"))
+
+T = TypeVar("T")
+
+IO_EXECUTOR = ThreadPoolExecutor(max_workers=max(1, IO_MAX_WORKERS), thread_name_prefix="io")
+
+LOOP_LAG = METRICS.histogram("event_loop_lag_seconds", "How late the event loop ran a timer scheduled by the lag monitor.",
+                             buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+LOOP_STALLS = METRICS.counter("event_loop_stalls_total", "Times the event loop was blocked for longer than the lag threshold.")
+
+
+async def run_io(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Runs a blocking file operation on the I/O pool. Like asyncio.to_thread, the call
+    sees the caller's context variables (run config, current trace span).
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(IO_EXECUTOR, functools.partial(context.run, fn, *args, **kwargs))
+
+
+def _read_text(path: str, encoding: str, errors: str) -> Optional[str]:
+    try:
+        with open(path, "r", encoding=encoding, errors=errors) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+async def read_text(path: "os.PathLike[str] | str", encoding: str = "utf-8", errors: str = "strict") -> Optional[str]:
+    """File contents, or None if it does not exist."""
+    return await run_io(_read_text, os.fspath(path), encoding, errors)
+
+
+def replace_text(path: str, content: str, encoding: str = "utf-8"):
+    """
+    Blocking atomic write. The file is replaced rather than rewritten in place, so readers
+    never see a partial file and hardlinks into pooled workspace templates are broken
+    instead of written through.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    _replace(path, content, "w", encoding)
+
+
+def replace_bytes(path: str, data: bytes):
+    """Blocking atomic write of binary content, like `replace_text`."""
+    _replace(path, data, "wb")
+
+
+def _replace(path: str, content: Any, mode: str, encoding: Optional[str] = None):
+    # Unique per thread, so concurrent writers of one path never share a temporary file;
+    # it is removed if the write fails
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, mode, encoding=encoding) as f:
+            f.write(content)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+async def write_text(path: "os.PathLike[str] | str", content: str, encoding: str = "utf-8"):
+    """Atomically writes a file, creating parent directories as needed."""
+    await run_io(replace_text, os.fspath(path), content, encoding)
+
+
+async def makedirs(path: "os.PathLike[str] | str"):
+    await run_io(os.makedirs, os.fspath(path), exist_ok=True)
+
+
+class LoopLagMonitor:
+    """
+    Measures event loop lag with a periodic timer and reports stalls.
+
+    A watchdog thread notices when the timer is overdue by more than `threshold` and
+    captures the event loop thread's stack while it is still blocked, so the report
+    names the code that held the loop, not just how long it was held.
+    """
+    def __init__(self, threshold: float = LOOP_LAG_THRESHOLD_SECONDS, interval: float = LOOP_LAG_INTERVAL_SECONDS):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = 0
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._loop_thread: Optional[int] = None
+        self._due = 0.0
+        self._stack: Optional[str] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0 and self.interval > 0
+
+    def start(self):
+        if not self.enabled or self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._due = time.monotonic() + self.interval
+        self._stop.clear()
+        self._task = asyncio.create_task(self._beat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+    async def _beat(self):
+        while True:
+            # The deadline moves before the old sample is cleared, so the watchdog never
+            # samples against a stale deadline
+            self._due = time.monotonic() + self.interval
+            self._stack = None
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - self._due)
+            LOOP_LAG.observe(lag)
+            if lag >= self.threshold:
+                self.report(lag, self._stack)
+
+    def report(self, lag: float, stack: Optional[str]):
+        self.stalls += 1
+        LOOP_STALLS.inc()
+        where = f"; blocked in:\n{stack}" if stack else ""
+        logging.warning(f"Event loop blocked for {lag * 1000:.0f}ms{where}")
+
+    def _watch(self):
+        # Polls at a fraction of the threshold; takes at most one stack sample per stall
+        poll = max(0.005, self.threshold / 4)
+        while not self._stop.wait(poll):
+            if self._stack is None and time.monotonic() - self._due >= self.threshold:
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is not None:
+                    # The innermost frames are the blocking call and its callers
+                    self._stack = "".join(traceback.format_stack(frame)[-6:]).rstrip()
+
+
+# Process-wide loop lag monitor, started with the server
+LOOP_MONITOR = LoopLagMonitor()
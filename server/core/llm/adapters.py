@@ -1,10 +1,21 @@
+from typing import Any, AsyncIterator, List, Optional
+
 from langchain_openai import ChatOpenAI
-from langchain_core.outputs import ChatGenerationChunk
+from langchain_core.callbacks import adispatch_custom_event
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_core.runnables.config import ensure_config
+
+from server.core.llm.scheduler import LLM_OUTPUT_TOKEN_RESERVE, LLM_SCHEDULER
 
 class ChatDeepSeekCompatible(ChatOpenAI):
     """
     Custom ChatOpenAI subclass to handle DeepSeek/Z.ai style reasoning_content.
     LangChain's default ChatOpenAI implementation ignores unrecognized fields in the delta.
+
+    Async calls are admitted by the server-wide LLM_SCHEDULER, which also owns retries,
+    so the scheduler sees 429s instead of the OpenAI client retrying them on its own.
+    Every agent and subagent model call goes through here.
     """
     def _convert_chunk_to_generation_chunk(
         self,
@@ -32,5 +43,77 @@ class ChatDeepSeekCompatible(ChatOpenAI):
                 generation_chunk.message.additional_kwargs["reasoning_content"] = reasoning
         except (KeyError, IndexError, AttributeError):
             pass
+
+        # DeepSeek-style providers report prefix cache hits outside prompt_tokens_details
+        usage = chunk.get("usage") or {}
+        cache_hit = usage.get("prompt_cache_hit_tokens")
+        usage_metadata = getattr(generation_chunk.message, "usage_metadata", None)
+        if cache_hit and usage_metadata and not (usage_metadata.get("input_token_details") or {}).get("cache_read"):
+            usage_metadata["input_token_details"] = {**(usage_metadata.get("input_token_details") or {}), "cache_read": cache_hit}
             
         return generation_chunk
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        parent = super()._astream
+        async for chunk in LLM_SCHEDULER.stream(
+            lambda: parent(messages, stop=stop, run_manager=run_manager, **kwargs),
+            count_tokens=_chunk_tokens,
+            **_admission(messages, kwargs),
+        ):
+            yield chunk
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        parent = super()._agenerate
+        return await LLM_SCHEDULER.call(
+            lambda: parent(messages, stop=stop, run_manager=run_manager, **kwargs),
+            count_tokens=lambda result: (result.llm_output or {}).get("token_usage", {}).get("total_tokens"),
+            **_admission(messages, kwargs),
+        )
+
+
+def _estimate_tokens(messages: List[BaseMessage], kwargs: dict) -> int:
+    """Rough request cost (~4 characters per token) plus the completion reserve."""
+    chars = sum(len(m.content) if isinstance(m.content, str) else len(str(m.content)) for m in messages)
+    chars += len(str(kwargs.get("tools") or ""))
+    return chars // 4 + LLM_OUTPUT_TOKEN_RESERVE
+
+
+def _chunk_tokens(chunk: ChatGenerationChunk) -> Optional[int]:
+    usage = getattr(chunk.message, "usage_metadata", None)
+    return usage.get("total_tokens") if usage else None
+
+
+def _admission(messages: List[BaseMessage], kwargs: dict) -> dict:
+    """
+    Scheduler arguments for a call: the session and lane come from the run config
+    (`configurable.session_id` / `configurable.llm_lane`), and queue positions are
+    published as `llm_queue` custom events on the run's event stream.
+    """
+    configurable = ensure_config().get("configurable", {})
+    lane = configurable.get("llm_lane", "interactive")
+
+    async def report(position: int):
+        try:
+            await adispatch_custom_event("llm_queue", {"position": position, "lane": lane})
+        except RuntimeError:
+            # Called outside of a run; nobody is listening
+            pass
+
+    return {
+        "session_id": configurable.get("session_id"),
+        "lane": lane,
+        "tokens": _estimate_tokens(messages, kwargs),
+        "on_queue": report,
+    }
@@ -0,0 +1,111 @@
+import os
+import logging
+import importlib.util
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+from server.core.llm.adapters import ChatDeepSeekCompatible
+
+# Connection pool shared by every model client in the process
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "120"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "600"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+# "auto" enables HTTP/2 when the optional `h2` package is installed
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "auto").lower()
+
+_HTTP_CLIENT: Optional[httpx.AsyncClient] = None
+_MODELS: Dict[Tuple, ChatDeepSeekCompatible] = {}
+
+
+def http2_enabled() -> bool:
+    if LLM_HTTP2 in ("0", "false", "no", "off"):
+        return False
+    has_h2 = importlib.util.find_spec("h2") is not None
+    if LLM_HTTP2 in ("1", "true", "yes", "on") and not has_h2:
+        logging.warning("LLM_HTTP2 is on but the `h2` package is not installed; using HTTP/1.1")
+    return has_h2
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Returns the process-wide keep-alive client used by every model.
+    HTTP/2 is negotiated via ALPN, so providers without it fall back to HTTP/1.1.
+    """
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None or _HTTP_CLIENT.is_closed:
+        _HTTP_CLIENT = httpx.AsyncClient(
+            http2=http2_enabled(),
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        )
+    return _HTTP_CLIENT
+
+
+def _freeze(value: Any) -> Any:
+    """Turns nested params into something hashable for the registry key."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def get_chat_model(
+    model_id: str,
+    base_url: Optional[str] = None,
+    api_key: Optional[str] = None,
+    **params: Any
+) -> ChatDeepSeekCompatible:
+    """
+    Returns the long-lived model client for this model id, base URL and params.
+    All clients share one connection pool, so turns reuse warm TLS connections.
+    Pass `max_retries` to let the OpenAI client retry on its own as well.
+    """
+    # Retries belong to the LLM scheduler, which backs off globally on 429s
+    params.setdefault("max_retries", 0)
+    key = (model_id, base_url, api_key, _freeze(params))
+    model = _MODELS.get(key)
+    if model is None:
+        model = ChatDeepSeekCompatible(
+            model=model_id,
+            api_key=api_key,
+            base_url=base_url,
+            http_async_client=get_http_client(),
+            **params
+        )
+        _MODELS[key] = model
+        logging.info(f"LLM registry: created client for {model_id} at {base_url}")
+    return model
+
+
+async def warm_up(model: ChatDeepSeekCompatible):
+    """
+    Opens a pooled connection to the model's provider ahead of the first request,
+    so the TLS handshake is not paid on the first user turn.
+    """
+    base_url = (model.openai_api_base or "https://api.openai.com/v1").rstrip("/")
+    headers = {}
+    if model.openai_api_key:
+        headers["Authorization"] = f"Bearer {model.openai_api_key.get_secret_value()}"
+    try:
+        response = await get_http_client().get(f"{base_url}/models", headers=headers)
+        logging.info(f"LLM registry: warmed {base_url} ({response.http_version} {response.status_code})")
+    except httpx.HTTPError as e:
+        # Warm-up is best effort; the first real request will connect on its own
+        logging.warning(f"LLM registry: warm-up of {base_url} failed: {e}")
+
+
+async def close_clients():
+    """Closes the shared connection pool and forgets every model client."""
+    global _HTTP_CLIENT
+    _MODELS.clear()
+    if _HTTP_CLIENT is not None:
+        await _HTTP_CLIENT.aclose()
+        _HTTP_CLIENT = None
@@ -0,0 +1,379 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional
+
+import httpx
+
+from server.core.metrics import LLM_QUEUE_WAIT, METRICS, PROVIDER_ERRORS
+from server.core.tracing import instant, record_span
+
+# Model calls allowed in flight at once across the whole server
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# Provider token budget per minute (prompt + completion); 0 disables the budget
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+# Completion tokens reserved per call until the real usage is known
+LLM_OUTPUT_TOKEN_RESERVE = int(os.getenv("LLM_OUTPUT_TOKEN_RESERVE", "1024"))
+# Retries of a call rejected with 429 or a transient provider error
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "1"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "60"))
+# While both lanes are waiting, one background call is admitted per this many interactive ones
+LLM_BACKGROUND_SHARE = int(os.getenv("LLM_BACKGROUND_SHARE", "4"))
+
+# Admission lanes, highest priority first
+LANES = ("interactive", "background")
+
+
+def _openai():
+    # An OpenAI error can only exist once the client library is loaded, so checking for
+    # one never needs to import it (keeps this module cheap to import at startup)
+    return sys.modules.get("openai")
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+    openai = _openai()
+    if openai is not None and isinstance(exc, openai.RateLimitError):
+        return True
+    return isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code == 429
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Errors raised before any output was streamed that are worth retrying."""
+    if is_rate_limited(exc):
+        return True
+    openai = _openai()
+    if openai is None:
+        return False
+    if isinstance(exc, (openai.APIConnectionError, openai.InternalServerError)):
+        return True
+    return isinstance(exc, openai.APIStatusError) and exc.status_code >= 500
+
+
+def error_kind(exc: BaseException) -> str:
+    """Coarse error class used to label provider error metrics."""
+    if is_rate_limited(exc):
+        return "rate_limited"
+    openai = _openai()
+    if openai is not None and isinstance(exc, openai.APITimeoutError):
+        return "timeout"
+    if isinstance(exc, httpx.TransportError) or (openai is not None and isinstance(exc, openai.APIConnectionError)):
+        return "connection"
+    status = getattr(exc, "status_code", None)
+    if isinstance(status, int):
+        return "server_error" if status >= 500 else "client_error"
+    return "other"
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """Seconds the provider asked us to wait, from `retry-after-ms` or `Retry-After` (seconds only)."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+@dataclass(eq=False)
+class _Waiter:
+    session_id: Optional[str]
+    lane: str
+    tokens: int
+    position: int = 0
+    granted: bool = False
+    moved: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+@dataclass
+class Grant:
+    """An admitted model call. Set `used` to the real token count to settle the budget."""
+    tokens: int
+    queued_seconds: float
+    used: Optional[int] = None
+
+
+class LLMScheduler:
+    """
+    Server-wide admission control for model calls.
+
+    A call is admitted when a concurrency slot is free and the token-per-minute bucket
+    holds its estimated cost. Waiting calls are kept per lane and, within a lane, per
+    session; sessions are served round-robin, so one busy session cannot starve the
+    others. Interactive calls go first, but background calls still get one slot in
+    every `background_share` grants. A 429 pauses all admissions for the provider's
+    Retry-After (or an exponential backoff) instead of letting every caller retry at
+    once. Waiters are told their queue position as it changes.
+    """
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        tokens_per_minute: int = LLM_TOKENS_PER_MINUTE,
+        max_retries: int = LLM_MAX_RETRIES,
+        background_share: int = LLM_BACKGROUND_SHARE,
+        backoff_base: float = LLM_BACKOFF_BASE_SECONDS,
+        backoff_max: float = LLM_BACKOFF_MAX_SECONDS,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max(0, max_retries)
+        self.background_share = max(1, background_share)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._queues: Dict[str, "OrderedDict[Optional[str], Deque[_Waiter]]"] = {lane: OrderedDict() for lane in LANES}
+        self._running = 0
+        self._bucket = float(tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._interactive_streak = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.stats = {"admitted": 0, "rate_limited": 0, "retries": 0}
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    def waiting(self, lane: Optional[str] = None) -> int:
+        lanes = [lane] if lane else LANES
+        return sum(len(q) for l in lanes for q in self._queues[l].values())
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        session_id: Optional[str] = None,
+        lane: str = "interactive",
+        tokens: int = 0,
+        on_queue: Optional[Callable[[int], Awaitable[None]]] = None,
+    ) -> AsyncIterator[Grant]:
+        """Waits for admission, reporting queue positions to `on_queue`, and holds the slot for the block."""
+        if lane not in LANES:
+            raise ValueError(f"Unknown lane {lane!r}; expected one of {', '.join(LANES)}")
+        waiter = _Waiter(session_id, lane, max(0, tokens))
+        self._queues[lane].setdefault(session_id, deque()).append(waiter)
+        queued_at = time.perf_counter()
+        self._dispatch()
+
+        reported = 0
+        try:
+            while not waiter.granted:
+                if on_queue is not None and waiter.position != reported:
+                    reported = waiter.position
+                    await on_queue(reported)
+                    continue
+                waiter.moved.clear()
+                await waiter.moved.wait()
+        except BaseException:
+            if waiter.granted:
+                self._release(waiter.tokens, None)
+            else:
+                self._remove(waiter)
+                self._dispatch()
+            raise
+
+        admitted_at = time.perf_counter()
+        grant = Grant(tokens=waiter.tokens, queued_seconds=admitted_at - queued_at)
+        LLM_QUEUE_WAIT.labels(lane).observe(grant.queued_seconds)
+        if waiter.position:
+            # Only calls that actually queued get a span
+            record_span("llm.queue", queued_at, admitted_at, cat="scheduler", lane=lane)
+        try:
+            yield grant
+        finally:
+            self._release(grant.tokens, grant.used)
+
+    async def call(
+        self,
+        fn: Callable[[], Awaitable[Any]],
+        session_id: Optional[str] = None,
+        lane: str = "interactive",
+        tokens: int = 0,
+        on_queue: Optional[Callable[[int], Awaitable[None]]] = None,
+        count_tokens: Optional[Callable[[Any], Optional[int]]] = None,
+    ) -> Any:
+        """Runs `fn` once admitted, retrying rate limits and transient provider errors with backoff."""
+        attempt = 0
+        while True:
+            async with self.slot(session_id, lane, tokens, on_queue) as grant:
+                try:
+                    result = await fn()
+                except Exception as e:
+                    PROVIDER_ERRORS.labels(error_kind(e)).inc()
+                    if not self._should_retry(e, attempt):
+                        raise
+                    # A rejected call consumed nothing
+                    grant.used = 0
+                    delay = self._backoff(e, attempt, session_id)
+                else:
+                    if count_tokens is not None:
+                        grant.used = count_tokens(result)
+                    return result
+            attempt += 1
+            self.stats["retries"] += 1
+            if delay:
+                await asyncio.sleep(delay)
+
+    async def stream(
+        self,
+        factory: Callable[[], AsyncIterator[Any]],
+        session_id: Optional[str] = None,
+        lane: str = "interactive",
+        tokens: int = 0,
+        on_queue: Optional[Callable[[int], Awaitable[None]]] = None,
+        count_tokens: Optional[Callable[[Any], Optional[int]]] = None,
+    ) -> AsyncIterator[Any]:
+        """
+        Streaming counterpart of `call`: holds the slot while the stream is consumed. Errors are
+        only retried before the first item, since earlier output has already been delivered.
+        """
+        attempt = 0
+        while True:
+            async with self.slot(session_id, lane, tokens, on_queue) as grant:
+                started = False
+                try:
+                    async for item in factory():
+                        started = True
+                        if count_tokens is not None:
+                            grant.used = count_tokens(item) or grant.used
+                        yield item
+                    return
+                except Exception as e:
+                    PROVIDER_ERRORS.labels(error_kind(e)).inc()
+                    if started or not self._should_retry(e, attempt):
+                        raise
+                    grant.used = 0
+                    delay = self._backoff(e, attempt, session_id)
+            attempt += 1
+            self.stats["retries"] += 1
+            if delay:
+                await asyncio.sleep(delay)
+
+    def _should_retry(self, exc: BaseException, attempt: int) -> bool:
+        return is_transient(exc) and attempt < self.max_retries
+
+    def _backoff(self, exc: BaseException, attempt: int, session_id: Optional[str]) -> float:
+        """
+        Returns how long this caller should sleep before retrying. Rate limits pause every
+        caller instead, this one included, so it simply queues again.
+        """
+        delay = retry_after(exc)
+        if delay is None:
+            delay = min(self.backoff_max, self.backoff_base * 2 ** attempt) * (0.5 + random.random() / 2)
+        logging.warning(f"LLMScheduler: {type(exc).__name__} for {session_id}; retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+        instant("llm.retry", cat="scheduler", error=type(exc).__name__, attempt=attempt + 1, delay=round(delay, 3))
+        if is_rate_limited(exc):
+            self.stats["rate_limited"] += 1
+            self.pause(delay)
+            return 0.0
+        return delay
+
+    def pause(self, seconds: float):
+        """Holds back all admissions for `seconds`, e.g. after the provider answered 429."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._dispatch()
+
+    def _release(self, reserved: int, used: Optional[int]):
+        self._running -= 1
+        if used is not None and self.tokens_per_minute > 0:
+            # Settle the reservation against the real usage; overruns leave the bucket in debt
+            self._bucket = min(float(self.tokens_per_minute), self._bucket + reserved - used)
+        self._dispatch()
+
+    def _remove(self, waiter: _Waiter):
+        sessions = self._queues[waiter.lane]
+        queue = sessions.get(waiter.session_id)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del sessions[waiter.session_id]
+
+    def _refill(self, now: float):
+        if self.tokens_per_minute > 0:
+            rate = self.tokens_per_minute / 60
+            self._bucket = min(float(self.tokens_per_minute), self._bucket + (now - self._refilled_at) * rate)
+        self._refilled_at = now
+
+    def _next_lane(self) -> Optional[str]:
+        interactive, background = (bool(self._queues[lane]) for lane in LANES)
+        if interactive and background:
+            return "background" if self._interactive_streak >= self.background_share else "interactive"
+        if interactive:
+            return "interactive"
+        return "background" if background else None
+
+    def _dispatch(self):
+        now = time.monotonic()
+        self._refill(now)
+        wake_in = None
+        while self._running < self.max_concurrency:
+            lane = self._next_lane()
+            if lane is None:
+                break
+            if now < self._paused_until:
+                wake_in = self._paused_until - now
+                break
+            sessions = self._queues[lane]
+            session_id, queue = next(iter(sessions.items()))
+            waiter = queue[0]
+            if self.tokens_per_minute > 0:
+                # A call larger than the whole budget is let through once the bucket is full
+                needed = min(waiter.tokens, self.tokens_per_minute)
+                if self._bucket < needed:
+                    wake_in = (needed - self._bucket) / (self.tokens_per_minute / 60)
+                    break
+                self._bucket -= waiter.tokens
+
+            queue.popleft()
+            # Round-robin: the session goes to the back of its lane
+            del sessions[session_id]
+            if queue:
+                sessions[session_id] = queue
+            self._interactive_streak = self._interactive_streak + 1 if lane == "interactive" else 0
+            self._running += 1
+            self.stats["admitted"] += 1
+            waiter.granted = True
+            waiter.moved.set()
+
+        self._schedule(wake_in)
+        self._update_positions()
+
+    def _schedule(self, wake_in: Optional[float]):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if wake_in is not None and self.waiting():
+            self._timer = asyncio.get_running_loop().call_later(wake_in, self._dispatch)
+
+    def _update_positions(self):
+        """Numbers waiters in the order they would be served (ignoring background share), starting at 1."""
+        position = 0
+        for lane in LANES:
+            queues: List[Deque[_Waiter]] = list(self._queues[lane].values())
+            depth = max((len(q) for q in queues), default=0)
+            for i in range(depth):
+                for queue in queues:
+                    if i < len(queue):
+                        position += 1
+                        waiter = queue[i]
+                        if waiter.position != position:
+                            waiter.position = position
+                            waiter.moved.set()
+
+
+# Process-wide scheduler shared by every model call
+LLM_SCHEDULER = LLMScheduler()
+
+METRICS.gauge("llm_scheduler_running", "Model calls currently admitted.", collect=lambda: LLM_SCHEDULER.running)
+METRICS.gauge("llm_scheduler_waiting", "Model calls waiting for admission.", ["lane"],
+              collect=lambda: {(lane,): LLM_SCHEDULER.waiting(lane) for lane in LANES})
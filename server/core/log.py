@@ -0,0 +1,251 @@
+import os
+import sys
+import copy
+import json
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
+from typing import Dict, Optional, Tuple
+
+from server.core.metrics import METRICS
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Root level, plus per-module overrides, e.g. "server.chat=DEBUG,httpx=WARNING"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_FILE = os.getenv("LOG_FILE", os.path.join(SERVER_DIR, "agent", "agent_debug.log"))
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "3"))
+# Console output: "text", "json" or "off"
+LOG_CONSOLE = os.getenv("LOG_CONSOLE", "text").lower()
+# DEBUG records allowed per second from any one call site; the rest are counted and dropped
+LOG_DEBUG_PER_SECOND = float(os.getenv("LOG_DEBUG_PER_SECOND", "5"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+LOG_RECORDS_DROPPED = METRICS.counter("log_records_dropped_total", "Log records dropped because the log queue was full.")
+
+# Attributes every LogRecord has; anything else was passed via `extra=` and is kept as a field
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "suppressed"}
+
+_MODULE_NAMES: Dict[str, str] = {}
+
+
+def module_name(record: logging.LogRecord) -> str:
+    """
+    Dotted module name of the code that logged. Most of the server logs through the
+    root logger, so for root records it is derived from the source path.
+    """
+    if record.name != "root":
+        return record.name
+    name = _MODULE_NAMES.get(record.pathname)
+    if name is None:
+        path = os.path.splitext(os.path.abspath(record.pathname))[0]
+        root = os.path.dirname(SERVER_DIR)
+        if path.startswith(root + os.sep):
+            name = os.path.relpath(path, root).replace(os.sep, ".")
+        else:
+            name = record.module
+        _MODULE_NAMES[record.pathname] = name
+    return name
+
+
+def parse_levels(spec: str) -> Dict[str, int]:
+    """Parses "module=LEVEL,..." into level numbers; unknown levels are ignored."""
+    levels = {}
+    for item in spec.split(","):
+        module, _, level = item.partition("=")
+        number = logging.getLevelName(level.strip().upper())
+        if module.strip() and isinstance(number, int):
+            levels[module.strip()] = number
+    return levels
+
+
+class ModuleLevelFilter(logging.Filter):
+    """Applies the most specific per-module level to each record."""
+    def __init__(self, default: int, levels: Dict[str, int]):
+        super().__init__()
+        self.default = default
+        # Longest prefix first, so "server.chat.service" wins over "server"
+        self.levels = sorted(levels.items(), key=lambda item: -len(item[0]))
+        self._cache: Dict[str, int] = {}
+
+    def level_for(self, name: str) -> int:
+        level = self._cache.get(name)
+        if level is None:
+            level = self.default
+            for module, module_level in self.levels:
+                if name == module or name.startswith(module + "."):
+                    level = module_level
+                    break
+            self._cache[name] = level
+        return level
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= self.level_for(module_name(record))
+
+
+class DebugSampler(logging.Filter):
+    """
+    Rate-limits records below INFO per call site, so debug logging on per-chunk paths
+    cannot flood the queue. The number of dropped records is reported on the next one
+    that gets through.
+    """
+    def __init__(self, per_second: float = LOG_DEBUG_PER_SECOND):
+        super().__init__()
+        self.per_second = per_second
+        self._sites: Dict[Tuple[str, int], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.INFO or self.per_second <= 0:
+            return True
+        now = time.monotonic()
+        site = self._sites.get((record.pathname, record.lineno))
+        if site is None:
+            # [tokens, last refill, suppressed]
+            site = self._sites[(record.pathname, record.lineno)] = [self.per_second, now, 0]
+        site[0] = min(self.per_second, site[0] + (now - site[1]) * self.per_second)
+        site[1] = now
+        if site[0] < 1:
+            site[2] += 1
+            return False
+        site[0] -= 1
+        if site[2]:
+            record.suppressed = site[2]
+            site[2] = 0
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, module, message, extra fields and traceback."""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "module": module_name(record),
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the listener thread without ever blocking the caller: when the
+    queue is full the record is dropped and counted instead, on /metrics and in a
+    warning queued ahead of the next record that fits.
+    """
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._unreported = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge the message and render the traceback now, while args and exc_info are still
+        # valid, but keep the traceback separate so formatters can place it themselves
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            if self._unreported:
+                self.queue.put_nowait(self.prepare(logging.LogRecord(
+                    __name__, logging.WARNING, __file__, 0,
+                    f"Dropped {self._unreported} log records: the log queue was full", None, None,
+                )))
+                self._unreported = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            self._unreported += 1
+            LOG_RECORDS_DROPPED.inc()
+
+
+_LISTENER: Optional[logging.handlers.QueueListener] = None
+_HANDLER: Optional[NonBlockingQueueHandler] = None
+
+
+def configure_logging(
+    level: str = LOG_LEVEL,
+    levels: str = LOG_LEVELS,
+    log_file: Optional[str] = LOG_FILE,
+    console: str = LOG_CONSOLE,
+) -> NonBlockingQueueHandler:
+    """
+    Routes all logging through a bounded queue to a background thread that does the
+    formatting and I/O (a size-rotated JSON file and the console), so a slow disk never
+    stalls the event loop. Safe to call more than once; later calls reconfigure.
+    """
+    global _LISTENER, _HANDLER
+    shutdown_logging()
+
+    default = logging.getLevelName(level.upper())
+    if not isinstance(default, int):
+        default = logging.INFO
+    module_levels = parse_levels(levels)
+
+    outputs = []
+    if log_file:
+        os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8", delay=True
+        )
+        file_handler.setFormatter(JsonFormatter())
+        outputs.append(file_handler)
+    if console != "off":
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(JsonFormatter() if console == "json" else logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+        outputs.append(console_handler)
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    handler.addFilter(ModuleLevelFilter(default, module_levels))
+    handler.addFilter(DebugSampler())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        if isinstance(existing, NonBlockingQueueHandler):
+            root.removeHandler(existing)
+    root.addHandler(handler)
+    # Let records through to the filter for the most verbose module configured
+    root.setLevel(min([default, *module_levels.values()]))
+    for module, module_level in module_levels.items():
+        if not module.startswith("server"):
+            # Third-party loggers are named, so their level can be set directly
+            logging.getLogger(module).setLevel(module_level)
+
+    _LISTENER = logging.handlers.QueueListener(handler.queue, *outputs, respect_handler_level=True)
+    _LISTENER.start()
+    _HANDLER = handler
+    return handler
+
+
+def shutdown_logging():
+    """Flushes queued records and stops the listener thread."""
+    global _LISTENER, _HANDLER
+    if _LISTENER is not None:
+        _LISTENER.stop()
+        for output in _LISTENER.handlers:
+            output.close()
+        _LISTENER = None
+    if _HANDLER is not None:
+        logging.getLogger().removeHandler(_HANDLER)
+        _HANDLER = None
+
+
+atexit.register(shutdown_logging)
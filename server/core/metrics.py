@@ -0,0 +1,231 @@
+import math
+import logging
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+# Upper bounds in seconds; covers sub-millisecond tool calls up to multi-minute turns
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 35, 50, 75, 100, 150, 250, 500)
+
+LabelValues = Tuple[str, ...]
+# What a gauge callback returns: one value, or a value per label tuple
+Sample = Union[float, Dict[LabelValues, float]]
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[LabelValues, object] = {}
+
+    def labels(self, *values: str, **kwargs: str):
+        """The child for one combination of label values, created on first use."""
+        if kwargs:
+            values = tuple(kwargs[n] for n in self.labelnames)
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _default(self):
+        # Unlabelled metrics are their own single child
+        return self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for key, child in self._children.items():
+            lines.extend(self._render_child(key, child))
+        return lines
+
+    def _render_child(self, key: LabelValues, child) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, key)} {_format_value(child.value)}"]
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+
+class Gauge(_Metric):
+    """
+    A value that goes up and down. With `collect`, the value is read from a callback
+    at scrape time instead, so the hot path does not have to keep it up to date.
+    """
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), collect: Optional[Callable[[], Sample]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float):
+        self._default().set(value)
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._default().dec(amount)
+
+    def render(self) -> List[str]:
+        if self.collect is not None:
+            try:
+                sample = self.collect()
+            except Exception as e:
+                logging.warning(f"metrics: collecting {self.name} failed: {e}")
+                sample = {}
+            values = sample if isinstance(sample, dict) else {(): sample}
+            self._children = {}
+            for key, value in values.items():
+                self.labels(*key).set(value)
+        return super().render()
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # Per-bucket (not cumulative) counts; the last slot is +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    """
+    Fixed-bucket histogram. An observation is one binary search and three increments;
+    cumulative counts are only computed at scrape time.
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.bounds = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def _render_child(self, key: LabelValues, child: _HistogramChild) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (math.inf,), child.counts):
+            cumulative += count
+            le = 'le="' + _format_value(bound) + '"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {child.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Metrics rendered in the Prometheus text exposition format.
+
+    Metrics are updated from the event loop thread, so they keep no locks; a scrape
+    reads whatever values are current.
+    """
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            # Modules may be re-imported (tests, reloads); keep the original series
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (), collect: Optional[Callable[[], Sample]] = None) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames, collect))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide metrics registry, served at /metrics
+METRICS = MetricsRegistry()
+
+# Agent turns
+TIME_TO_FIRST_TOKEN = METRICS.histogram("agent_time_to_first_token_seconds", "Time from the start of a turn to the first streamed model token.")
+TOKENS_PER_SECOND = METRICS.histogram("agent_output_tokens_per_second", "Completion tokens per second after the first token.", buckets=RATE_BUCKETS)
+TURN_DURATION = METRICS.histogram("agent_turn_duration_seconds", "Total duration of an agent turn.", ["status"])
+TOOL_DURATION = METRICS.histogram("agent_tool_duration_seconds", "Duration of agent tool calls.", ["tool"])
+
+# Model provider
+PROVIDER_ERRORS = METRICS.counter("llm_provider_errors_total", "Failed model calls by error kind.", ["kind"])
+LLM_QUEUE_WAIT = METRICS.histogram("llm_queue_wait_seconds", "Time model calls waited for admission by the LLM scheduler.", ["lane"])
+
+# Bundling
+BUNDLE_DURATION = METRICS.histogram("bundle_duration_seconds", "Duration of bundle_workspace calls.", ["mode", "status"])
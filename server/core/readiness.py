@@ -0,0 +1,71 @@
+import time
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Dict, Optional
+
+
+@dataclass
+class Component:
+    required: bool = True
+    # "pending", "ready", "skipped" or "failed"
+    state: str = "pending"
+    seconds: Optional[float] = None
+    error: Optional[str] = None
+
+    @property
+    def done(self) -> bool:
+        return self.state in ("ready", "skipped")
+
+
+class Readiness:
+    """
+    Tracks the startup warm-up of the server's components. The server answers requests
+    before everything is warm (cold paths load on demand); readiness only reports when
+    the first turn will no longer pay for loading anything.
+    """
+    def __init__(self):
+        self.components: Dict[str, Component] = {}
+        self.started_at = time.monotonic()
+
+    def expect(self, name: str, required: bool = True):
+        self.components.setdefault(name, Component(required=required))
+
+    def skip(self, name: str, reason: str):
+        component = self.components.setdefault(name, Component())
+        component.state = "skipped"
+        component.error = reason
+
+    async def run(self, name: str, awaitable: Awaitable[Any]) -> Any:
+        """Awaits one warm-up step, recording how long it took and whether it failed."""
+        component = self.components.setdefault(name, Component())
+        start = time.perf_counter()
+        try:
+            result = await awaitable
+        except Exception as e:
+            component.state = "failed"
+            component.error = str(e) or type(e).__name__
+            logging.warning(f"Readiness: warming {name} failed: {component.error}")
+            return None
+        finally:
+            component.seconds = round(time.perf_counter() - start, 3)
+        component.state = "ready"
+        logging.info(f"Readiness: {name} warm in {component.seconds:.2f}s")
+        return result
+
+    @property
+    def ready(self) -> bool:
+        return all(c.done for c in self.components.values() if c.required)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "uptime": round(time.monotonic() - self.started_at, 3),
+            "components": {
+                name: {k: v for k, v in vars(c).items() if v is not None}
+                for name, c in self.components.items()
+            },
+        }
+
+
+# Process-wide readiness state, served at /health/ready
+READINESS = Readiness()
@@ -0,0 +1,365 @@
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from server.core.aio import run_io
+
+TRACE_DIR = os.getenv(
+    "TRACE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "generated", "traces")
+)
+# Share of turns written to disk; slow and failed turns are always kept
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.05"))
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "20"))
+# A session's trace file is rotated to `.1` once it grows past this
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(4 * 1024 * 1024)))
+# Sessions with trace files kept (least recently written go first), and how long a file
+# is kept after its last write; 0 disables either limit
+TRACE_MAX_FILES = int(os.getenv("TRACE_MAX_FILES", "200"))
+TRACE_RETENTION_DAYS = float(os.getenv("TRACE_RETENTION_DAYS", "7"))
+# Retention is applied after a write, at most this often
+TRACE_PRUNE_SECONDS = 60.0
+
+# astream_events kinds recorded as spans, with their trace category
+_SPAN_KINDS = {"chain": "graph", "chat_model": "model", "llm": "model", "tool": "tool", "retriever": "tool"}
+
+
+@dataclass
+class Span:
+    name: str
+    cat: str
+    start: float
+    parent: Optional[str] = None
+    end: Optional[float] = None
+    tid: int = 1
+    args: Dict[str, Any] = field(default_factory=dict)
+
+
+class Trace:
+    """
+    Span tree of one agent turn, built from its astream_events stream plus spans the
+    server code opens itself (scheduler waits, bundling, file writes).
+
+    Spans are laid out on Chrome trace "threads": a span goes on its parent's thread
+    when the parent is the innermost open span there, otherwise on a free thread, so
+    parallel tool calls show up side by side instead of overlapping.
+    """
+    def __init__(self, session_id: str, turn: Optional[str] = None):
+        self.session_id = session_id
+        self.turn = turn or f"{int(time.time() * 1000)}"
+        self.spans: Dict[str, Span] = {}
+        self.instants: List[Dict[str, Any]] = []
+        self._origin_wall = time.time()
+        self._origin = time.perf_counter()
+        self._stacks: Dict[int, List[str]] = {}
+        self._next_key = 0
+
+    def open(self, key: str, name: str, cat: str, parent: Optional[str] = None, start: Optional[float] = None, **args) -> Span:
+        span = Span(name=name, cat=cat, start=time.perf_counter() if start is None else start, parent=parent, args=args)
+        span.tid = self._thread_for(parent)
+        self._stacks.setdefault(span.tid, []).append(key)
+        self.spans[key] = span
+        return span
+
+    def close(self, key: str, end: Optional[float] = None, **args):
+        span = self.spans.get(key)
+        if span is None or span.end is not None:
+            return
+        span.end = time.perf_counter() if end is None else end
+        span.args.update(args)
+        stack = self._stacks.get(span.tid, [])
+        if key in stack:
+            stack.remove(key)
+
+    def new_key(self) -> str:
+        self._next_key += 1
+        return f"local-{self._next_key}"
+
+    def instant(self, name: str, cat: str, **args):
+        self.instants.append({"name": name, "cat": cat, "ts": time.perf_counter(), "args": args})
+
+    def _thread_for(self, parent: Optional[str]) -> int:
+        parent_span = self.spans.get(parent) if parent else None
+        if parent_span is not None:
+            stack = self._stacks.get(parent_span.tid)
+            if stack and stack[-1] == parent:
+                return parent_span.tid
+        tid = 1
+        while self._stacks.get(tid):
+            tid += 1
+        return tid
+
+    def record(self, event: Dict[str, Any]):
+        """Turns one astream_events v2 event into span updates."""
+        kind = event["event"]
+        if kind == "on_custom_event":
+            self.instant(event.get("name", "custom"), "custom", **(event.get("data") or {}))
+            return
+        if not kind.startswith("on_"):
+            return
+        run_type, _, phase = kind[3:].rpartition("_")
+        cat = _SPAN_KINDS.get(run_type)
+        if cat is None:
+            return
+        run_id = event["run_id"]
+        if phase == "start":
+            parents = event.get("parent_ids") or []
+            self.open(run_id, event.get("name") or run_type, cat, parent=parents[-1] if parents else None)
+        elif phase == "end":
+            self.close(run_id)
+        elif phase == "stream" and cat == "model":
+            span = self.spans.get(run_id)
+            if span is not None and "first_token_ms" not in span.args:
+                span.args["first_token_ms"] = round((time.perf_counter() - span.start) * 1000, 3)
+
+    @property
+    def duration(self) -> float:
+        ends = [s.end for s in self.spans.values() if s.end is not None]
+        return (max(ends) - self._origin) if ends else 0.0
+
+    def _us(self, t: float) -> int:
+        return int((self._origin_wall + (t - self._origin)) * 1_000_000)
+
+    def chrome_events(self) -> List[Dict[str, Any]]:
+        """The trace as Chrome trace-event "complete" and "instant" events; open spans are closed now."""
+        now = time.perf_counter()
+        pid = f"session {self.session_id}"
+        events = []
+        for key, span in self.spans.items():
+            end = span.end if span.end is not None else now
+            args = {"turn": self.turn, **span.args}
+            if span.end is None:
+                args["unfinished"] = True
+            events.append({
+                "name": span.name, "cat": span.cat, "ph": "X", "pid": pid, "tid": span.tid,
+                "ts": self._us(span.start), "dur": max(0, int((end - span.start) * 1_000_000)), "args": args,
+            })
+        for instant in self.instants:
+            events.append({
+                "name": instant["name"], "cat": instant["cat"], "ph": "i", "s": "p", "pid": pid, "tid": 1,
+                "ts": self._us(instant["ts"]), "args": {"turn": self.turn, **instant["args"]},
+            })
+        return events
+
+
+# The trace of the turn running in this context, and the innermost span opened with `span()`
+_CURRENT_TRACE: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_CURRENT_SPAN: ContextVar[Optional[str]] = ContextVar("current_span", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _CURRENT_TRACE.get()
+
+
+def _langchain_parent() -> Optional[str]:
+    # The LangChain run (tool, model call) this code runs under, if any
+    try:
+        from langchain_core.runnables.config import ensure_config
+        callbacks = ensure_config().get("callbacks")
+        parent = getattr(callbacks, "parent_run_id", None)
+        return str(parent) if parent else None
+    except Exception:
+        return None
+
+
+@contextmanager
+def span(name: str, cat: str = "app", **args) -> Iterator[Optional[Span]]:
+    """Records a span in the current turn's trace; a no-op outside of a traced turn."""
+    trace = _CURRENT_TRACE.get()
+    if trace is None:
+        yield None
+        return
+    key = trace.new_key()
+    opened = trace.open(key, name, cat, parent=_CURRENT_SPAN.get() or _langchain_parent(), **args)
+    token = _CURRENT_SPAN.set(key)
+    try:
+        yield opened
+    except BaseException as e:
+        opened.args["error"] = type(e).__name__
+        raise
+    finally:
+        _CURRENT_SPAN.reset(token)
+        trace.close(key)
+
+
+def record_span(name: str, start: float, end: float, cat: str = "app", **args):
+    """Records an already finished span (perf_counter times) in the current trace."""
+    trace = _CURRENT_TRACE.get()
+    if trace is not None:
+        key = trace.new_key()
+        trace.open(key, name, cat, parent=_CURRENT_SPAN.get() or _langchain_parent(), start=start, **args)
+        trace.close(key, end=end)
+
+
+def instant(name: str, cat: str = "app", **args):
+    trace = _CURRENT_TRACE.get()
+    if trace is not None:
+        trace.instant(name, cat, **args)
+
+
+def _log_write_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logging.warning(f"TraceStore: writing a trace failed: {task.exception()}")
+
+
+class TraceStore:
+    """
+    Writes sampled turn traces to one JSONL file of Chrome trace events per session.
+    Sampling is decided when the turn ends, so slow and failed turns are always kept.
+    Files are written off the event loop, and old ones are pruned across sessions.
+    """
+    def __init__(
+        self,
+        trace_dir: str = TRACE_DIR,
+        sample_rate: float = TRACE_SAMPLE_RATE,
+        slow_seconds: float = TRACE_SLOW_SECONDS,
+        max_bytes: int = TRACE_MAX_BYTES,
+        max_files: int = TRACE_MAX_FILES,
+        retention_days: float = TRACE_RETENTION_DAYS,
+    ):
+        self.trace_dir = Path(trace_dir)
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.retention_days = retention_days
+        self._writes: Set[asyncio.Task] = set()
+        # The latest write of each file; later writes wait for it
+        self._tails: Dict[Path, asyncio.Task] = {}
+        self._last_prune = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or self.slow_seconds > 0
+
+    @contextmanager
+    def activate(self, trace: Trace) -> Iterator[Trace]:
+        """Makes `trace` the current trace for the code (and the tasks it starts) in this block."""
+        token = _CURRENT_TRACE.set(trace)
+        try:
+            yield trace
+        finally:
+            try:
+                _CURRENT_TRACE.reset(token)
+            except ValueError:
+                # An async generator finalized from another task; its context dies with it
+                pass
+
+    def keep(self, trace: Trace, status: str) -> bool:
+        if status != "ok" or (self.slow_seconds > 0 and trace.duration >= self.slow_seconds):
+            return True
+        return random.random() < self.sample_rate
+
+    def path_for(self, session_id: str) -> Path:
+        # The readable prefix may be shared by several ids; the hash keeps their files apart
+        safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in session_id)[:48]
+        digest = hashlib.sha256(session_id.encode()).hexdigest()[:16]
+        return self.trace_dir / f"{safe}-{digest}.jsonl"
+
+    def submit(self, trace: Trace, status: str = "ok") -> Optional[asyncio.Task]:
+        """Writes the finished trace in the background if it is sampled."""
+        if not self.keep(trace, status):
+            return None
+        lines = "".join(json.dumps(e, default=str) + "\n" for e in trace.chrome_events())
+        path = self.path_for(trace.session_id)
+        task = asyncio.create_task(self._append_later(path, lines, self._tails.get(path)))
+        self._tails[path] = task
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+        task.add_done_callback(_log_write_error)
+        return task
+
+    async def _append_later(self, path: Path, lines: str, previous: Optional[asyncio.Task]):
+        # Appends to one file land in the order the traces were submitted
+        try:
+            if previous is not None:
+                await asyncio.gather(previous, return_exceptions=True)
+            await run_io(self._append, path, lines)
+        finally:
+            if self._tails.get(path) is asyncio.current_task():
+                del self._tails[path]
+
+    def _append(self, path: Path, lines: str):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            if path.stat().st_size + len(lines) > self.max_bytes:
+                path.replace(path.with_suffix(".jsonl.1"))
+        except FileNotFoundError:
+            pass
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(lines)
+        if time.monotonic() - self._last_prune >= TRACE_PRUNE_SECONDS:
+            self.prune()
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """
+        Deletes the trace files of sessions not written for `retention_days`, then those
+        of the least recently written sessions beyond `max_files`. Returns sessions removed.
+        """
+        self._last_prune = time.monotonic()
+        now = time.time() if now is None else now
+        sessions = []
+        for path in self.trace_dir.glob("*.jsonl"):
+            try:
+                sessions.append((path.stat().st_mtime, path))
+            except FileNotFoundError:
+                continue
+        sessions.sort()
+        excess = len(sessions) - self.max_files if self.max_files > 0 else 0
+        cutoff = now - self.retention_days * 86400 if self.retention_days > 0 else None
+        removed = 0
+        for i, (mtime, path) in enumerate(sessions):
+            if i < excess or (cutoff is not None and mtime < cutoff):
+                for candidate in (path, path.with_suffix(".jsonl.1")):
+                    candidate.unlink(missing_ok=True)
+                removed += 1
+        if removed:
+            logging.info(f"TraceStore: removed the traces of {removed} sessions")
+        return removed
+
+    def read(self, session_id: str, turns: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Trace events of a session, limited to its last `turns` recorded turns."""
+        path = self.path_for(session_id)
+        events = []
+        for candidate in (path.with_suffix(".jsonl.1"), path):
+            try:
+                with open(candidate, encoding="utf-8") as f:
+                    events.extend(json.loads(line) for line in f if line.strip())
+            except FileNotFoundError:
+                continue
+        if turns is not None:
+            recent = []
+            for event in events:
+                turn = event.get("args", {}).get("turn")
+                if turn not in recent:
+                    recent.append(turn)
+            keep = set(recent[-turns:]) if turns > 0 else set()
+            events = [e for e in events if e.get("args", {}).get("turn") in keep]
+        return events
+
+    def delete(self, session_id: str):
+        """Removes the session's trace files."""
+        path = self.path_for(session_id)
+        for candidate in (path, path.with_suffix(".jsonl.1")):
+            try:
+                candidate.unlink()
+            except FileNotFoundError:
+                pass
+
+    async def flush(self):
+        """Waits for pending trace writes."""
+        if self._writes:
+            await asyncio.gather(*list(self._writes), return_exceptions=True)
+
+
+# Process-wide trace store
+TRACE_STORE = TraceStore()
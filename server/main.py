@@ -1,17 +1,101 @@
 import os
+import sys
 import json
-from fastapi import FastAPI, Request
+import asyncio
+import logging
+import importlib
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import Response, StreamingResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any, Union
 
-from server.chat.service import stream_conversation # stream_openai_conversation would be next
+# Only light modules are imported up front. The agent stack (langchain, langgraph,
+# deepagents, the OpenAI client) is loaded by the background prewarm, or on first use.
+from server.bundle.service import ESBUILD_SERVICE
+from server.chat.events import dumps, sse_frame
+from server.session.events import EVENT_HEARTBEAT_SECONDS
 from server.session.store import SESSION_STORE, broadcast_event
+from server.session.pool import SESSION_POOL
+from server.session.runs import RUN_COORDINATOR, RUN_POLICIES, RunTicket, cancel_on_disconnect
+from server.core.aio import LOOP_MONITOR, run_io
+from server.core.llm.scheduler import LANES
+from server.core.metrics import METRICS
+from server.core.readiness import READINESS
+from server.core.tracing import TRACE_STORE
+from server.core.log import configure_logging
 
-app = FastAPI()
+# Logs go through a queue to a background thread; nothing on the event loop touches the disk
+configure_logging()
+
+# Modules the first agent turn needs, imported off the event loop during prewarm
+AGENT_MODULES = ("server.chat.service", "server.chat.openai_compat", "server.chat.history")
+
+async def prewarm():
+    """
+    Warms everything the first turn would otherwise pay for, in the background so the
+    server can answer (health checks, the UI) immediately. /health/ready reports progress.
+    """
+    esbuild = asyncio.create_task(READINESS.run("esbuild", ESBUILD_SERVICE.start()))
+    # New sessions claim a ready workspace instead of creating one on their first message
+    pool = asyncio.create_task(READINESS.run("session_pool", SESSION_POOL.start()))
+    await READINESS.run("imports", asyncio.to_thread(lambda: [importlib.import_module(m) for m in AGENT_MODULES]))
+
+    from server.agent.checkpoint import CHECKPOINT_STORE
+    from server.agent.skills import SKILL_REGISTRY
+    from server.chat.service import ConversationFlow, install_shared_skills
+
+    checkpointer = await READINESS.run("checkpoints", CHECKPOINT_STORE.get())
+    await READINESS.run("skills", run_io(lambda: SKILL_REGISTRY.skills(install_shared_skills())))
+
+    if not os.getenv("OPENAI_API_KEY"):
+        READINESS.skip("agent", "OPENAI_API_KEY is not set")
+        READINESS.skip("llm_pool", "OPENAI_API_KEY is not set")
+    elif checkpointer is not None:
+        from server.core.llm.registry import warm_up
+        flow = ConversationFlow()
+        model = flow.get_model()
+        # Open the shared LLM connection pool while the agent graph compiles
+        await asyncio.gather(
+            READINESS.run("llm_pool", warm_up(model)),
+            READINESS.run("agent", asyncio.to_thread(flow._get_agent, model, checkpointer)),
+        )
+    await asyncio.gather(esbuild, pool)
+
+def _loaded(module: str):
+    """The module if something already imported it; shutdown never imports anything."""
+    return sys.modules.get(module)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    for name in ("esbuild", "imports", "checkpoints", "skills", "agent"):
+        READINESS.expect(name)
+    # A failed TLS warm-up does not make the first turn slower than without it
+    READINESS.expect("llm_pool", required=False)
+    READINESS.expect("session_pool", required=False)
+    # Reports any callback that blocks the event loop past LOOP_LAG_THRESHOLD_SECONDS
+    LOOP_MONITOR.start()
+    prewarm_task = asyncio.create_task(prewarm())
+    yield
+    prewarm_task.cancel()
+    await LOOP_MONITOR.stop()
+    # Persist live sessions so their history survives the restart along with the checkpoints
+    SESSION_STORE.hibernate_all()
+    await SESSION_STORE.flush()
+    await TRACE_STORE.flush()
+    checkpoint = _loaded("server.agent.checkpoint")
+    if checkpoint is not None:
+        await checkpoint.CHECKPOINT_STORE.close()
+    await ESBUILD_SERVICE.close()
+    await SESSION_POOL.close()
+    registry = _loaded("server.core.llm.registry")
+    if registry is not None:
+        await registry.close_clients()
+
+app = FastAPI(lifespan=lifespan)
 
 # Ensure generated directory exists
 GENERATED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "generated")
@@ -31,7 +115,8 @@ app.add_middleware(
 # OpenAI Pydantic Models
 class Message(BaseModel):
     role: str
-    content: str
+    # Plain text or a list of content parts
+    content: Union[str, List[Dict[str, Any]], None] = None
 
 class ChatCompletionRequest(BaseModel):
     model: str = "deep-agent"
@@ -40,6 +125,7 @@ class ChatCompletionRequest(BaseModel):
     max_tokens: Optional[int] = None
     temperature: Optional[float] = 0.7
     user: Optional[str] = None # We will use this as session_id if provided
+    stream_options: Optional[Dict[str, Any]] = None
 
 @app.middleware("http")
 async def add_frame_headers(request: Request, call_next):
@@ -51,23 +137,52 @@ async def add_frame_headers(request: Request, call_next):
         del response.headers["X-Frame-Options"]
     return response
 
+async def guard_stream(request: Request, ticket: RunTicket, stream):
+    """Relays a run's stream, cancelling the run as soon as the client disconnects."""
+    watcher = asyncio.create_task(cancel_on_disconnect(request, ticket))
+    try:
+        async for item in stream:
+            yield item
+    finally:
+        watcher.cancel()
+
 @app.get("/agent/query")
-async def stream_agent_query(prompt: str, session_id: str = None):
+async def stream_agent_query(
+    request: Request,
+    prompt: str,
+    session_id: str = None,
+    policy: Optional[str] = None,
+    lane: str = "interactive"
+):
+    """
+    Runs one agent turn. `policy` overrides what happens when the session is already
+    running: "queue" (wait), "reject" (error) or "supersede" (cancel the running turn).
+    `lane` is the LLM scheduler priority: "interactive" or "background".
+    """
+    if policy is not None and policy not in RUN_POLICIES:
+        return JSONResponse(status_code=400, content={"error": f"policy must be one of: {', '.join(RUN_POLICIES)}"})
+    if lane not in LANES:
+        return JSONResponse(status_code=400, content={"error": f"lane must be one of: {', '.join(LANES)}"})
+    ticket = RUN_COORDINATOR.ticket(session_id, policy)
+
+    from server.chat.service import stream_conversation
+
     async def event_generator():
-        # Backward compatibility endpoint
-        async for event_type, payload in stream_conversation(prompt, session_id):
-             data = json.dumps({"type": event_type, "payload": payload})
-             yield f"data: {data}\n\n"
+        # Backward compatibility endpoint; events are serialized once, here
+        async for event in stream_conversation(prompt, session_id, ticket=ticket, lane=lane):
+            yield event.to_sse()
     
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+    return StreamingResponse(guard_stream(request, ticket, event_generator()), media_type="text/event-stream")
 
 @app.get("/agent/events/{session_id}")
-async def stream_agent_events(session_id: str):
+async def stream_agent_events(session_id: str, request: Request, last_event_id: Optional[str] = Header(None)):
     """
     Dedicated persistent event stream for a session.
+    Any number of tabs can subscribe; reconnecting clients replay missed events via Last-Event-ID.
     """
     async def event_generator():
-        if session_id not in SESSION_STORE:
+        session = await SESSION_STORE.aget(session_id)
+        if session is None:
             # Wait a bit or error? Let's verify existence or create placeholder?
             # For now, if session doesn't exist, we just wait until it might? 
             # Or simpler: return 404? 
@@ -78,49 +193,98 @@ async def stream_agent_events(session_id: str):
             # But client `useEventStream` will retry.
             return
 
-        queue = SESSION_STORE[session_id].get("event_queue")
-        if not queue:
+        bus = session.get("event_bus")
+        if not bus:
             # Should not happen if session exists
-            yield f"data: {json.dumps({'type': 'error', 'payload': 'No event queue.'})}\n\n"
+            yield f"data: {json.dumps({'type': 'error', 'payload': 'No event bus.'})}\n\n"
             return
+
+        try:
+            replay_from = int(last_event_id) if last_event_id else None
+        except ValueError:
+            replay_from = None
+        subscription = bus.subscribe(replay_from)
+        logging.debug(f"Event stream connected for {session_id} ({bus.subscriber_count} subscribers)")
         
-        print(f"[DEBUG] Event stream connected for {session_id}")
-        
+        # A connected event stream keeps the session from being hibernated
+        SESSION_STORE.pin(session_id)
         try:
-            while True:
-                # Wait for next event
-                event = await queue.get()
-                yield f"data: {json.dumps(event)}\n\n"
+            while not subscription.closed:
+                if await request.is_disconnected():
+                    break
+                event = await subscription.get(timeout=EVENT_HEARTBEAT_SECONDS)
+                if event is None:
+                    # Comment frames keep proxies from timing out and surface dead clients on write
+                    yield ": heartbeat\n\n"
+                    continue
+                yield sse_frame(event.type, event.payload, event.id)
         except Exception as e:
-            print(f"[DEBUG] Event stream disconnected for {session_id}: {e}")
+            logging.debug(f"Event stream disconnected for {session_id}: {e}")
+        finally:
+            bus.unsubscribe(subscription)
+            SESSION_STORE.release(session_id)
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
 @app.post("/v1/chat/completions")
-async def chat_completions(request: ChatCompletionRequest):
+async def chat_completions(request: ChatCompletionRequest, http_request: Request):
     """
-    OpenAI-compatible Chat Completion Endpoint (Streaming only for now).
+    OpenAI-compatible Chat Completion Endpoint.
+    `user` selects the agent session; requests without it run in a one-off session that is
+    deleted afterwards. Streaming and buffered responses are both supported.
     """
-    if not request.stream:
-        # TODO: Implement blocking mode if needed. For now, force validation error or just stream?
-        # A compliant API should handle non-stream, but we are optimizing for Agent streaming.
-        # We'll just stream and let the client handle it, or return a 400.
-        # Ideally, we buffer and return full response.
-        return JSONResponse(status_code=400, content={"error": "Only streaming is supported. Set stream=true."})
+    from server.chat.openai_compat import CompletionError, RequestError, complete_openai_conversation, stream_openai_conversation, validate_request
 
     # Prepare request dict for the adapter
     req_dict = request.model_dump()
-    
+    try:
+        validate_request(req_dict)
+    except RequestError as e:
+        return JSONResponse(status_code=400, content={"error": {"message": str(e), "type": "invalid_request_error"}})
+    ticket = RUN_COORDINATOR.ticket(request.user)
+
+    if not request.stream:
+        watcher = asyncio.create_task(cancel_on_disconnect(http_request, ticket))
+        try:
+            completion = await complete_openai_conversation(req_dict, ticket=ticket)
+        except CompletionError as e:
+            return JSONResponse(status_code=502, content={"error": {"message": str(e), "type": "agent_error"}})
+        finally:
+            watcher.cancel()
+        return Response(content=dumps(completion), media_type="application/json")
+
     return StreamingResponse(
-        stream_openai_conversation(req_dict), 
+        guard_stream(http_request, ticket, stream_openai_conversation(req_dict, ticket=ticket)),
         media_type="text/event-stream"
     )
 
 @app.get("/agent/history/{session_id}")
 async def get_agent_history(session_id: str):
-    if session_id in SESSION_STORE:
-        return JSONResponse(content=SESSION_STORE[session_id]["history"])
-    return JSONResponse(content=[])
+    from server.chat.history import visible_history
+
+    # Hibernated sessions are read from disk without being rehydrated
+    return JSONResponse(content=visible_history(await SESSION_STORE.aload_history(session_id)))
+
+@app.get("/agent/trace/{session_id}")
+async def get_agent_trace(session_id: str, turns: Optional[int] = None):
+    """
+    Recorded turn traces of a session in the Chrome trace-event format; open the JSON in
+    chrome://tracing or ui.perfetto.dev. `turns` limits it to the most recent turns.
+    """
+    events = await run_io(TRACE_STORE.read, session_id, turns)
+    if not events:
+        return JSONResponse(status_code=404, content={"error": "No trace recorded for this session."})
+    return Response(content=dumps({"traceEvents": events, "displayTimeUnit": "ms"}), media_type="application/json")
+
+@app.get("/health/ready")
+async def health_ready():
+    """200 once the agent stack is warm, 503 while warming up or if a warm-up step failed."""
+    return JSONResponse(status_code=200 if READINESS.ready else 503, content=READINESS.to_dict())
+
+@app.get("/metrics")
+async def get_metrics():
+    """Server metrics in the Prometheus text exposition format."""
+    return Response(content=METRICS.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,130 @@
+import os
+import time
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Optional, Set
+
+EVENT_BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", "256"))
+EVENT_SUBSCRIBER_QUEUE = int(os.getenv("EVENT_SUBSCRIBER_QUEUE", "64"))
+# "drop" discards the oldest queued event; "coalesce" first replaces a queued event of the same type
+EVENT_SLOW_CONSUMER_POLICY = os.getenv("EVENT_SLOW_CONSUMER_POLICY", "coalesce")
+EVENT_HEARTBEAT_SECONDS = float(os.getenv("EVENT_HEARTBEAT_SECONDS", "15"))
+
+
+@dataclass
+class SessionEvent:
+    id: int
+    type: str
+    payload: Any
+
+    def to_dict(self) -> dict:
+        return {"type": self.type, "payload": self.payload}
+
+
+class Subscription:
+    """A single consumer of a session's events, with its own bounded backlog."""
+    def __init__(self, maxsize: int, policy: str):
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self.closed = False
+        self._queue: Deque[SessionEvent] = deque()
+        self._ready = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def offer(self, event: SessionEvent):
+        """Queues an event without ever blocking the publisher."""
+        if len(self._queue) >= self.maxsize:
+            if self.policy == "coalesce" and self._coalesce(event):
+                return
+            self._queue.popleft()
+            self.dropped += 1
+        self._queue.append(event)
+        self._ready.set()
+
+    def _coalesce(self, event: SessionEvent) -> bool:
+        # The newer event supersedes the queued one of the same type
+        for i, queued in enumerate(self._queue):
+            if queued.type == event.type:
+                del self._queue[i]
+                self._queue.append(event)
+                self.dropped += 1
+                return True
+        return False
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[SessionEvent]:
+        """Next event, or None on timeout or once the subscription is closed."""
+        while not self._queue:
+            if self.closed:
+                return None
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self._queue.popleft()
+
+    def close(self):
+        self.closed = True
+        self._ready.set()
+
+
+class SessionEventBus:
+    """
+    Per-session pub/sub over a bounded ring buffer.
+
+    Every subscriber gets every event; a subscriber that falls behind loses events
+    per the slow-consumer policy instead of stalling the publisher or other tabs.
+    The ring buffer lets a reconnecting client replay what it missed via Last-Event-ID.
+    Ids start from the creation time in ms, so ids from a newer bus always sort after
+    ids from an older one for the same session.
+    """
+    def __init__(
+        self,
+        buffer_size: int = EVENT_BUFFER_SIZE,
+        subscriber_queue: int = EVENT_SUBSCRIBER_QUEUE,
+        policy: str = EVENT_SLOW_CONSUMER_POLICY,
+    ):
+        self.subscriber_queue = subscriber_queue
+        self.policy = policy
+        self._buffer: Deque[SessionEvent] = deque(maxlen=buffer_size)
+        self._subscribers: Set[Subscription] = set()
+        self._next_id = int(time.time() * 1000)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(s) for s in self._subscribers)
+
+    def publish(self, event_type: str, payload: Any) -> SessionEvent:
+        self._next_id += 1
+        event = SessionEvent(id=self._next_id, type=event_type, payload=payload)
+        self._buffer.append(event)
+        for subscription in self._subscribers:
+            subscription.offer(event)
+        return event
+
+    def subscribe(self, last_event_id: Optional[int] = None) -> Subscription:
+        """Adds a subscriber, first replaying buffered events newer than `last_event_id`."""
+        subscription = Subscription(self.subscriber_queue, self.policy)
+        if last_event_id is not None:
+            for event in self._buffer:
+                if event.id > last_event_id:
+                    subscription.offer(event)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscription.close()
+        self._subscribers.discard(subscription)
+
+    def close(self):
+        """Ends every subscription, e.g. when the session is hibernated."""
+        for subscription in list(self._subscribers):
+            self.unsubscribe(subscription)
@@ -0,0 +1,166 @@
+import os
+import uuid
+import shutil
+import asyncio
+import logging
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, Dict, Optional
+
+from server.bundle.esbuild import write_preview_html
+from server.core.aio import run_io
+from server.core.metrics import METRICS
+from server.session.events import SessionEventBus
+
+# Pooled workspaces sit next to the session workspaces, so claiming one is a rename
+WORKSPACES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "generated", "workspaces")
+
+# Ready-to-claim sessions kept warm; 0 disables the pool
+SESSION_POOL_SIZE = int(os.getenv("SESSION_POOL_SIZE", "4"))
+# Optional directory of starter files every new workspace gets, in addition to index.html
+SESSION_TEMPLATE_DIR = os.getenv("SESSION_TEMPLATE_DIR", "")
+
+
+def unshare(path: Path, keep_content: bool = True):
+    """
+    Gives a hardlinked file its own inode before it is written in place, so writes to
+    one workspace never show up in the template or in other workspaces. Without
+    `keep_content` (the file is about to be overwritten) the link is simply removed.
+    """
+    try:
+        if os.lstat(path).st_nlink <= 1:
+            return
+    except OSError:
+        return
+    if not keep_content:
+        os.unlink(path)
+        return
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    shutil.copy2(path, tmp)
+    os.replace(tmp, path)
+
+
+def link_tree(src: Path, dest: Path):
+    """Populates `dest` with hardlinks to the files under `src`, copying where linking is not possible."""
+    for root, dirs, files in os.walk(src):
+        target = dest / os.path.relpath(root, src)
+        target.mkdir(parents=True, exist_ok=True)
+        for name in files:
+            try:
+                os.link(os.path.join(root, name), target / name)
+            except OSError:
+                # Another filesystem, or one without hardlinks
+                shutil.copy2(os.path.join(root, name), target / name)
+
+
+class SessionPool:
+    """
+    Keeps a few new-session entries ready (a workspace populated from the template and
+    an event bus), so the first message of a session does not create any of it.
+
+    Pooled workspaces hold hardlinks to a shared template and are filled in the
+    background; claiming one is a single rename. The agent graph, its tools and its
+    filesystem backend are already shared by every session, so they need no pooling.
+    """
+    def __init__(self, workspaces_dir: str = WORKSPACES_DIR, size: int = SESSION_POOL_SIZE, template_dir: str = SESSION_TEMPLATE_DIR):
+        self.workspaces_dir = Path(workspaces_dir)
+        self.pool_dir = self.workspaces_dir / ".pool"
+        self.template = self.workspaces_dir / ".template"
+        self.size = size
+        self.template_dir = Path(template_dir) if template_dir else None
+        self._ready: Deque[Dict[str, Any]] = deque()
+        self._wanted: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._ready)
+
+    async def start(self):
+        """Builds the template, fills the pool and keeps it refilled in the background."""
+        if self.size <= 0 or self._task is not None:
+            return
+        self._wanted = asyncio.Event()
+        self._ready.clear()
+        await run_io(self._reset)
+        await self._fill()
+        self._task = asyncio.create_task(self._refill_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._wanted = None
+
+    def _reset(self):
+        # Workspaces pooled by an earlier process may come from an outdated template
+        shutil.rmtree(self.pool_dir, ignore_errors=True)
+        shutil.rmtree(self.template, ignore_errors=True)
+        self.pool_dir.mkdir(parents=True, exist_ok=True)
+        if self.template_dir is not None and self.template_dir.is_dir():
+            shutil.copytree(self.template_dir, self.template)
+        self.template.mkdir(parents=True, exist_ok=True)
+        write_preview_html(self.template)
+
+    def _prepare(self) -> Path:
+        # Populated under a temporary name, so a half-built workspace is never claimed
+        name = uuid.uuid4().hex
+        tmp = self.pool_dir / f".{name}.tmp"
+        link_tree(self.template, tmp)
+        path = self.pool_dir / name
+        os.rename(tmp, path)
+        return path
+
+    async def _fill(self):
+        while len(self._ready) < self.size:
+            path = await run_io(self._prepare)
+            self._ready.append({"workspace_path": path, "event_bus": SessionEventBus()})
+
+    async def _refill_loop(self):
+        while True:
+            await self._wanted.wait()
+            self._wanted.clear()
+            try:
+                await self._fill()
+            except OSError as e:
+                logging.warning(f"SessionPool: refilling failed: {e}")
+
+    @staticmethod
+    def _move(src: Path, dest: Path):
+        if dest.exists():
+            raise FileExistsError(dest)
+        os.rename(src, dest)
+
+    async def claim(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Takes a ready entry for a new session, moving its workspace into place on the
+        I/O pool. Returns None when the pool is empty (or the workspace already exists),
+        in which case the caller sets the session up itself.
+        """
+        dest = self.workspaces_dir / f"session_{session_id}"
+        entry = self._ready.popleft() if self._ready else None
+        if entry is not None:
+            try:
+                await run_io(self._move, entry["workspace_path"], dest)
+                entry["workspace_path"] = dest
+            except FileExistsError:
+                # Still unused, so it goes back for the next session
+                self._ready.appendleft(entry)
+                entry = None
+            except OSError as e:
+                logging.warning(f"SessionPool: could not claim {entry['workspace_path']}: {e}")
+                entry = None
+        if self._wanted is not None:
+            self._wanted.set()
+        POOL_CLAIMS.labels("hit" if entry is not None else "miss").inc()
+        if entry is None:
+            return None
+        logging.debug(f"SessionPool: claimed a workspace for {session_id} ({len(self._ready)} left)")
+        return entry
+
+
+# Process-wide pool of new-session entries
+SESSION_POOL = SessionPool()
+
+POOL_CLAIMS = METRICS.counter("session_pool_claims_total", "New sessions served from the pool (hit) or set up on the request path (miss).", ["result"])
+METRICS.gauge("session_pool_ready", "Pre-warmed session entries ready to claim.", collect=lambda: len(SESSION_POOL))
@@ -0,0 +1,143 @@
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, List, Optional
+
+from server.core.metrics import METRICS
+
+# What a new run does while another run of the same session is in progress:
+# "queue" waits its turn, "reject" fails fast, "supersede" cancels the runs ahead of it
+RUN_POLICIES = ("queue", "reject", "supersede")
+SESSION_RUN_POLICY = os.getenv("SESSION_RUN_POLICY", "queue")
+# Runs allowed to wait behind the active one under the "queue" policy
+SESSION_RUN_QUEUE_LIMIT = int(os.getenv("SESSION_RUN_QUEUE_LIMIT", "4"))
+RUN_DISCONNECT_POLL_SECONDS = float(os.getenv("RUN_DISCONNECT_POLL_SECONDS", "1"))
+
+
+class RunRejected(Exception):
+    """Raised when a run cannot start because the session is busy."""
+
+
+class RunTicket:
+    """
+    One requested run of a session. The coordinator binds it to the task that
+    executes the run, so cancelling the ticket cancels the run wherever it is:
+    waiting in the queue, streaming from the model, or inside a tool.
+    """
+    def __init__(self, session_id: Optional[str], policy: str = SESSION_RUN_POLICY):
+        if policy not in RUN_POLICIES:
+            raise ValueError(f"Unknown run policy {policy!r}; expected one of {', '.join(RUN_POLICIES)}")
+        self.session_id = session_id
+        self.policy = policy
+        self.task: Optional[asyncio.Task] = None
+        self.cancel_reason: Optional[str] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_reason is not None
+
+    def cancel(self, reason: str = "cancelled") -> bool:
+        """Cancels the run; returns whether a running task was interrupted."""
+        if self.cancel_reason is None:
+            self.cancel_reason = reason
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            return True
+        return False
+
+
+@dataclass
+class _SessionRuns:
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    active: Optional[RunTicket] = None
+    waiting: List[RunTicket] = field(default_factory=list)
+
+
+class RunCoordinator:
+    """
+    Serializes runs per session, so concurrent requests never interleave their
+    writes to the same history, and applies the session's busy policy.
+    """
+    def __init__(self, policy: str = SESSION_RUN_POLICY, queue_limit: int = SESSION_RUN_QUEUE_LIMIT):
+        self.policy = policy
+        self.queue_limit = queue_limit
+        self._sessions: Dict[str, _SessionRuns] = {}
+
+    def ticket(self, session_id: Optional[str], policy: Optional[str] = None) -> RunTicket:
+        return RunTicket(session_id, policy or self.policy)
+
+    def active(self, session_id: str) -> Optional[RunTicket]:
+        runs = self._sessions.get(session_id)
+        return runs.active if runs else None
+
+    def cancel(self, session_id: str, reason: str = "cancelled") -> bool:
+        """Cancels the active run and every queued run of a session."""
+        runs = self._sessions.get(session_id)
+        if runs is None:
+            return False
+        for ticket in [runs.active, *runs.waiting]:
+            if ticket is not None:
+                ticket.cancel(reason)
+        return True
+
+    @asynccontextmanager
+    async def acquire(self, ticket: RunTicket) -> AsyncIterator[RunTicket]:
+        """Holds the session for the duration of a run, waiting or failing per the ticket's policy."""
+        ticket.task = asyncio.current_task()
+        if ticket.cancelled:
+            raise asyncio.CancelledError()
+        if ticket.session_id is None:
+            # Nothing to serialize against without a session
+            yield ticket
+            return
+
+        runs = self._sessions.get(ticket.session_id)
+        if runs is None:
+            runs = self._sessions[ticket.session_id] = _SessionRuns()
+
+        if runs.lock.locked():
+            if ticket.policy == "reject":
+                raise RunRejected("A run is already in progress for this session.")
+            if ticket.policy == "supersede":
+                for other in [runs.active, *runs.waiting]:
+                    if other is not None:
+                        other.cancel("superseded")
+            elif len(runs.waiting) >= self.queue_limit:
+                raise RunRejected("Too many runs are queued for this session. Try again shortly.")
+
+        runs.waiting.append(ticket)
+        try:
+            await runs.lock.acquire()
+        finally:
+            runs.waiting.remove(ticket)
+            if not runs.lock.locked() and not runs.waiting:
+                self._sessions.pop(ticket.session_id, None)
+
+        runs.active = ticket
+        try:
+            yield ticket
+        finally:
+            runs.active = None
+            runs.lock.release()
+            if not runs.waiting:
+                self._sessions.pop(ticket.session_id, None)
+
+
+# Process-wide run coordinator
+RUN_COORDINATOR = RunCoordinator()
+
+METRICS.gauge("agent_runs", "Agent runs in progress and waiting behind another run of their session.", ["state"],
+              collect=lambda: {
+                  ("active",): sum(1 for r in RUN_COORDINATOR._sessions.values() if r.active is not None),
+                  ("queued",): sum(len(r.waiting) for r in RUN_COORDINATOR._sessions.values()),
+              })
+
+
+async def cancel_on_disconnect(request, ticket: RunTicket, poll_seconds: float = RUN_DISCONNECT_POLL_SECONDS):
+    """Cancels the ticket once the HTTP client goes away; run it as a task next to the response."""
+    while not await request.is_disconnected():
+        await asyncio.sleep(poll_seconds)
+    if ticket.cancel("disconnected"):
+        logging.info(f"RunCoordinator: client disconnected, cancelled run for {ticket.session_id}")
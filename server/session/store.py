@@ -1,12 +1,351 @@
-# In-memory session store
-SESSION_STORE = {}
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from server.core.aio import replace_text, run_io
+from server.core.metrics import METRICS
+from server.session.events import SessionEventBus
+
+# Hibernated sessions live next to the generated workspaces
+HIBERNATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "generated", "sessions")
+
+MAX_SESSIONS = int(os.getenv("SESSION_STORE_MAX_SESSIONS", "64"))
+MAX_BYTES = int(os.getenv("SESSION_STORE_MAX_BYTES", str(64 * 1024 * 1024)))
+IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", "900"))
+SWEEP_INTERVAL_SECONDS = 30.0
+
+
+def estimate_history_bytes(history: List[Dict[str, Any]]) -> int:
+    """Cheap approximation of how much memory a history list holds."""
+    total = 0
+    for msg in history:
+        content = msg.get("content")
+        total += len(content) if isinstance(content, str) else len(str(content))
+        if msg.get("tool_calls"):
+            total += len(str(msg["tool_calls"]))
+        total += 64  # Per-message dict overhead
+    return total
+
+
+class SessionStore:
+    """
+    Bounded in-memory session store with LRU eviction.
+
+    Sessions pushed out by the size/memory cap, or left idle for longer than
+    `idle_seconds`, are hibernated: their history and workspace pointer are written
+    to disk and the event bus is closed. Looking a hibernated session up again
+    rehydrates it transparently.
+
+    Pinned sessions (an active run or a connected event stream) are never evicted.
+
+    On the event loop, hibernation files are written on the I/O pool; a session stays
+    reachable (and is revived from memory) until its file is on disk. `aget` and
+    `aload_history` read hibernated sessions off the loop as well.
+    """
+    def __init__(
+        self,
+        hibernate_dir: str = HIBERNATE_DIR,
+        max_sessions: int = MAX_SESSIONS,
+        max_bytes: int = MAX_BYTES,
+        idle_seconds: float = IDLE_SECONDS,
+    ):
+        self.hibernate_dir = Path(hibernate_dir)
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+
+        self._live: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._pins: Dict[str, int] = {}
+        # Sessions being written to disk, and the write of each
+        self._hibernating: Dict[str, Dict[str, Any]] = {}
+        self._writes: Dict[str, asyncio.Task] = {}
+        self._last_sweep = time.monotonic()
+
+    # --- Mapping interface (kept compatible with the old plain dict) ---
+
+    def __getitem__(self, session_id: str) -> Dict[str, Any]:
+        entry = self.get(session_id)
+        if entry is None:
+            raise KeyError(session_id)
+        return entry
+
+    def __setitem__(self, session_id: str, entry: Dict[str, Any]):
+        entry["last_access"] = time.monotonic()
+        self._live[session_id] = entry
+        self._live.move_to_end(session_id)
+        self._sizes[session_id] = estimate_history_bytes(entry.get("history", []))
+        self._maintain()
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    def get(self, session_id: str, default: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Returns the live session, rehydrating it from disk if it was hibernated."""
+        entry = self._live.get(session_id)
+        if entry is not None:
+            self._touch(session_id, entry)
+            self._maintain()
+            return entry
+
+        entry = self._revive(session_id)
+        if entry is None:
+            entry = self._rehydrate(session_id)
+        if entry is None:
+            return default
+        self[session_id] = entry
+        return entry
+
+    async def aget(self, session_id: str, default: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Like `get`, reading a hibernated session on the I/O pool."""
+        if session_id in self._live or session_id in self._hibernating:
+            return self.get(session_id, default)
+        data = await run_io(self._read_hibernated, session_id)
+        # Another caller may have brought the session back while the file was read
+        if session_id in self._live or session_id in self._hibernating:
+            return self.get(session_id, default)
+        if data is None:
+            return default
+        entry = self._entry_from(data)
+        self[session_id] = entry
+        logging.info(f"SessionStore: rehydrated session {session_id}")
+        return entry
+
+    def peek(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Returns the session only if it is live, without touching or rehydrating it."""
+        return self._live.get(session_id)
+
+    def load_history(self, session_id: str) -> List[Dict[str, Any]]:
+        """Returns the session history, reading hibernated sessions without rehydrating them."""
+        entry = self._live.get(session_id) or self._hibernating.get(session_id)
+        if entry is not None:
+            return entry["history"]
+        data = self._read_hibernated(session_id)
+        return data["history"] if data else []
+
+    async def aload_history(self, session_id: str) -> List[Dict[str, Any]]:
+        """Like `load_history`, reading a hibernated session on the I/O pool."""
+        entry = self._live.get(session_id) or self._hibernating.get(session_id)
+        if entry is not None:
+            return entry["history"]
+        data = await run_io(self._read_hibernated, session_id)
+        return data["history"] if data else []
+
+    # --- Lifecycle ---
+
+    def pin(self, session_id: str):
+        """Marks a session as in use so it is exempt from eviction."""
+        self._pins[session_id] = self._pins.get(session_id, 0) + 1
+
+    def release(self, session_id: str):
+        """Unpins a session and re-accounts its size now that its history may have grown."""
+        count = self._pins.get(session_id, 0) - 1
+        if count > 0:
+            self._pins[session_id] = count
+        else:
+            self._pins.pop(session_id, None)
+
+        entry = self._live.get(session_id)
+        if entry is not None:
+            self._touch(session_id, entry)
+            self._sizes[session_id] = estimate_history_bytes(entry.get("history", []))
+        self._maintain()
+
+    def hibernate(self, session_id: str) -> bool:
+        """
+        Writes a live session to disk and drops it from memory. On the event loop the
+        write is started in the background; `flush` waits for it.
+        """
+        entry = self._live.get(session_id)
+        if entry is None:
+            return False
+
+        workspace_path = entry.get("workspace_path")
+        data = {
+            "session_id": session_id,
+            "workspace_path": str(workspace_path) if workspace_path else None,
+            # A copy, as a revived session may append to the history while it is written
+            "history": list(entry.get("history", [])),
+            "hibernated_at": time.time(),
+        }
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None:
+            if not self._write(session_id, data):
+                return False
+        else:
+            self._hibernating[session_id] = entry
+            self._writes[session_id] = loop.create_task(self._write_later(session_id, data, self._writes.get(session_id)))
+
+        bus = entry.get("event_bus")
+        if bus:
+            bus.close()
+        del self._live[session_id]
+        self._sizes.pop(session_id, None)
+        logging.info(f"SessionStore: hibernated session {session_id}")
+        return True
+
+    async def discard(self, session_id: str):
+        """Drops a session from memory and disk, e.g. a one-off session when its request ends."""
+        entry = self._live.pop(session_id, None)
+        self._sizes.pop(session_id, None)
+        self._hibernating.pop(session_id, None)
+        if entry is not None and entry.get("event_bus"):
+            entry["event_bus"].close()
+        write = self._writes.pop(session_id, None)
+        if write is not None:
+            await asyncio.gather(write, return_exceptions=True)
+        await run_io(self._unlink, session_id)
+
+    async def flush(self):
+        """Waits for hibernation files being written."""
+        if self._writes:
+            await asyncio.gather(*list(self._writes.values()), return_exceptions=True)
+
+    def hibernate_all(self) -> int:
+        """Hibernates every live session, e.g. on shutdown."""
+        return sum(1 for sid in list(self._live) if self.hibernate(sid))
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Hibernates every unpinned session idle for longer than `idle_seconds`."""
+        now = time.monotonic() if now is None else now
+        self._last_sweep = now
+        idle = [
+            sid for sid, entry in self._live.items()
+            if sid not in self._pins and now - entry.get("last_access", now) > self.idle_seconds
+        ]
+        return sum(1 for sid in idle if self.hibernate(sid))
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(self._sizes.values())
+
+    # --- Internals ---
+
+    def _touch(self, session_id: str, entry: Dict[str, Any]):
+        entry["last_access"] = time.monotonic()
+        self._live.move_to_end(session_id)
+
+    def _maintain(self):
+        now = time.monotonic()
+        if now - self._last_sweep >= SWEEP_INTERVAL_SECONDS:
+            self.sweep(now)
+        self._evict()
+
+    def _evict(self):
+        """Hibernates least recently used, unpinned sessions until the store fits its caps."""
+        # The most recently used session is the one the caller is about to work with
+        for session_id in list(self._live.keys())[:-1]:
+            if len(self._live) <= self.max_sessions and self.total_bytes <= self.max_bytes:
+                return
+            if session_id in self._pins:
+                continue
+            self.hibernate(session_id)
+
+    def _hibernate_path(self, session_id: str) -> Path:
+        # Hashed, so ids that differ only in characters unsafe for file names never share a file
+        digest = hashlib.sha256(session_id.encode()).hexdigest()[:32]
+        return self.hibernate_dir / f"session_{digest}.json"
+
+    def _write(self, session_id: str, data: Dict[str, Any]) -> bool:
+        try:
+            replace_text(str(self._hibernate_path(session_id)), json.dumps(data, default=str))
+        except OSError as e:
+            logging.error(f"SessionStore: failed to hibernate {session_id}: {e}")
+            return False
+        return True
+
+    async def _write_later(self, session_id: str, data: Dict[str, Any], previous: Optional[asyncio.Task]):
+        # Writes of one session land in order, so an older snapshot never replaces a newer one
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        written = await run_io(self._write, session_id, data)
+        if self._writes.get(session_id) is not asyncio.current_task():
+            return
+        del self._writes[session_id]
+        entry = self._hibernating.pop(session_id, None)
+        if not written and entry is not None and session_id not in self._live:
+            # Keep the session in memory rather than lose it
+            entry["event_bus"] = SessionEventBus()
+            self._live[session_id] = entry
+            self._sizes[session_id] = estimate_history_bytes(entry.get("history", []))
+
+    def _unlink(self, session_id: str):
+        self._hibernate_path(session_id).unlink(missing_ok=True)
+
+    def _read_hibernated(self, session_id: str) -> Optional[Dict[str, Any]]:
+        path = self._hibernate_path(session_id)
+        if not path.exists():
+            return None
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"SessionStore: failed to read hibernated session {session_id}: {e}")
+            return None
+        if data.get("session_id") != session_id:
+            logging.warning(f"SessionStore: {path.name} belongs to another session, not loading it for {session_id}")
+            return None
+        return data
+
+    def _revive(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """A session whose hibernation file is still being written, with a new event bus."""
+        entry = self._hibernating.pop(session_id, None)
+        if entry is not None:
+            entry["event_bus"] = SessionEventBus()
+        return entry
+
+    def _rehydrate(self, session_id: str) -> Optional[Dict[str, Any]]:
+        data = self._read_hibernated(session_id)
+        if data is None:
+            return None
+        logging.info(f"SessionStore: rehydrated session {session_id}")
+        return self._entry_from(data)
+
+    @staticmethod
+    def _entry_from(data: Dict[str, Any]) -> Dict[str, Any]:
+        workspace_path = data.get("workspace_path")
+        return {
+            "history": data.get("history", []),
+            "workspace_path": Path(workspace_path) if workspace_path else None,
+            "event_bus": SessionEventBus(),
+        }
+
+
+# Process-wide session store
+SESSION_STORE = SessionStore()
+
+
+def _event_bus_stats() -> Dict[tuple, float]:
+    depth = subscribers = 0
+    for entry in SESSION_STORE._live.values():
+        bus = entry.get("event_bus")
+        if bus is not None:
+            depth += bus.queue_depth
+            subscribers += bus.subscriber_count
+    return {("queued",): depth, ("subscribers",): subscribers}
+
+
+METRICS.gauge("agent_sessions", "Sessions held in memory, and how many of them are in use.", ["state"],
+              collect=lambda: {("live",): len(SESSION_STORE), ("pinned",): len(SESSION_STORE._pins)})
+METRICS.gauge("session_event_queue", "Events waiting in subscriber queues, and connected subscribers.", ["kind"],
+              collect=_event_bus_stats)
 
 async def broadcast_event(session_id: str, event_type: str, payload: dict):
     """
-    Broadcast an event to the session's event stream.
+    Broadcast an event to every subscriber of the session's event stream.
     """
-    if session_id in SESSION_STORE:
-        queue = SESSION_STORE[session_id].get("event_queue")
-        if queue:
-            await queue.put({"type": event_type, "payload": payload})
-            print(f"[DEBUG] Broadcasted {event_type} to session {session_id}", flush=True)
+    session = SESSION_STORE.peek(session_id)
+    if session:
+        bus = session.get("event_bus")
+        if bus:
+            bus.publish(event_type, payload)
+            logging.debug(f"Broadcasted {event_type} to session {session_id} ({bus.subscriber_count} subscribers)")
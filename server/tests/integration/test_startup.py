@@ -0,0 +1,53 @@
+import os
+import sys
+import json
+import subprocess
+
+# Generous enough for a cold CI disk; the agent stack alone takes several seconds to import
+IMPORT_BUDGET_SECONDS = float(os.getenv("STARTUP_IMPORT_BUDGET_SECONDS", "2.0"))
+FIRST_RESPONSE_BUDGET_SECONDS = float(os.getenv("STARTUP_FIRST_RESPONSE_BUDGET_SECONDS", "1.0"))
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+HEAVY_MODULES = ["langchain", "langchain_core", "langgraph", "deepagents", "langchain_openai", "openai"]
+
+# Runs in a fresh interpreter, so modules imported by other tests do not hide regressions.
+# Heavy modules are checked right after the import, before the lifespan prewarms them.
+PROBE = """
+import sys, json, time
+start = time.perf_counter()
+import server.main
+imported = time.perf_counter() - start
+heavy = [m for m in %r if m in sys.modules]
+
+from fastapi.testclient import TestClient
+start = time.perf_counter()
+with TestClient(server.main.app) as client:
+    response = client.get("/health/ready")
+    first_response = time.perf_counter() - start
+print(json.dumps({
+    "import_seconds": imported,
+    "first_response_seconds": first_response,
+    "status": response.status_code,
+    "body": response.json(),
+    "heavy": heavy,
+}))
+""" % (HEAVY_MODULES,)
+
+
+def run_probe():
+    env = dict(os.environ, CHECKPOINT_BACKEND="memory", LOG_CONSOLE="off", LOG_FILE="")
+    env.pop("OPENAI_API_KEY", None)
+    result = subprocess.run([sys.executable, "-c", PROBE], cwd=REPO_ROOT, env=env, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_cold_start_budget():
+    probe = run_probe()
+    assert probe["heavy"] == [], f"imported at startup: {probe['heavy']}"
+    assert probe["import_seconds"] < IMPORT_BUDGET_SECONDS, f"import took {probe['import_seconds']:.2f}s"
+    # The server answers while the agent stack is still warming in the background
+    assert probe["first_response_seconds"] < FIRST_RESPONSE_BUDGET_SECONDS, f"first response took {probe['first_response_seconds']:.2f}s"
+    assert probe["status"] in (200, 503)
+    assert set(probe["body"]["components"]) >= {"esbuild", "imports", "checkpoints", "skills", "agent"}
@@ -0,0 +1,42 @@
+from langchain_core.runnables.config import var_child_runnable_config
+
+from server.agent.factory import SafeFilesystemBackend, resolve_workspace_path
+
+
+def test_backend_root_follows_invocation_config(tmp_path):
+    ws_a = tmp_path / "a"
+    ws_b = tmp_path / "b"
+    ws_a.mkdir()
+    ws_b.mkdir()
+    backend = SafeFilesystemBackend(root_dir=tmp_path)
+
+    for ws in (ws_a, ws_b):
+        token = var_child_runnable_config.set({"configurable": {"workspace_path": str(ws)}})
+        try:
+            assert resolve_workspace_path() == ws
+            backend.write("/widget.jsx", f"// {ws.name}")
+        finally:
+            var_child_runnable_config.reset(token)
+
+    assert (ws_a / "widget.jsx").read_text() == "// a"
+    assert (ws_b / "widget.jsx").read_text() == "// b"
+    assert not (tmp_path / "widget.jsx").exists()
+
+
+def test_resolve_workspace_path_outside_run():
+    assert resolve_workspace_path() is None
+    assert resolve_workspace_path({"configurable": {}}) is None
+
+
+def test_agent_template_follows_the_model_instance(monkeypatch):
+    import server.agent.factory as factory
+
+    monkeypatch.setattr(factory, "_AGENT_TEMPLATES", {})
+    monkeypatch.setattr(factory, "create_skilled_deep_agent", lambda model, **kwargs: ("agent", model))
+    first, second = object(), object()
+
+    agent = factory.get_agent_template(first, "m")
+    assert factory.get_agent_template(first, "m") is agent
+    # A model recreated after the registry closed its clients must not reuse the old graph
+    assert factory.get_agent_template(second, "m") == ("agent", second)
+    assert len(factory._AGENT_TEMPLATES) == 1
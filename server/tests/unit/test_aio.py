@@ -0,0 +1,51 @@
+import asyncio
+import logging
+import time
+from contextvars import ContextVar
+
+import pytest
+
+from server.core.aio import LoopLagMonitor, read_text, replace_text, run_io, write_text
+
+REQUEST = ContextVar("request", default=None)
+
+
+def test_run_io_keeps_context_and_file_helpers(tmp_path):
+    async def scenario():
+        REQUEST.set("abc")
+        seen = await run_io(REQUEST.get)
+        await write_text(tmp_path / "nested" / "a.txt", "hello")
+        return seen, await read_text(tmp_path / "nested" / "a.txt"), await read_text(tmp_path / "missing.txt")
+
+    assert asyncio.run(scenario()) == ("abc", "hello", None)
+    assert [p.name for p in (tmp_path / "nested").iterdir()] == ["a.txt"]
+
+
+def test_failed_replace_leaves_no_temporary_file(tmp_path):
+    (tmp_path / "target").mkdir()  # A directory cannot be replaced by a file
+
+    with pytest.raises(OSError):
+        replace_text(str(tmp_path / "target"), "hello")
+    with pytest.raises(UnicodeEncodeError):
+        replace_text(str(tmp_path / "a.txt"), "\u00e9", encoding="ascii")
+    assert [p.name for p in tmp_path.iterdir()] == ["target"]
+
+
+def test_loop_lag_monitor_reports_the_blocking_call(caplog):
+    monitor = LoopLagMonitor(threshold=0.05, interval=0.02)
+
+    def blocking_call():
+        time.sleep(0.3)
+
+    async def scenario():
+        monitor.start()
+        await asyncio.sleep(0.05)
+        blocking_call()
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+
+    with caplog.at_level(logging.WARNING):
+        asyncio.run(scenario())
+    assert monitor.stalls == 1
+    [record] = [r for r in caplog.records if "Event loop blocked" in r.getMessage()]
+    assert "blocking_call" in record.getMessage()
@@ -0,0 +1,50 @@
+import asyncio
+import json
+
+import server.agent.tools as tools
+from server.bundle.esbuild import BundleResult
+
+
+def run_build(workspace, monkeypatch, result, broadcasts=None, **args):
+    async def broadcast(session_id, event_type, payload):
+        broadcasts.append((session_id, event_type, payload))
+
+    monkeypatch.setattr(tools, "bundle_workspace", lambda path: asyncio.sleep(0, result))
+    monkeypatch.setattr(tools, "broadcast_event", broadcast)
+    config = {"configurable": {"workspace_path": str(workspace), "session_id": "build-widget-test"}}
+    return json.loads(asyncio.run(tools.build_widget.ainvoke(args, config=config)))
+
+
+def test_build_widget_writes_bundles_and_previews(tmp_path, monkeypatch):
+    broadcasts = []
+    report = run_build(tmp_path, monkeypatch, BundleResult(ok=True), broadcasts, title="Clock", width=9,
+                       files={"widget.jsx": "export default function Widget() {}", "parts/Face.jsx": "x"})
+
+    assert report["ok"] is True
+    assert report["written"] == ["widget.jsx", "parts/Face.jsx"]
+    assert (tmp_path / "parts" / "Face.jsx").read_text() == "x"
+    assert json.loads((tmp_path / "widget.json").read_text()) == {"title": "Clock", "width": 4, "height": 2}
+    [(session_id, event_type, manifest)] = broadcasts
+    assert (session_id, event_type) == ("build-widget-test", "preview")
+    assert manifest["title"] == "Clock" and manifest["dimensions"] == {"w": 4, "h": 2}
+
+
+def test_build_widget_reports_structured_errors(tmp_path, monkeypatch):
+    errors = [{"text": "Unexpected \"}\"", "file": "widget.jsx", "line": 3, "column": 4}]
+    report = run_build(tmp_path, monkeypatch, BundleResult(ok=False, error="...", messages=errors),
+                       title="Broken", files={"widget.jsx": "export default () => {"})
+    assert report["ok"] is False
+    assert report["errors"] == errors
+
+
+def test_build_widget_rejects_paths_outside_the_workspace(tmp_path, monkeypatch):
+    report = run_build(tmp_path / "ws", monkeypatch, BundleResult(ok=True), title="x", files={"../escape.jsx": "x"})
+    assert report["ok"] is False
+    assert not (tmp_path / "escape.jsx").exists()
+
+
+def test_build_widget_rejects_reserved_files_under_any_spelling(tmp_path, monkeypatch):
+    for name in ("./widget.json", "x/../index.html", "/widget.bundled.js"):
+        report = run_build(tmp_path, monkeypatch, BundleResult(ok=True), title="x", files={name: "x"})
+        assert report["ok"] is False and "generated by build_widget" in report["errors"][0]["text"]
+    assert not (tmp_path / "index.html").exists()
@@ -0,0 +1,69 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from server.bundle.cache import BundleCache, bundle_cache_key, resolve_local_imports
+
+FLAGS = ["--bundle", "--format=esm"]
+
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    return path
+
+
+def test_key_covers_entry_and_local_imports_only(tmp_path):
+    entry = write(tmp_path / "widget.jsx", "import Card from './components/Card';\nimport { X } from 'lucide-react';\n")
+    card = write(tmp_path / "components" / "Card.jsx", "export default () => null;\n")
+    write(tmp_path / "notes.txt", "unrelated")
+
+    assert resolve_local_imports(entry) == [entry.resolve(), card.resolve()]
+
+    key = bundle_cache_key(entry, FLAGS)
+    write(tmp_path / "notes.txt", "still unrelated")
+    assert bundle_cache_key(entry, FLAGS) == key
+
+    write(card, "export default () => 1;\n")
+    changed = bundle_cache_key(entry, FLAGS)
+    assert changed != key
+    assert bundle_cache_key(entry, FLAGS + ["--minify"]) != changed
+
+
+def test_restore_and_size_bounded_eviction(tmp_path):
+    cache = BundleCache(cache_dir=str(tmp_path / "cache"), max_bytes=250)
+    out = write(tmp_path / "out.js", "a" * 100)
+    dest = tmp_path / "restored.js"
+
+    assert not cache.restore("k1", dest)
+    cache.put("k1", out)
+    assert cache.restore("k1", dest)
+    assert dest.read_text() == "a" * 100
+
+    os.utime(tmp_path / "cache" / "k1.js", (1, 1))  # Make k1 the least recently used
+    cache.put("k2", out)
+    cache.put("k3", out)
+
+    assert cache.total_bytes <= 250
+    assert not cache.restore("k1", dest)
+    assert cache.restore("k3", dest)
+
+
+def test_concurrent_puts_keep_the_size_accounting(tmp_path):
+    cache = BundleCache(cache_dir=str(tmp_path / "cache"), max_bytes=10_000)
+    outs = [write(tmp_path / f"out{i}.js", "b" * 100) for i in range(4)]
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(lambda i: cache.put(f"k{i % 8}", outs[i % 4]), range(64)))
+
+    assert cache.total_bytes == 800
+    assert sorted(p.name for p in (tmp_path / "cache").iterdir()) == sorted(f"k{i}.js" for i in range(8))
+
+
+def test_put_failure_is_logged_not_raised(tmp_path, caplog):
+    blocked = write(tmp_path / "cache", "not a directory")
+    cache = BundleCache(cache_dir=str(blocked), max_bytes=1000)
+    out = write(tmp_path / "out.js", "a" * 10)
+
+    cache.put("k1", out)
+    assert "could not store k1" in caplog.text
+    assert not cache.restore("k1", tmp_path / "restored.js")
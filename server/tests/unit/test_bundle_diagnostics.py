@@ -0,0 +1,59 @@
+import asyncio
+
+from server.bundle.diagnostics import DiagnosticsCache, check_workspace
+from server.bundle.service import format_messages
+
+
+def check(workspace, transform=None, cache=None):
+    return asyncio.run(check_workspace(workspace, transform, DiagnosticsCache() if cache is None else cache))
+
+
+def test_reports_disallowed_imports_and_missing_default_export(tmp_path):
+    (tmp_path / "widget.jsx").write_text(
+        'import { useState } from "react";\n'
+        'import { FaBeer } from "react-icons/fa";\n'
+        'import Chart from "./Chart";\n'
+        'export function Widget() { return null; }\n'
+    )
+    diagnostics = check(tmp_path)
+    assert [(d["file"], d["line"], d["column"]) for d in diagnostics] == [
+        ("widget.jsx", 2, 24), ("widget.jsx", 4, 0), ("widget.jsx", 3, 19)
+    ]
+    assert "lucide-react" in diagnostics[0]["suggestion"]
+    assert "export default function Widget" in diagnostics[1]["suggestion"]
+    assert diagnostics[2]["text"] == 'Could not resolve "./Chart".'
+
+
+def test_clean_workspace_has_no_diagnostics(tmp_path):
+    (tmp_path / "widget.jsx").write_text('import { Sun } from "lucide-react";\nimport Part from "./Part";\nexport default function Widget() { return <Part />; }\n')
+    (tmp_path / "Part.jsx").write_text("export default () => null;\n")
+    assert check(tmp_path) == []
+
+
+def test_syntax_errors_are_cached_per_file_hash(tmp_path):
+    calls = []
+
+    async def transform(source, file):
+        calls.append(file)
+        if "<div>;" in source:
+            return [{"text": "Unexpected end of file", "file": file, "line": 1, "column": 40}]
+        return []
+
+    cache = DiagnosticsCache()
+    (tmp_path / "widget.jsx").write_text("export default function Widget() { <div>; }\n")
+    first = check(tmp_path, transform, cache)
+    again = check(tmp_path, transform, cache)
+    assert first == again == [{
+        "file": "widget.jsx", "line": 1, "column": 40, "text": "Unexpected end of file",
+        "suggestion": "A brace, parenthesis, JSX tag or string is not closed.",
+    }]
+    assert calls == ["widget.jsx"]
+
+    (tmp_path / "widget.jsx").write_text("export default function Widget() { return <div />; }\n")
+    assert check(tmp_path, transform, cache) == []
+    assert len(calls) == 2
+
+
+def test_format_messages_includes_suggestions():
+    text = format_messages([{"text": "Bad import", "file": "widget.jsx", "line": 1, "column": 0, "suggestion": "Use lucide-react."}])
+    assert text.splitlines() == ["widget.jsx:1:0: ERROR: Bad import", "    fix: Use lucide-react."]
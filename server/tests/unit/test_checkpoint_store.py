@@ -0,0 +1,68 @@
+import asyncio
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.graph import START, MessagesState, StateGraph
+
+from server.agent.checkpoint import CheckpointStore
+
+
+def echo_graph(checkpointer):
+    graph = StateGraph(MessagesState)
+    graph.add_node("echo", lambda state: {"messages": [AIMessage(content=f"echo {len(state['messages'])}")]})
+    graph.add_edge(START, "echo")
+    return graph.compile(checkpointer=checkpointer)
+
+
+def test_thread_resumes_from_sqlite_and_only_needs_new_messages(tmp_path):
+    path = str(tmp_path / "ck.sqlite")
+    config = {"configurable": {"thread_id": "s1"}}
+
+    async def first_process():
+        store = CheckpointStore(path=path, backend="sqlite")
+        assert not await store.has_thread("s1")
+        await echo_graph(await store.get()).ainvoke({"messages": [HumanMessage(content="hi")]}, config)
+        await store.close()
+
+    async def second_process():
+        store = CheckpointStore(path=path, backend="sqlite")
+        assert await store.has_thread("s1")
+        result = await echo_graph(await store.get()).ainvoke({"messages": [HumanMessage(content="again")]}, config)
+        await store.close()
+        return [m.content for m in result["messages"]]
+
+    asyncio.run(first_process())
+    assert asyncio.run(second_process()) == ["hi", "echo 1", "again", "echo 3"]
+
+
+def test_prune_drops_oversized_threads_and_compact_expires_idle_ones(tmp_path):
+    async def scenario():
+        store = CheckpointStore(path=str(tmp_path / "ck.sqlite"), backend="sqlite", max_per_thread=4, retention_days=1)
+        graph = echo_graph(await store.get())
+        config = {"configurable": {"thread_id": "s1"}}
+
+        await graph.ainvoke({"messages": [HumanMessage(content="1")]}, config)
+        assert not await store.prune("s1")
+        await graph.ainvoke({"messages": [HumanMessage(content="2")]}, config)
+        assert await store.prune("s1")
+        assert not await store.has_thread("s1")
+
+        await graph.ainvoke({"messages": [HumanMessage(content="3")]}, {"configurable": {"thread_id": "s2"}})
+        await store.prune("s2")
+        await store._conn.execute("UPDATE thread_activity SET updated_at = ?", (time.time() - 2 * 86400,))
+        deleted = await store.compact()
+        has_s2 = await store.has_thread("s2")
+        await store.close()
+        return deleted, has_s2
+
+    assert asyncio.run(scenario()) == (2, False)
+
+
+def test_memory_backend():
+    async def scenario():
+        store = CheckpointStore(backend="memory", max_per_thread=2)
+        graph = echo_graph(await store.get())
+        await graph.ainvoke({"messages": [HumanMessage(content="1")]}, {"configurable": {"thread_id": "s1"}})
+        return await store.has_thread("s1"), await store.prune("s1"), await store.has_thread("s1")
+
+    assert asyncio.run(scenario()) == (True, True, False)
@@ -0,0 +1,104 @@
+import asyncio
+
+from server.chat.coalesce import coalesce_events
+from server.chat.events import StreamEvent
+
+
+async def scripted(items):
+    for item in items:
+        if isinstance(item, (int, float)):
+            await asyncio.sleep(item)
+        else:
+            yield item
+
+
+def run(items, **kwargs):
+    async def collect():
+        return [(e.type, e.payload) async for e in coalesce_events(scripted(items), **kwargs)]
+    return asyncio.run(collect())
+
+
+def test_merges_same_type_runs_and_flushes_on_type_change():
+    events = run([
+        StreamEvent("reasoning", "a"), StreamEvent("reasoning", "b"),
+        StreamEvent("chunk", "c"), StreamEvent("chunk", "d"),
+        StreamEvent("done", "[DONE]"),
+    ], latency_ms=1000)
+    assert events == [("reasoning", "ab"), ("chunk", "cd"), ("done", "[DONE]")]
+
+
+def test_flush_events_and_size_threshold():
+    events = run([
+        StreamEvent("chunk", "ab"), StreamEvent("chunk", "cd"), StreamEvent("chunk", "e"),
+        StreamEvent("chunk", "> Running tool", flush=True),
+        StreamEvent("chunk", "f"),
+    ], latency_ms=1000, max_chars=4)
+    assert events == [("chunk", "abcd"), ("chunk", "e"), ("chunk", "> Running tool"), ("chunk", "f")]
+
+
+def test_latency_budget_flushes_when_upstream_stalls():
+    events = run([StreamEvent("chunk", "a"), StreamEvent("chunk", "b"), 0.2, StreamEvent("chunk", "c")], latency_ms=20)
+    assert events == [("chunk", "ab"), ("chunk", "c")]
+
+
+def test_disabled_passes_events_through():
+    events = run([StreamEvent("chunk", "a"), StreamEvent("chunk", "b")], latency_ms=0)
+    assert events == [("chunk", "a"), ("chunk", "b")]
+
+
+def test_early_exit_closes_the_source():
+    closed = []
+
+    async def source():
+        try:
+            while True:
+                yield StreamEvent("status", "tick")
+                await asyncio.sleep(0)
+        finally:
+            closed.append(True)
+
+    async def consume():
+        stream = coalesce_events(source(), latency_ms=10)
+        async for _ in stream:
+            break
+        await stream.aclose()
+
+    asyncio.run(consume())
+    assert closed == [True]
+
+
+def test_pump_cancelled_on_a_full_queue_ends_the_stream():
+    # A superseded run cancels the task draining the source, here while the queue is full
+    async def source():
+        asyncio.get_running_loop().call_later(0.05, asyncio.current_task().cancel)
+        for i in range(1000):
+            yield StreamEvent("status", i)
+
+    async def consume():
+        events = []
+        async for event in coalesce_events(source(), latency_ms=10):
+            if not events:
+                await asyncio.sleep(0.1)
+            events.append(event)
+        return events
+
+    events = asyncio.run(asyncio.wait_for(consume(), 2))
+    assert 256 <= len(events) < 1000
+    assert [e.payload for e in events] == list(range(len(events)))
+
+
+def test_source_errors_are_raised_after_pending_text():
+    async def source():
+        yield StreamEvent("chunk", "a")
+        raise RuntimeError("boom")
+
+    async def consume():
+        events = []
+        try:
+            async for event in coalesce_events(source(), latency_ms=1000):
+                events.append((event.type, event.payload))
+        except RuntimeError as e:
+            events.append(("error", str(e)))
+        return events
+
+    assert asyncio.run(consume()) == [("chunk", "a"), ("error", "boom")]
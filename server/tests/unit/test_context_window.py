@@ -0,0 +1,55 @@
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+
+from server.agent.middleware import ContextWindowMiddleware, split_turns
+from server.chat.history import session_messages, visible_history
+
+
+def turn(i, tool_output=""):
+    messages = [HumanMessage(content=f"request {i}")]
+    if tool_output:
+        messages += [
+            AIMessage(content="", tool_calls=[{"name": "read_file", "args": {}, "id": f"c{i}"}]),
+            ToolMessage(content=tool_output, tool_call_id=f"c{i}"),
+        ]
+    return messages + [AIMessage(content=f"answer {i}")]
+
+
+def test_within_budget_is_untouched():
+    messages = turn(1) + turn(2)
+    assert ContextWindowMiddleware(token_budget=10_000).window(messages) is messages
+
+
+def test_elides_old_tool_output_before_dropping_turns():
+    messages = turn(1, "x" * 4000) + turn(2) + turn(3)
+    window = ContextWindowMiddleware(token_budget=600, keep_turns=2, tool_output_chars=100).window(messages)
+    assert len(window) == len(messages)
+    assert window[2].content.startswith("x" * 100) and "3900 characters of tool output elided" in window[2].content
+    assert messages[2].content == "x" * 4000  # The stored message is not modified
+
+
+def test_drops_oldest_turns_in_blocks_with_a_summary():
+    messages = [m for i in range(10) for m in turn(i, "y" * 400)]
+    middleware = ContextWindowMiddleware(token_budget=700, keep_turns=2, tool_output_chars=1000, drop_block=4)
+    window = middleware.window(messages)
+
+    assert isinstance(window[0], SystemMessage) and "8 earlier turns were elided" in window[0].content
+    assert "- request 0" in window[0].content and "- request 7" in window[0].content
+    turns = split_turns(window[1:])
+    assert [t[0].content for t in turns] == ["request 8", "request 9"]
+    # Tool calls keep their results
+    assert all(isinstance(t[2], ToolMessage) for t in turns)
+
+
+def test_converted_history_is_incremental():
+    entry = {"history": [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello", "tool_calls": []}]}
+    first = session_messages(entry)
+    kept = first[0]
+    entry["history"] += [
+        {"role": "user", "content": "build"},
+        {"role": "assistant", "content": "", "tool_calls": [{"name": "ls", "args": {}, "id": "c1"}]},
+        {"role": "tool", "content": "[]", "tool_call_id": "c1", "name": "ls"},
+    ]
+    messages = session_messages(entry)
+    assert messages[0] is kept
+    assert [type(m).__name__ for m in messages] == ["HumanMessage", "AIMessage", "HumanMessage", "AIMessage", "ToolMessage"]
+    assert [m["role"] for m in visible_history(entry["history"])] == ["user", "assistant", "user", "assistant"]
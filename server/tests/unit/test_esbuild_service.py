@@ -0,0 +1,118 @@
+import sys
+import asyncio
+
+import pytest
+
+import server.bundle.service as service_module
+from server.bundle.esbuild import OUTPUT_FILE
+from server.bundle.service import EsbuildService, EsbuildWorker, EsbuildWorkerError, format_messages
+
+# Stands in for esbuild_worker.mjs: floods stderr, echoes requests and dies on "exit"
+FAKE_WORKER = """
+import sys, json
+sys.stderr.write("noise" * 8_000_000)  # Past what the stream buffers before pausing the pipe
+sys.stderr.flush()
+for line in sys.stdin:
+    request = json.loads(line)
+    if request["op"] == "exit":
+        sys.exit(3)
+    print(json.dumps({"id": request["id"], "ok": True}), flush=True)
+"""
+
+
+def test_format_messages_matches_cli_shape():
+    text = format_messages([
+        {"text": "Unexpected \"}\"", "file": "widget.jsx", "line": 3, "column": 4, "lineText": "  }}"},
+        {"text": "Could not resolve \"lodash\""},
+    ])
+    assert text.splitlines() == [
+        'widget.jsx:3:4: ERROR: Unexpected "}"',
+        "      }}",
+        'ERROR: Could not resolve "lodash"',
+    ]
+
+
+def test_worker_rebuilds_and_reports_errors(tmp_path):
+    service = EsbuildService(workers=1, max_concurrency=1)
+    if not service.available:
+        pytest.skip("node or the esbuild package is not installed")
+
+    async def scenario():
+        (tmp_path / "widget.jsx").write_text("export default function Widget() { return <div>hi</div>; }\n")
+        try:
+            first = await service.build(tmp_path)
+            second = await service.build(tmp_path)
+            (tmp_path / "widget.jsx").write_text("export default function Widget() { return <div>; }\n")
+            broken = await service.build(tmp_path)
+        finally:
+            await service.close()
+        return first, second, broken
+
+    first, second, broken = asyncio.run(scenario())
+    assert first.ok and second.ok
+    assert (tmp_path / OUTPUT_FILE).exists()
+    assert not broken.ok
+    assert "widget.jsx:1:" in broken.error
+
+
+def test_parse_cli_errors():
+    from server.bundle.esbuild import parse_cli_errors
+    stderr = (
+        '✘ [ERROR] Could not resolve "./nope"\n\n'
+        '    widget.jsx:1:14:\n'
+        '      1 │ import x from "./nope";\n'
+        '        ╵               ~~~~~~~~\n\n'
+        '✘ [ERROR] Unexpected end of file\n\n'
+        '2 errors\n'
+    )
+    assert parse_cli_errors(stderr) == [
+        {"text": 'Could not resolve "./nope"', "file": "widget.jsx", "line": 1, "column": 14},
+        {"text": "Unexpected end of file"},
+    ]
+
+
+def test_transform_routes_by_workspace_and_shares_build_limits(monkeypatch):
+    monkeypatch.setattr(EsbuildService, "available", property(lambda self: True))
+    service = EsbuildService(workers=4, max_concurrency=1)
+    used = []
+
+    for worker in service.workers:
+        async def request(op, worker=worker, **payload):
+            used.append((worker.index, service._semaphore.locked()))
+            return {"ok": True, "errors": []}
+        worker.request = request
+
+    async def scenario():
+        for ws in ("/ws/a", "/ws/b", "/ws/c"):
+            assert await service.transform("x", "widget.jsx", workspace=ws) == []
+            assert used[-1] == (service._worker_for(ws).index, True)
+        # Every slot taken and the queue full: the check is skipped, not queued
+        async with service._slot() as admitted:
+            assert admitted and service._semaphore.locked()
+            service.max_queue = 0
+            return await service.transform("x", "widget.jsx", workspace="/ws/a")
+
+    assert asyncio.run(scenario()) is None
+    assert len({index for index, _ in used}) > 1
+
+
+def test_worker_drains_stderr_and_restarts_with_its_own_requests(tmp_path, monkeypatch):
+    script = tmp_path / "worker.py"
+    script.write_text(FAKE_WORKER)
+    monkeypatch.setattr(service_module, "NODE_BINARY", sys.executable)
+    monkeypatch.setattr(service_module, "WORKER_SCRIPT", str(script))
+    worker = EsbuildWorker(0)
+
+    async def scenario():
+        try:
+            assert (await asyncio.wait_for(worker.request("ping"), timeout=10))["ok"]
+            with pytest.raises(EsbuildWorkerError):
+                await asyncio.wait_for(worker.request("exit"), timeout=10)
+            # The replacement process answers; the old process's exit does not fail its requests
+            results = await asyncio.wait_for(asyncio.gather(*(worker.request("ping") for _ in range(5))), timeout=10)
+            assert all(r["ok"] for r in results)
+            assert worker.restarts == 1
+        finally:
+            await worker.stop()
+
+    asyncio.run(scenario())
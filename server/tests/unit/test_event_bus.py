@@ -0,0 +1,60 @@
+import asyncio
+
+from server.session.events import SessionEventBus
+
+
+def drain(subscription):
+    async def collect():
+        events = []
+        while True:
+            event = await subscription.get(timeout=0)
+            if event is None:
+                return events
+            events.append(event)
+    return asyncio.run(collect())
+
+
+def test_every_subscriber_gets_every_event():
+    bus = SessionEventBus()
+    first, second = bus.subscribe(), bus.subscribe()
+    bus.publish("preview", {"id": 1})
+    bus.publish("status", "ok")
+
+    assert [e.type for e in drain(first)] == ["preview", "status"]
+    assert [e.type for e in drain(second)] == ["preview", "status"]
+
+
+def test_last_event_id_replays_missed_events():
+    bus = SessionEventBus(buffer_size=3)
+    events = [bus.publish("status", i) for i in range(5)]
+
+    replayed = drain(bus.subscribe(last_event_id=events[2].id))
+    assert [e.payload for e in replayed] == [3, 4]
+    # Older events have fallen out of the ring buffer
+    assert [e.payload for e in drain(bus.subscribe(last_event_id=0))] == [2, 3, 4]
+
+
+def test_slow_consumer_policies():
+    dropping = SessionEventBus(subscriber_queue=2, policy="drop")
+    sub = dropping.subscribe()
+    for i in range(4):
+        dropping.publish("status", i)
+    assert [e.payload for e in drain(sub)] == [2, 3]
+    assert sub.dropped == 2
+
+    coalescing = SessionEventBus(subscriber_queue=2, policy="coalesce")
+    sub = coalescing.subscribe()
+    coalescing.publish("preview", "a")
+    coalescing.publish("status", "working")
+    coalescing.publish("status", "done")
+    assert [(e.type, e.payload) for e in drain(sub)] == [("preview", "a"), ("status", "done")]
+
+
+def test_close_ends_subscriptions():
+    bus = SessionEventBus()
+    sub = bus.subscribe()
+    bus.close()
+
+    assert sub.closed
+    assert asyncio.run(sub.get(timeout=1)) is None
+    assert bus.subscriber_count == 0
@@ -0,0 +1,72 @@
+import asyncio
+import json
+
+import pytest
+
+import server.agent.factory as factory
+import server.agent.tools as tools
+from server.agent.factory import SafeFilesystemBackend
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return SafeFilesystemBackend(root_dir=tmp_path)
+
+
+def write_lines(path, count):
+    path.write_text("".join(f"line {i}\n" for i in range(count)))
+
+
+@pytest.mark.parametrize("mmap_min", [1 << 30, 1])
+def test_read_returns_the_requested_window(tmp_path, backend, monkeypatch, mmap_min):
+    monkeypatch.setattr(factory, "FS_MMAP_MIN_BYTES", mmap_min)
+    write_lines(tmp_path / "big.txt", 100)
+
+    result = backend.read("/big.txt", offset=10, limit=5)
+    assert result.file_data["content"] == "".join(f"line {i}\n" for i in range(10, 15))
+    assert (result.total_lines, result.start_line, result.end_line, result.next_offset) == (100, 11, 15, 15)
+
+    last = backend.read("big.txt", offset=98, limit=5)
+    assert last.file_data["content"] == "line 98\nline 99\n"
+    assert (last.end_line, last.next_offset) == (100, None)
+
+    assert "exceeds file length (100 lines)" in backend.read("big.txt", offset=100).error
+
+
+def test_long_windows_are_cut_at_a_line_with_a_marker(tmp_path, backend, monkeypatch):
+    monkeypatch.setattr(factory, "FS_READ_MAX_BYTES", 64)
+    monkeypatch.setattr(factory, "FS_MMAP_MIN_BYTES", 1)
+    write_lines(tmp_path / "big.txt", 100)
+
+    result = backend.read("big.txt", offset=0, limit=50)
+    source, marker = result.file_data["content"].split("\n\n")
+    assert source.split("\n") == [f"line {i}" for i in range(9)]
+    assert (result.end_line, result.next_offset, result.total_lines) == (9, 9, 100)
+    assert "[truncated at the 64-byte read limit" in marker and "790 bytes, 100 lines" in marker and "offset=9" in marker
+
+
+def test_overlong_line_points_to_read_range(tmp_path, backend, monkeypatch):
+    monkeypatch.setattr(factory, "FS_READ_MAX_BYTES", 32)
+    (tmp_path / "widget.bundled.js").write_text("x" * 500 + "\nend\n")
+
+    result = backend.read("widget.bundled.js")
+    assert result.file_data["content"].startswith("x" * 32 + "\n\n[truncated")
+    assert "rest of line 1 needs read_range" in result.file_data["content"]
+    assert (result.end_line, result.next_offset) == (1, 1)
+
+
+@pytest.mark.parametrize("mmap_min", [1 << 30, 1])
+def test_read_range_returns_bytes_with_size_metadata(tmp_path, monkeypatch, mmap_min):
+    monkeypatch.setattr(factory, "FS_MMAP_MIN_BYTES", mmap_min)
+    monkeypatch.setattr(factory, "FS_READ_MAX_BYTES", 8)
+    (tmp_path / "data.txt").write_text("0123456789abcdef")
+    config = {"configurable": {"workspace_path": str(tmp_path)}}
+
+    def read_range(**args):
+        return json.loads(asyncio.run(tools.read_range.ainvoke(args, config=config)))
+
+    assert read_range(file_path="/data.txt", start=4, length=100) == {
+        "path": "data.txt", "size": 16, "start": 4, "end": 12, "truncated": True, "content": "456789ab",
+    }
+    assert read_range(file_path="data.txt", start=12)["content"] == "cdef"
+    assert "outside the workspace" in read_range(file_path="../data.txt")["error"]
@@ -0,0 +1,12 @@
+from server.core.llm.registry import get_chat_model, get_http_client
+
+
+def test_models_are_reused_per_key_and_share_one_pool():
+    a = get_chat_model("m", base_url="http://localhost:1/v1", api_key="k", temperature=0.6)
+    b = get_chat_model("m", base_url="http://localhost:1/v1", api_key="k", temperature=0.6)
+    c = get_chat_model("m", base_url="http://localhost:1/v1", api_key="k", temperature=0.1)
+
+    assert a is b
+    assert a is not c
+    assert a.http_async_client is get_http_client()
+    assert c.http_async_client is get_http_client()
@@ -0,0 +1,103 @@
+import asyncio
+import json
+
+import httpx
+from langchain_core.messages import HumanMessage
+
+import server.core.llm.adapters as adapters
+from server.core.llm.adapters import ChatDeepSeekCompatible
+from server.core.llm.scheduler import LLMScheduler
+
+
+def test_sessions_are_served_round_robin_and_positions_reported():
+    scheduler = LLMScheduler(max_concurrency=1)
+    order = []
+    positions = {}
+
+    async def job(session_id, name):
+        async def report(position):
+            positions.setdefault(name, []).append(position)
+        async with scheduler.slot(session_id, on_queue=report):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        # Session "a" floods the queue before "b" and "c" arrive
+        tasks = [asyncio.create_task(job("a", f"a{i}")) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(job("b", "b0")), asyncio.create_task(job("c", "c0"))]
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    assert order == ["a0", "a1", "b0", "c0", "a2"]
+    assert positions["c0"][0] == 3 and positions["c0"][-1] == 1
+    assert scheduler.running == 0 and scheduler.waiting() == 0
+
+
+def test_interactive_lane_goes_first_without_starving_background():
+    scheduler = LLMScheduler(max_concurrency=1, background_share=2)
+    order = []
+
+    async def job(name, lane):
+        async with scheduler.slot(name, lane=lane):
+            order.append(name)
+            await asyncio.sleep(0.005)
+
+    async def scenario():
+        blocker = asyncio.create_task(job("first", "interactive"))
+        await asyncio.sleep(0)
+        jobs = [job(f"bg{i}", "background") for i in range(2)] + [job(f"i{i}", "interactive") for i in range(4)]
+        await asyncio.gather(blocker, *jobs)
+
+    asyncio.run(scenario())
+    assert order == ["first", "i0", "bg0", "i1", "i2", "bg1", "i3"]
+
+
+def test_token_budget_holds_calls_until_refilled():
+    # 6000 tokens per minute refill at 100 per second
+    scheduler = LLMScheduler(tokens_per_minute=6000)
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        async with scheduler.slot("a", tokens=6000) as grant:
+            grant.used = 6000
+        start = loop.time()
+        async with scheduler.slot("b", tokens=20):
+            pass
+        return loop.time() - start
+
+    waited = asyncio.run(scenario())
+    assert 0.15 <= waited < 1
+
+
+def _sse(*chunks):
+    body = "".join(f"data: {json.dumps(c)}\n\n" for c in chunks) + "data: [DONE]\n\n"
+    return body.encode()
+
+
+def test_rate_limited_stream_pauses_and_retries(monkeypatch):
+    scheduler = LLMScheduler(max_retries=2)
+    monkeypatch.setattr(adapters, "LLM_SCHEDULER", scheduler)
+    calls = []
+
+    def handler(request):
+        calls.append(asyncio.get_event_loop().time())
+        if len(calls) == 1:
+            return httpx.Response(429, headers={"retry-after-ms": "200"}, json={"error": {"message": "slow down"}})
+        chunk = {"id": "x", "object": "chat.completion.chunk", "created": 0, "model": "m",
+                 "choices": [{"index": 0, "delta": {"content": "hello"}, "finish_reason": None}]}
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=_sse(chunk))
+
+    async def scenario():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        model = ChatDeepSeekCompatible(
+            model="m", api_key="k", base_url="http://llm.test/v1", streaming=True,
+            max_retries=0, http_async_client=client,
+        )
+        text = "".join([c.content async for c in model.astream([HumanMessage(content="hi")])])
+        await client.aclose()
+        return text
+
+    assert asyncio.run(scenario()) == "hello"
+    assert len(calls) == 2 and calls[1] - calls[0] >= 0.2
+    assert scheduler.stats["rate_limited"] == 1 and scheduler.running == 0
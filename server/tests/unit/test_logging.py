@@ -0,0 +1,70 @@
+import json
+import queue
+import logging
+
+import server.chat.service as service
+
+from server.core.log import LOG_RECORDS_DROPPED, DebugSampler, ModuleLevelFilter, NonBlockingQueueHandler, configure_logging, module_name, parse_levels, shutdown_logging
+
+
+def record(level, pathname="/x/server/chat/service.py", lineno=1, name="root"):
+    return logging.LogRecord(name, level, pathname, lineno, "hello %s", ("world",), None)
+
+
+def test_per_module_levels_use_the_most_specific_prefix():
+    levels = parse_levels("server=WARNING, server.chat=DEBUG, httpx=ERROR, bogus=LOUD")
+    assert "bogus" not in levels
+    flt = ModuleLevelFilter(logging.INFO, levels)
+    assert flt.level_for("server.chat.service") == logging.DEBUG
+    assert flt.level_for("server.agent.factory") == logging.WARNING
+    assert flt.level_for("httpx") == logging.ERROR
+    assert flt.level_for("uvicorn") == logging.INFO
+
+
+def test_debug_records_are_rate_limited_per_call_site():
+    sampler = DebugSampler(per_second=2)
+    passed = [sampler.filter(record(logging.DEBUG, lineno=10)) for _ in range(5)]
+    assert passed == [True, True, False, False, False]
+    # Other call sites and INFO records are unaffected
+    assert sampler.filter(record(logging.DEBUG, lineno=11))
+    assert all(sampler.filter(record(logging.INFO, lineno=10)) for _ in range(5))
+
+
+def test_records_are_written_as_json_lines_off_thread(tmp_path):
+    log_file = tmp_path / "server.log"
+    root = logging.getLogger()
+    previous = root.level
+    try:
+        configure_logging(level="INFO", levels="tests=DEBUG", log_file=str(log_file), console="off")
+        logging.getLogger("tests.unit").debug("turn %s", "t1", extra={"session_id": "s1"})
+        logging.getLogger("other").debug("hidden")
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logging.getLogger("tests.unit").exception("failed")
+    finally:
+        shutdown_logging()
+        root.setLevel(previous)
+
+    lines = [json.loads(line) for line in log_file.read_text().splitlines()]
+    assert [l["msg"] for l in lines] == ["turn t1", "failed"]
+    assert lines[0]["module"] == "tests.unit" and lines[0]["session_id"] == "s1"
+    assert "ValueError: boom" in lines[1]["exc"]
+    assert module_name(record(logging.INFO, pathname=service.__file__)) == "server.chat.service"
+    assert module_name(record(logging.INFO, pathname="/elsewhere/tool.py")) == "tool"
+
+
+def test_records_dropped_on_a_full_queue_are_counted_and_reported():
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=1))
+    before = LOG_RECORDS_DROPPED._default().value
+    for _ in range(3):
+        handler.emit(record(logging.INFO))
+
+    assert handler.dropped == 2
+    assert LOG_RECORDS_DROPPED._default().value - before == 2
+    # Room for the notice only, so the record that follows it is counted in turn
+    handler.queue.get_nowait()
+    handler.emit(record(logging.INFO))
+    notice = handler.queue.get_nowait()
+    assert notice.levelno == logging.WARNING and "Dropped 2 log records" in notice.getMessage()
+    assert handler.dropped == 3
@@ -0,0 +1,36 @@
+from server.core.metrics import MetricsRegistry
+
+
+def test_histogram_buckets_are_cumulative_and_inclusive():
+    registry = MetricsRegistry()
+    latency = registry.histogram("tool_seconds", "Tool time.", ["tool"], buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.labels(tool="ls").observe(value)
+
+    text = registry.render()
+    assert '# TYPE tool_seconds histogram' in text
+    assert 'tool_seconds_bucket{tool="ls",le="0.1"} 2' in text
+    assert 'tool_seconds_bucket{tool="ls",le="1"} 3' in text
+    assert 'tool_seconds_bucket{tool="ls",le="+Inf"} 4' in text
+    assert 'tool_seconds_count{tool="ls"} 4' in text
+    assert 'tool_seconds_sum{tool="ls"} 3.65' in text
+
+
+def test_counters_and_collected_gauges():
+    registry = MetricsRegistry()
+    errors = registry.counter("errors_total", "Errors.", ["kind"])
+    errors.labels("rate_limited").inc()
+    errors.labels("rate_limited").inc(2)
+    queue = {"n": 3}
+    registry.gauge("depth", "Depth.", collect=lambda: queue["n"])
+    registry.gauge("sessions", "Sessions.", ["state"], collect=lambda: {("live",): 2, ("pinned",): 1})
+
+    text = registry.render()
+    assert 'errors_total{kind="rate_limited"} 3' in text
+    assert "depth 3" in text
+    assert 'sessions{state="live"} 2' in text and 'sessions{state="pinned"} 1' in text
+
+    queue["n"] = 0
+    assert "depth 0" in registry.render()
+    # Registering the same name again returns the existing metric
+    assert registry.counter("errors_total", "Errors.", ["kind"]) is errors
@@ -0,0 +1,117 @@
+import asyncio
+import json
+
+import pytest
+
+import server.chat.openai_compat as compat
+from server.chat.events import StreamEvent
+
+
+def fake_stream(events, calls):
+    async def stream_conversation(prompt, session_id=None, seed_history=None, ticket=None):
+        calls.append((prompt, session_id, seed_history))
+        for event in events:
+            yield event
+    return stream_conversation
+
+
+REQUEST = {
+    "model": "deep-agent",
+    "user": "s1",
+    "messages": [
+        {"role": "system", "content": "ignored"},
+        {"role": "user", "content": "hi"},
+        {"role": "assistant", "content": "hello"},
+        {"role": "user", "content": [{"type": "text", "text": "make a "}, {"type": "text", "text": "clock"}]},
+    ],
+}
+
+
+def test_stream_emits_openai_chunks(monkeypatch):
+    calls = []
+    monkeypatch.setattr(compat, "stream_conversation", fake_stream([
+        StreamEvent("reasoning", "think"),
+        StreamEvent("chunk", "Hel"), StreamEvent("chunk", "lo"),
+        StreamEvent("usage", {"prompt_tokens": 5, "completion_tokens": 2, "total_tokens": 7}),
+        StreamEvent("done", "[DONE]"),
+    ], calls))
+
+    async def collect():
+        req = dict(REQUEST, stream=True, stream_options={"include_usage": True})
+        return [f async for f in compat.stream_openai_conversation(req)]
+    frames = asyncio.run(collect())
+
+    assert calls == [("make a clock", "s1", [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}])]
+    assert frames[-1] == b"data: [DONE]\n\n"
+    chunks = [json.loads(f[len(b"data: "):]) for f in frames[:-1]]
+    assert all(c["object"] == "chat.completion.chunk" and c["id"] == chunks[0]["id"] for c in chunks)
+    assert chunks[0]["choices"][0]["delta"]["role"] == "assistant"
+    assert chunks[1]["choices"][0]["delta"] == {"reasoning_content": "think"}
+    assert "".join(c["choices"][0]["delta"].get("content", "") for c in chunks if c["choices"]) == "Hello"
+    assert chunks[-2]["choices"][0]["finish_reason"] == "stop"
+    assert chunks[-1]["choices"] == [] and chunks[-1]["usage"]["total_tokens"] == 7
+    assert chunks[-1]["usage"]["prompt_tokens_details"] == {"cached_tokens": 0}
+
+
+def test_complete_aggregates_and_raises_on_error(monkeypatch):
+    monkeypatch.setattr(compat, "stream_conversation", fake_stream([
+        StreamEvent("reasoning", "a"), StreamEvent("chunk", "Hel"), StreamEvent("chunk", "lo"),
+        StreamEvent("usage", {"prompt_tokens": 5, "completion_tokens": 2, "total_tokens": 7}),
+    ], []))
+    completion = asyncio.run(compat.complete_openai_conversation(REQUEST))
+    assert completion["object"] == "chat.completion"
+    assert completion["choices"][0]["message"] == {"role": "assistant", "content": "Hello", "reasoning_content": "a"}
+    assert completion["usage"]["prompt_tokens"] == 5
+
+    monkeypatch.setattr(compat, "stream_conversation", fake_stream([StreamEvent("error", "boom")], []))
+    with pytest.raises(compat.CompletionError):
+        asyncio.run(compat.complete_openai_conversation(REQUEST))
+
+
+def collect_stream(req):
+    async def collect():
+        return [f async for f in compat.stream_openai_conversation(req)]
+    return [json.loads(f[len(b"data: "):]) for f in asyncio.run(collect())[:-1]]
+
+
+def test_stream_skips_tool_hints_and_reports_cancelled_runs(monkeypatch):
+    monkeypatch.setattr(compat, "stream_conversation", fake_stream([
+        StreamEvent("chunk", "Hi"),
+        StreamEvent("chunk", "> 🛠️  Running build_widget", flush=True, hint=True),
+        StreamEvent("cancelled", "superseded"),
+        StreamEvent("done", "[DONE]"),
+    ], []))
+    chunks = collect_stream(REQUEST)
+
+    assert "".join(c["choices"][0]["delta"].get("content", "") for c in chunks if c.get("choices")) == "Hi"
+    assert chunks[-1] == {"error": {"message": "Run superseded.", "type": "cancelled"}}
+    assert not any(c["choices"][0]["finish_reason"] for c in chunks if c.get("choices"))
+
+
+def test_requests_without_user_run_in_a_discarded_session(monkeypatch):
+    calls, discarded = [], []
+
+    async def discard_session(session_id):
+        discarded.append(session_id)
+
+    monkeypatch.setattr(compat, "stream_conversation", fake_stream([StreamEvent("chunk", "ok")], calls))
+    monkeypatch.setattr(compat, "discard_session", discard_session)
+    req = {k: v for k, v in REQUEST.items() if k != "user"}
+
+    asyncio.run(compat.complete_openai_conversation(req))
+    collect_stream(req)
+    asyncio.run(compat.complete_openai_conversation(REQUEST))
+
+    assert [c[1] for c in calls[:2]] == discarded
+    assert all(sid.startswith(compat.EPHEMERAL_PREFIX) for sid in discarded) and len(set(discarded)) == 2
+
+
+@pytest.mark.parametrize("req", [
+    dict(REQUEST, user="../escape"),
+    dict(REQUEST, user="a.b"),
+    dict(REQUEST, messages=[{"role": "system", "content": "only a system prompt"}]),
+    dict(REQUEST, messages=[]),
+])
+def test_validate_request_rejects_unusable_requests(req):
+    with pytest.raises(compat.RequestError):
+        compat.validate_request(req)
@@ -0,0 +1,119 @@
+import asyncio
+import os
+import stat
+
+import pytest
+
+import server.bundle.esbuild as esbuild
+from server.chat.coalesce import coalesce_events
+from server.chat.events import StreamEvent
+from server.session.runs import RunCoordinator, RunRejected
+
+
+def test_queue_policy_serializes_runs():
+    coordinator = RunCoordinator(policy="queue")
+    order = []
+
+    async def run(name):
+        async with coordinator.acquire(coordinator.ticket("s1")):
+            order.append(f"{name} start")
+            await asyncio.sleep(0.01)
+            order.append(f"{name} end")
+
+    async def scenario():
+        await asyncio.gather(run("a"), run("b"))
+
+    asyncio.run(scenario())
+    assert order == ["a start", "a end", "b start", "b end"]
+
+
+def test_reject_policy_and_queue_limit():
+    coordinator = RunCoordinator(policy="queue", queue_limit=0)
+
+    async def scenario():
+        async with coordinator.acquire(coordinator.ticket("s1")):
+            with pytest.raises(RunRejected):
+                async with coordinator.acquire(coordinator.ticket("s1", "reject")):
+                    pass
+            with pytest.raises(RunRejected):
+                async with coordinator.acquire(coordinator.ticket("s1")):
+                    pass
+            # Other sessions are unaffected
+            async with coordinator.acquire(coordinator.ticket("s2", "reject")):
+                pass
+
+    asyncio.run(scenario())
+
+
+def test_supersede_cancels_the_active_run():
+    coordinator = RunCoordinator()
+    first = coordinator.ticket("s1")
+
+    async def long_run():
+        async with coordinator.acquire(first):
+            await asyncio.sleep(10)
+
+    async def scenario():
+        task = asyncio.create_task(long_run())
+        await asyncio.sleep(0)
+        async with coordinator.acquire(coordinator.ticket("s1", "supersede")) as ticket:
+            assert coordinator.active("s1") is ticket
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert first.cancel_reason == "superseded"
+
+
+def test_cancelling_a_ticket_stops_the_upstream_stream():
+    coordinator = RunCoordinator()
+    ticket = coordinator.ticket("s1")
+    finished = []
+
+    async def run():
+        # Mirrors ConversationFlow.run: own cancellations end the stream with a "cancelled" event
+        try:
+            async with coordinator.acquire(ticket):
+                try:
+                    for i in range(1000):
+                        yield StreamEvent("chunk", str(i))
+                        await asyncio.sleep(0.01)
+                finally:
+                    finished.append(True)
+        except asyncio.CancelledError:
+            asyncio.current_task().uncancel()
+            yield StreamEvent("cancelled", ticket.cancel_reason)
+
+    async def scenario():
+        events = []
+        async for event in coalesce_events(run(), latency_ms=5):
+            events.append(event)
+            if len(events) == 2:
+                ticket.cancel("disconnected")
+        return events
+
+    events = asyncio.run(scenario())
+    assert finished == [True]
+    assert events[-1].type == "cancelled" and events[-1].payload == "disconnected"
+    assert len(events) < 10
+
+
+def test_cancelled_cli_build_kills_the_process(tmp_path, monkeypatch):
+    script = tmp_path / "slow-esbuild"
+    pid_file = tmp_path / "pid"
+    script.write_text(f"#!/bin/sh\necho $$ > {pid_file}\nexec sleep 30\n")
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(esbuild, "ESBUILD_PATH", str(script))
+
+    async def scenario():
+        task = asyncio.create_task(esbuild.run_esbuild(tmp_path))
+        while not pid_file.exists() or not pid_file.read_text().strip():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return int(pid_file.read_text())
+
+    pid = asyncio.run(scenario())
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
@@ -0,0 +1,74 @@
+import asyncio
+import os
+
+from server.agent.factory import SafeFilesystemBackend
+from server.session.pool import SessionPool
+
+
+def test_claim_moves_a_prewarmed_workspace_and_refills(tmp_path):
+    template = tmp_path / "starter"
+    template.mkdir()
+    (template / "widget.jsx").write_text("export default () => null;\n")
+    pool = SessionPool(workspaces_dir=str(tmp_path / "workspaces"), size=2, template_dir=str(template))
+
+    async def scenario():
+        await pool.start()
+        assert len(pool) == 2
+        entry = await pool.claim("abc")
+        # The refill runs in the background
+        for _ in range(100):
+            if len(pool) == 2:
+                break
+            await asyncio.sleep(0.01)
+        refilled = len(pool)
+        await pool.close()
+        return entry, refilled
+
+    entry, refilled = asyncio.run(scenario())
+    workspace = entry["workspace_path"]
+    assert workspace == tmp_path / "workspaces" / "session_abc"
+    assert (workspace / "index.html").exists()
+    assert (workspace / "widget.jsx").read_text() == "export default () => null;\n"
+    # Hardlinked to the template, not copied
+    assert os.stat(workspace / "widget.jsx").st_ino == os.stat(pool.template / "widget.jsx").st_ino
+    assert entry["event_bus"] is not None
+    assert refilled == 2
+
+
+def test_claim_misses_when_empty_or_taken(tmp_path):
+    pool = SessionPool(workspaces_dir=str(tmp_path), size=1)
+    assert asyncio.run(pool.claim("abc")) is None
+
+    async def scenario():
+        await pool.start()
+        (tmp_path / "session_taken").mkdir()
+        missed = await pool.claim("taken")
+        await pool.close()
+        return missed
+
+    assert asyncio.run(scenario()) is None
+    assert len(pool) == 1
+
+
+def test_writes_do_not_reach_the_template(tmp_path):
+    template = tmp_path / "starter"
+    template.mkdir()
+    (template / "widget.jsx").write_text("const a = 1;\n")
+    pool = SessionPool(workspaces_dir=str(tmp_path / "workspaces"), size=2, template_dir=str(template))
+
+    async def scenario():
+        await pool.start()
+        first, second = await pool.claim("one"), await pool.claim("two")
+        await pool.close()
+        return first["workspace_path"], second["workspace_path"]
+
+    first, second = asyncio.run(scenario())
+    backend = SafeFilesystemBackend(root_dir=first)
+    backend.edit("widget.jsx", "a = 1", "a = 2")
+    backend.write("index.html", "<html></html>")
+
+    assert (first / "widget.jsx").read_text() == "const a = 2;\n"
+    assert (first / "index.html").read_text() == "<html></html>"
+    assert (second / "widget.jsx").read_text() == "const a = 1;\n"
+    assert (pool.template / "widget.jsx").read_text() == "const a = 1;\n"
+    assert (pool.template / "index.html").read_text() != "<html></html>"
@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+from server.session.store import SessionStore
+
+
+def make_entry(history=None):
+    return {"history": history or [], "workspace_path": "/tmp/ws", "event_queue": None}
+
+
+def test_lru_eviction_hibernates_oldest(tmp_path):
+    store = SessionStore(hibernate_dir=str(tmp_path), max_sessions=2, idle_seconds=3600)
+    store["a"] = make_entry([{"role": "user", "content": "hello"}])
+    store["b"] = make_entry()
+    store.get("a")  # "b" is now least recently used
+    store["c"] = make_entry()
+
+    assert store.peek("b") is None
+    assert store.peek("a") is not None
+    assert store._hibernate_path("b").exists()  # Still known, just hibernated
+
+
+def test_rehydrate_restores_history(tmp_path):
+    store = SessionStore(hibernate_dir=str(tmp_path), max_sessions=4, idle_seconds=3600)
+    store["a"] = make_entry([{"role": "user", "content": "hello"}])
+    assert store.hibernate("a")
+
+    assert store.load_history("a") == [{"role": "user", "content": "hello"}]
+    assert store.peek("a") is None  # load_history does not rehydrate
+
+    entry = store["a"]
+    assert entry["history"] == [{"role": "user", "content": "hello"}]
+    assert str(entry["workspace_path"]) == "/tmp/ws"
+
+
+def test_memory_cap_and_pinning(tmp_path):
+    store = SessionStore(hibernate_dir=str(tmp_path), max_sessions=10, max_bytes=500, idle_seconds=3600)
+    store["a"] = make_entry([{"role": "user", "content": "x" * 300}])
+    store.pin("a")
+    store["b"] = make_entry([{"role": "user", "content": "y" * 300}])
+    store["c"] = make_entry()
+
+    # "a" is pinned, so the least recently used unpinned session goes instead
+    assert store.peek("a") is not None
+    assert store.peek("b") is None
+
+
+def test_sweep_hibernates_idle_sessions(tmp_path):
+    store = SessionStore(hibernate_dir=str(tmp_path), idle_seconds=10)
+    store["a"] = make_entry()
+    store["b"] = make_entry()
+    store.pin("b")
+
+    assert store.sweep(now=time.monotonic() + 60) == 1
+    assert store.peek("a") is None
+    assert store.peek("b") is not None
+
+
+def test_similar_ids_do_not_share_a_file(tmp_path):
+    store = SessionStore(hibernate_dir=str(tmp_path), idle_seconds=3600)
+    for sid in ("a.b", "ab", "alice@x.com", "alicex.com"):
+        store[sid] = make_entry([{"role": "user", "content": sid}])
+        assert store.hibernate(sid)
+
+    assert len(list(tmp_path.glob("session_*.json"))) == 4
+    assert store.load_history("a.b") == [{"role": "user", "content": "a.b"}]
+    assert store.load_history("alicex.com") == [{"role": "user", "content": "alicex.com"}]
+
+
+def test_files_of_other_sessions_are_not_loaded(tmp_path):
+    store = SessionStore(hibernate_dir=str(tmp_path), idle_seconds=3600)
+    store["a"] = make_entry([{"role": "user", "content": "secret"}])
+    store.hibernate("a")
+    store._hibernate_path("a").rename(store._hibernate_path("b"))
+
+    assert store.get("b") is None
+    assert store.load_history("b") == []
+
+
+def test_hibernation_on_the_loop_writes_in_the_background(tmp_path):
+    store = SessionStore(hibernate_dir=str(tmp_path), max_sessions=1, idle_seconds=3600)
+
+    async def scenario():
+        store["a"] = make_entry([{"role": "user", "content": "hello"}])
+        store["b"] = make_entry()  # Evicts "a"; its file is written off the loop
+        assert store.peek("a") is None
+        revived = await store.aget("a")  # Served from memory while the write is pending
+        assert revived["history"] == [{"role": "user", "content": "hello"}]
+        await store.flush()
+        assert store._hibernate_path("b").exists()
+
+        await store.discard("b")
+        assert store.peek("b") is None and not store._hibernate_path("b").exists()
+        assert await store.aload_history("a") == [{"role": "user", "content": "hello"}]
+
+    asyncio.run(scenario())
@@ -0,0 +1,123 @@
+import os
+import asyncio
+import threading
+
+from langchain.agents.middleware.types import ModelRequest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+import server.agent.skills as skills
+from server.agent.middleware import SkillsMiddleware
+from server.agent.skills import SkillRegistry
+
+
+def write_skill(root, name, body):
+    skill_dir = root / name
+    skill_dir.mkdir(parents=True, exist_ok=True)
+    path = skill_dir / "SKILL.md"
+    path.write_text(f"---\nname: {name}\ndescription: {name} skill\n---\n{body}\n")
+    return path
+
+
+def test_parses_once_and_reloads_on_change(tmp_path, monkeypatch):
+    path = write_skill(tmp_path, "alpha", "Do alpha things.")
+    parses = []
+    real = skills.load_skill_from_path
+    monkeypatch.setattr(skills, "load_skill_from_path", lambda *a: parses.append(a[0]) or real(*a))
+    registry = SkillRegistry(reload_seconds=0)
+
+    first = registry.instructions(str(tmp_path))
+    assert "### alpha" in first and "Do alpha things." in first
+    assert registry.instructions(str(tmp_path)) is first
+    assert len(parses) == 1
+
+    path.write_text(path.read_text().replace("alpha things", "alpha things, revised"))
+    os.utime(path, ns=(1, 1))
+    write_skill(tmp_path, "beta", "Do beta things.")
+    updated = registry.instructions(str(tmp_path))
+    assert "revised" in updated and "### beta" in updated
+    assert len(parses) == 3
+
+    (tmp_path / "beta" / "SKILL.md").unlink()
+    assert "### beta" not in registry.instructions(str(tmp_path))
+    assert len(parses) == 3
+
+
+def test_rescans_are_throttled(tmp_path):
+    registry = SkillRegistry(reload_seconds=3600)
+    assert registry.instructions(str(tmp_path)) == ""
+    write_skill(tmp_path, "alpha", "Do alpha things.")
+    assert registry.instructions(str(tmp_path)) == ""
+    registry.invalidate()
+    assert "### alpha" in registry.instructions(str(tmp_path))
+
+
+def test_async_refresh_scans_on_the_io_pool(tmp_path, monkeypatch):
+    write_skill(tmp_path, "alpha", "Do alpha things.")
+    registry = SkillRegistry(reload_seconds=3600)
+    threads = []
+    real = SkillRegistry._scan
+    monkeypatch.setattr(SkillRegistry, "_scan", staticmethod(lambda p: threads.append(threading.current_thread().name) or real(p)))
+
+    async def scenario():
+        await registry.arefresh(str(tmp_path))
+        await registry.arefresh(str(tmp_path))  # Still fresh, nothing to scan
+        return registry.instructions(str(tmp_path))
+
+    assert "### alpha" in asyncio.run(scenario())
+    assert len(threads) == 1 and threads[0].startswith("io")
+
+
+def test_selects_top_k_relevant_skills_and_a_catalog(tmp_path):
+    write_skill(tmp_path, "weather-widget", "Fetch forecasts and render temperature charts.")
+    write_skill(tmp_path, "clock-widget", "Render analog and digital clocks with time zones.")
+    write_skill(tmp_path, "todo-list", "Persist tasks and checkboxes in local storage.")
+    registry = SkillRegistry(reload_seconds=0)
+
+    catalog = registry.catalog(str(tmp_path), top_k=1)
+    assert "- weather-widget: weather-widget skill" in catalog and "- clock-widget" in catalog
+    assert "analog and digital" not in catalog
+
+    relevant = registry.select(str(tmp_path), "build me a clock showing the time in Tokyo", top_k=1)
+    assert "### clock-widget" in relevant and "analog and digital" in relevant
+    assert "weather" not in relevant
+
+    # Everything fits: the catalog holds every skill in full and nothing varies per turn
+    assert registry.catalog(str(tmp_path), top_k=3) == registry.instructions(str(tmp_path))
+    assert registry.select(str(tmp_path), "clock", top_k=3) == ""
+
+
+def test_middleware_keeps_previous_turns_a_stable_prefix(tmp_path):
+    write_skill(tmp_path, "weather-widget", "Fetch forecasts and render temperature charts.")
+    write_skill(tmp_path, "clock-widget", "Render analog and digital clocks with time zones.")
+    middleware = SkillsMiddleware(str(tmp_path), top_k=1)
+    system = SystemMessage(content="You are helpful.")
+    thread = []
+
+    def turn(user_text, reply):
+        # The agent loop: the user message lands in state, before_model runs, then the model call
+        thread.append(HumanMessage(content=user_text))
+        for _ in range(2):
+            update = middleware.before_model({"messages": thread}, None)
+            thread.extend(update["messages"] if update else [])
+        request = middleware.apply(ModelRequest(model=None, messages=list(thread), system_message=system))
+        thread.append(AIMessage(content=reply))
+        return [("system", request.system_message.content)] + [(m.type, m.content) for m in request.messages]
+
+    turn1 = turn("what's the weather", "Sunny.")
+    turn2 = turn("add a clock", "Done.")
+
+    assert turn1[0][1].startswith("You are helpful.") and "## SKILL CATALOG" in turn1[0][1]
+    # Everything sent on the first turn is sent again, unchanged, ahead of the second
+    assert turn2[:len(turn1)] == turn1
+    assert turn1[1] == ("human", "what's the weather") and "### weather-widget" in turn1[2][1]
+    assert turn2[len(turn1)] == ("ai", "Sunny.")
+    assert turn2[-2] == ("human", "add a clock") and "### clock-widget" in turn2[-1][1]
+    # Selected once per turn, even with several model calls
+    assert sum(1 for kind, _ in turn2 if kind == "system") == 3
+
+
+def test_load_skill_tool_expands_catalog_entries(tmp_path):
+    write_skill(tmp_path, "alpha", "Do alpha things.")
+    load_skill = SkillsMiddleware(str(tmp_path)).tools[0]
+    assert "Do alpha things." in load_skill.invoke({"name": "alpha"})
+    assert "Available skills: alpha" in load_skill.invoke({"name": "nope"})
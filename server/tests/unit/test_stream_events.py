@@ -0,0 +1,17 @@
+import json
+
+from server.chat.events import StreamEvent, sse_frame
+
+
+def test_sse_frame_round_trips_through_json():
+    for payload in ["tok", 'quote " and\nnewline ✨', {"id": 1, "url": None}, ["a", 1]]:
+        frame = StreamEvent("chunk", payload).to_sse()
+        assert frame.startswith(b"data: ") and frame.endswith(b"\n\n")
+        assert json.loads(frame[len(b"data: "):]) == {"type": "chunk", "payload": payload}
+
+
+def test_sse_frame_with_event_id():
+    frame = sse_frame("preview", {"id": "w"}, 42)
+    head, data = frame.split(b"\n", 1)
+    assert head == b"id: 42"
+    assert json.loads(data[len(b"data: "):]) == {"type": "preview", "payload": {"id": "w"}}
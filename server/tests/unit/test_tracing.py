@@ -0,0 +1,74 @@
+import asyncio
+import os
+import time
+
+from server.core.tracing import Trace, TraceStore, span
+
+
+def ev(kind, run_id, name, *parents):
+    return {"event": kind, "run_id": run_id, "name": name, "parent_ids": list(parents)}
+
+
+def test_events_become_a_span_tree_with_parallel_tools_on_separate_threads():
+    trace = Trace("s1", turn="t1")
+    store = TraceStore()
+    trace.record(ev("on_chain_start", "root", "LangGraph"))
+    trace.record(ev("on_chat_model_start", "m1", "model", "root"))
+    trace.record(ev("on_chat_model_stream", "m1", "model", "root"))
+    trace.record(ev("on_chat_model_end", "m1", "model", "root"))
+    trace.record(ev("on_tool_start", "a", "write_file", "root"))
+    trace.record(ev("on_tool_start", "b", "bundle_project", "root"))
+    with store.activate(trace):
+        # Spans opened by server code nest under the innermost open span
+        with span("esbuild.build", cat="bundle"):
+            pass
+    trace.record(ev("on_tool_end", "a", "write_file", "root"))
+    trace.record({"event": "on_custom_event", "name": "llm_queue", "run_id": "x", "data": {"position": 2}})
+
+    events = {e["name"]: e for e in trace.chrome_events()}
+    assert events["model"]["tid"] == events["LangGraph"]["tid"] == events["write_file"]["tid"]
+    assert events["bundle_project"]["tid"] != events["write_file"]["tid"]
+    assert "first_token_ms" in events["model"]["args"]
+    # Still open when exported
+    assert events["bundle_project"]["args"]["unfinished"] is True
+    assert events["llm_queue"]["ph"] == "i" and events["llm_queue"]["args"]["position"] == 2
+    assert all(e["args"]["turn"] == "t1" for e in events.values())
+
+
+def test_sampling_keeps_failures_and_reads_back_recent_turns(tmp_path):
+    store = TraceStore(trace_dir=str(tmp_path), sample_rate=0.0, slow_seconds=0)
+
+    async def scenario():
+        for turn, status in (("t1", "error"), ("t2", "ok"), ("t3", "cancelled")):
+            trace = Trace("s/1", turn=turn)
+            trace.record(ev("on_chain_start", "root", "LangGraph"))
+            trace.record(ev("on_chain_end", "root", "LangGraph"))
+            store.submit(trace, status)
+        await store.flush()
+
+    asyncio.run(scenario())
+    assert [e["args"]["turn"] for e in store.read("s/1")] == ["t1", "t3"]
+    assert [e["args"]["turn"] for e in store.read("s/1", turns=1)] == ["t3"]
+    assert store.read("missing") == []
+
+
+def test_similar_session_ids_get_separate_files(tmp_path):
+    store = TraceStore(trace_dir=str(tmp_path))
+    assert store.path_for("a.b") != store.path_for("a_b")
+    assert store.path_for("a.b") == store.path_for("a.b")
+
+
+def test_prune_applies_age_and_count_limits_across_sessions(tmp_path):
+    store = TraceStore(trace_dir=str(tmp_path), max_files=2, retention_days=1)
+    now = time.time()
+    for i, sid in enumerate(("old", "s1", "s2", "s3")):
+        path = store.path_for(sid)
+        path.write_text("{}\n")
+        path.with_suffix(".jsonl.1").write_text("{}\n")
+        age = 2 * 86400 if sid == "old" else 60 * (4 - i)
+        os.utime(path, (now - age, now - age))
+
+    assert store.prune(now) == 2
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(
+        n for sid in ("s2", "s3") for n in (store.path_for(sid).name, store.path_for(sid).name + ".1")
+    )